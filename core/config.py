@@ -7,6 +7,13 @@ and a dumper using an OrderedDict instead of the regular dict used by PyYAML.
 Additionally, it fixes a bug in PyYAML with scientific notation and allows
 to dump numpy dtypes and numpy ndarrays.
 
+Numpy arrays of at least NPY_THRESHOLD bytes are stored in uncompressed .npy
+files next to the config file and only the file path is kept in the YAML
+document. These files are memory-mapped on load, so the data is only read from
+disk when it is accessed. Since a file may still be mapped while the config is
+saved again, every save writes new versioned .npy files and removes the stale
+ones it can.
+
 The fix of the scientific notation is applied globally at module import.
 
 The idea of the implementation of the OrderedDict was taken from
@@ -35,9 +42,15 @@ from collections import OrderedDict
 import numpy
 import re
 import os
+import logging
 import ruamel.yaml as yaml
 from io import BytesIO
 
+logger = logging.getLogger(__name__)
+
+# Size in bytes above which numpy arrays are stored in memory-mapped .npy files
+NPY_THRESHOLD = 2 ** 20
+
 
 def ordered_load(stream, Loader=yaml.Loader):
     """
@@ -80,6 +93,14 @@ def ordered_load(stream, Loader=yaml.Loader):
         arrays = numpy.load(filename)
         return arrays['array']
 
+    def construct_npy_ndarray(loader, node):
+        """
+        The constructor for a numpy array that is saved in an external .npy file.
+        The file is memory-mapped copy-on-write, so changes to the array are never written back.
+        """
+        filename = loader.construct_yaml_str(node)
+        return numpy.load(filename, mmap_mode='c')
+
     def construct_frozenset(loader, node):
         """
         The frozenset constructor.
@@ -120,6 +141,9 @@ def ordered_load(stream, Loader=yaml.Loader):
     OrderedLoader.add_constructor(
             '!extndarray',
             construct_external_ndarray)
+    OrderedLoader.add_constructor(
+            '!npyndarray',
+            construct_npy_ndarray)
     OrderedLoader.add_constructor(
         '!frozenset',
         construct_frozenset)
@@ -136,19 +160,21 @@ def ordered_load(stream, Loader=yaml.Loader):
         return OrderedDict()
 
 
-def ordered_dump(data, stream=None, Dumper=yaml.Dumper, **kwds):
+def ordered_dump(data, stream=None, Dumper=yaml.Dumper, npy_threshold=NPY_THRESHOLD, **kwds):
     """
     dumps (OrderedDict) data in YAML format
 
     @param OrderedDict data: the data
     @param Stream stream: where the data in YAML is dumped
     @param Dumper Dumper: The dumper that is used as a base class
+    @param int npy_threshold: size in bytes above which numpy arrays are saved to .npy files
     """
     class OrderedDumper(Dumper):
         """
         A Dumper using an OrderedDict
         """
         external_ndarray_counter = 0
+        npy_files = set()
 
         def ignore_aliases(self, ignore_data):
             """
@@ -188,24 +214,69 @@ def ordered_dump(data, stream=None, Dumper=yaml.Dumper, **kwds):
         """
         Representer for numpy ndarrays
         """
-        try:
-            filename = os.path.splitext(os.path.basename(stream.name))[0]
-            configdir = os.path.dirname(stream.name)
-            newpath = '{0}-{1:06}.npz'.format(
-                os.path.join(configdir, filename),
-                dumper.external_ndarray_counter)
-            numpy.savez_compressed(newpath, array=array_data)
-            node = dumper.represent_str(newpath)
-            node.tag = '!extndarray'
-            dumper.external_ndarray_counter += 1
-        except:
-            with BytesIO() as f:
-                numpy.savez_compressed(f, array=array_data)
-                compressed_string = f.getvalue()
-            node = dumper.represent_binary(compressed_string)
-            node.tag = '!ndarray'
+        if stream_base is not None:
+            newpath = None
+            try:
+                if array_data.nbytes >= npy_threshold and not array_data.dtype.hasobject:
+                    # The previous file may still be memory-mapped by the module saving its
+                    # status and can not be replaced on every OS, so write a new version.
+                    version = 0
+                    while True:
+                        newpath = '{0}-{1:06}-{2}.npy'.format(
+                            stream_base, dumper.external_ndarray_counter, version)
+                        if newpath not in dumper.npy_files and not os.path.exists(newpath):
+                            break
+                        version += 1
+                    dumper.npy_files.add(newpath)
+                    with open(newpath, 'wb') as f:
+                        numpy.save(f, numpy.asarray(array_data), allow_pickle=False)
+                    tag = '!npyndarray'
+                else:
+                    newpath = '{0}-{1:06}.npz'.format(
+                        stream_base, dumper.external_ndarray_counter)
+                    numpy.savez_compressed(newpath, array=array_data)
+                    tag = '!extndarray'
+                node = dumper.represent_str(newpath)
+                node.tag = tag
+                dumper.external_ndarray_counter += 1
+                return node
+            except Exception as e:
+                logger.warning('Could not save numpy array to file {0}, embedding it in the '
+                               'config file instead: {1}'.format(newpath, e))
+                dumper.npy_files.discard(newpath)
+                if newpath is not None and os.path.exists(newpath):
+                    try:
+                        os.remove(newpath)
+                    except OSError:
+                        pass
+        with BytesIO() as f:
+            numpy.savez_compressed(f, array=array_data)
+            compressed_string = f.getvalue()
+        node = dumper.represent_binary(compressed_string)
+        node.tag = '!ndarray'
         return node
 
+    def remove_stale_npy_files():
+        """
+        Removes .npy files of previous saves that are not referenced anymore. Files that are
+        still memory-mapped may not be removable and are left for a later save.
+        """
+        configdir, filename = os.path.split(stream_base)
+        pattern = re.compile(re.escape(filename) + r'-\d{6}(-\d+)?\.npy$')
+        for name in os.listdir(configdir or os.curdir):
+            path = os.path.join(configdir, name)
+            if pattern.match(name) and path not in OrderedDumper.npy_files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    stream_name = getattr(stream, 'name', None)
+    if isinstance(stream_name, str):
+        stream_base = os.path.splitext(stream_name)[0]
+    else:
+        stream_base = None
+
     # add representers
     OrderedDumper.add_representer(OrderedDict, represent_ordereddict)
     OrderedDumper.add_representer(numpy.uint8, represent_int)
@@ -221,10 +292,14 @@ def ordered_dump(data, stream=None, Dumper=yaml.Dumper, **kwds):
     OrderedDumper.add_representer(numpy.float64, represent_float)
     # OrderedDumper.add_representer(numpy.float128, represent_float)
     OrderedDumper.add_representer(numpy.ndarray, represent_ndarray)
+    OrderedDumper.add_representer(numpy.memmap, represent_ndarray)
     OrderedDumper.add_representer(frozenset, represent_frozenset)
 
     # dump data
-    return yaml.dump(data, stream, OrderedDumper, **kwds)
+    result = yaml.dump(data, stream, OrderedDumper, **kwds)
+    if stream_base is not None:
+        remove_stale_npy_files()
+    return result
 
 
 def load(filename):
@@ -239,12 +314,17 @@ def load(filename):
         return ordered_load(f, yaml.SafeLoader)
 
 
-def save(filename, data):
+def save(filename, data, npy_threshold=NPY_THRESHOLD):
     """
     saves data to filename in yaml format.
 
     @param str filename: filename of config file
     @param OrderedDict data: config values
+    @param int npy_threshold: size in bytes above which numpy arrays are saved to .npy files
     """
     with open(filename, 'w') as f:
-        ordered_dump(data, stream=f, Dumper=yaml.SafeDumper, default_flow_style=False)
+        ordered_dump(data,
+                     stream=f,
+                     Dumper=yaml.SafeDumper,
+                     default_flow_style=False,
+                     npy_threshold=npy_threshold)
@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains Qudi data buffers to collect continuously acquired data without copying.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Circular buffer holding the last <size> samples of one or more channels.
+
+    Every sample is stored twice, at index i and i + size of the underlying array. This way the
+    samples ordered from oldest to newest are always the contiguous slice [start, start + size),
+    which is returned by the data property as a view without copying. Appending n samples costs
+    O(n) independent of the buffer size.
+    """
+
+    def __init__(self, size, channels=None, dtype=float, fill_value=0):
+        """
+        @param int size: number of samples per channel
+        @param int channels: number of channels. None for a 1D buffer.
+        @param dtype: numpy data type of the samples
+        @param fill_value: initial value of all samples
+        """
+        self._size = int(size)
+        if self._size < 1:
+            raise ValueError('RingBuffer size must be at least 1.')
+        shape = (2 * self._size,) if channels is None else (int(channels), 2 * self._size)
+        self._buffer = np.full(shape, fill_value, dtype=dtype)
+        self._start = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def data(self):
+        """
+        Ordered view (oldest sample first) on the buffer content. The view reflects later changes
+        to the buffer, copy it if a snapshot is needed.
+        """
+        return self._buffer[..., self._start:self._start + self._size]
+
+    def append(self, samples):
+        """
+        Appends samples to the buffer and drops the oldest ones.
+
+        @param samples: scalar (1D buffer) or 1D array with one value per channel for a single
+                        sample, 1D array (1D buffer) or 2D array (channels x samples) for several
+                        samples.
+        """
+        samples = np.asarray(samples, dtype=self._buffer.dtype)
+        if samples.ndim < self._buffer.ndim:
+            samples = samples[..., np.newaxis]
+        number_of_samples = samples.shape[-1]
+        if number_of_samples > self._size:
+            samples = samples[..., -self._size:]
+            self._start = (self._start + number_of_samples - self._size) % self._size
+            number_of_samples = self._size
+
+        if number_of_samples == 1:
+            self._buffer[..., self._start] = samples[..., 0]
+            self._buffer[..., self._start + self._size] = samples[..., 0]
+        else:
+            # Write the samples up to the end of the ring and the remaining ones to its beginning
+            first = min(number_of_samples, self._size - self._start)
+            stop = self._start + first
+            self._buffer[..., self._start:stop] = samples[..., :first]
+            self._buffer[..., self._start + self._size:stop + self._size] = samples[..., :first]
+            rest = number_of_samples - first
+            if rest > 0:
+                self._buffer[..., :rest] = samples[..., first:]
+                self._buffer[..., self._size:self._size + rest] = samples[..., first:]
+        self._start = (self._start + number_of_samples) % self._size
+
+    def fill_newest(self, number_of_samples, value):
+        """
+        Overwrites the newest samples with a value.
+
+        @param int number_of_samples: number of newest samples to overwrite
+        @param value: scalar or 1D array with one value per channel
+        """
+        number_of_samples = min(int(number_of_samples), self._size)
+        if number_of_samples < 1:
+            return
+        value = np.asarray(value, dtype=self._buffer.dtype)
+        if value.ndim > 0:
+            value = value[..., np.newaxis]
+        indices = (self._start - number_of_samples + np.arange(number_of_samples)) % self._size
+        self._buffer[..., indices] = value
+        self._buffer[..., indices + self._size] = value
+
+    def clear(self, fill_value=0):
+        """
+        Resets all samples to fill_value.
+        """
+        self._buffer[...] = fill_value
+        self._start = 0
+
+
+class RecordBuffer:
+    """
+    Growing table of fixed width records (rows) stored in preallocated chunks.
+
+    Appending does not create a Python object per record and never copies already stored records.
+    The record width is taken from the first record if not given.
+    Supports len(), integer and slice indexing (returning numpy arrays) and numpy.array(buffer).
+
+    If a spill file path is given, completely filled chunks exceeding max_memory bytes are moved
+    from memory to this raw binary file (oldest first). finalize writes the remaining records to
+    the file as well and returns all records as a memmap, so even records exceeding the available
+    memory can be processed.
+    """
+
+    def __init__(self, width=None, chunk_size=4096, dtype=float, spill_path=None, max_memory=0):
+        """
+        @param int width: number of values per record. None to use the length of the first record.
+        @param int chunk_size: number of records per preallocated chunk
+        @param dtype: numpy data type of the records
+        @param str spill_path: optional, file to move records to if max_memory is exceeded
+        @param int max_memory: optional, maximum size in bytes of the records kept in memory if a
+                               spill file is given
+        """
+        self._width = None if width is None else int(width)
+        self._chunk_size = max(int(chunk_size), 1)
+        self._dtype = np.dtype(dtype)
+        self._chunks = list()
+        self._length = 0
+
+        self._spill_path = spill_path
+        self._max_memory = int(max_memory)
+        self._spill_file = None
+        # number of chunks (at the beginning) moved to the spill file
+        self._spilled_chunks = 0
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._length)
+            if step != 1:
+                return self.data[key]
+            if stop <= start:
+                return np.empty((0, self._width or 0), dtype=self._dtype)
+            first_chunk = start // self._chunk_size
+            last_chunk = (stop - 1) // self._chunk_size
+            offset = first_chunk * self._chunk_size
+            if first_chunk == last_chunk:
+                chunk = self._get_chunk(first_chunk)
+                return chunk[start - offset:stop - offset]
+            records = np.concatenate(
+                [self._get_chunk(i) for i in range(first_chunk, last_chunk + 1)])
+            return records[start - offset:stop - offset]
+        index = int(key)
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('RecordBuffer index out of range.')
+        return self._get_chunk(index // self._chunk_size)[index % self._chunk_size]
+
+    def __array__(self, dtype=None, copy=None):
+        records = self.data
+        return records if dtype is None else records.astype(dtype)
+
+    @property
+    def width(self):
+        return self._width
+
+    @property
+    def data(self):
+        """
+        All records as a 2D numpy array (records x width). This can be a view on the internal
+        storage, stored records are never modified though.
+        """
+        return self[:]
+
+    @property
+    def spilled_records(self):
+        """
+        Number of (oldest) records moved to the spill file.
+        """
+        return self._spilled_chunks * self._chunk_size
+
+    def append(self, record):
+        """
+        Appends a single record.
+
+        @param record: 1D array-like with width values
+        """
+        self.extend(np.asarray(record, dtype=self._dtype)[np.newaxis, :])
+
+    def extend(self, records):
+        """
+        Appends several records.
+
+        @param records: 2D array-like (records x width)
+        """
+        records = np.asarray(records, dtype=self._dtype)
+        if records.ndim != 2:
+            raise ValueError('RecordBuffer expects a 2D array of records.')
+        if self._width is None:
+            self._width = records.shape[1]
+        elif records.shape[1] != self._width:
+            raise ValueError('Record width {0} does not match RecordBuffer width {1}.'
+                             ''.format(records.shape[1], self._width))
+        written = 0
+        while written < len(records):
+            position = self._length % self._chunk_size
+            if position == 0:
+                self._chunks.append(np.empty((self._chunk_size, self._width), dtype=self._dtype))
+            count = min(self._chunk_size - position, len(records) - written)
+            self._chunks[-1][position:position + count] = records[written:written + count]
+            written += count
+            self._length += count
+        if self._spill_path is not None:
+            self._spill_chunks()
+
+    def finalize(self):
+        """
+        Moves all records to the spill file and returns them as read-only memmap. Records can
+        still be appended afterwards. Without spill file all records are returned from memory.
+
+        @return numpy.ndarray: 2D array (records x width)
+        """
+        if self._spill_path is None or self._length == 0:
+            return self.data
+        self._spill_chunks(finalize=True)
+        return np.memmap(self._spill_path, dtype=self._dtype, mode='r',
+                         shape=(self._length, self._width))
+
+    def clear(self):
+        """
+        Removes all records.
+        """
+        self._chunks = list()
+        self._length = 0
+        self._spilled_chunks = 0
+        if self._spill_file is not None:
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+
+    def close(self):
+        """
+        Removes all records and the spill file.
+        """
+        self._chunks = list()
+        self._length = 0
+        self._spilled_chunks = 0
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        if self._spill_path is not None:
+            try:
+                os.remove(self._spill_path)
+            except OSError:
+                pass
+
+    def _get_chunk(self, index):
+        """
+        Returns the chunk with index, read from the spill file if it has been moved there.
+        """
+        if index >= self._spilled_chunks:
+            return self._chunks[index - self._spilled_chunks]
+        self._spill_file.flush()
+        chunk_bytes = self._chunk_size * self._width * self._dtype.itemsize
+        return np.memmap(self._spill_path, dtype=self._dtype, mode='r',
+                         offset=index * chunk_bytes, shape=(self._chunk_size, self._width))
+
+    def _spill_chunks(self, finalize=False):
+        """
+        Moves the oldest chunks exceeding max_memory to the spill file. The newest chunk is always
+        kept in memory.
+
+        @param bool finalize: optional, move all completely filled chunks and additionally write
+                              the records of a partially filled newest chunk to the file
+        """
+        if not self._chunks:
+            return
+        chunk_bytes = self._chunks[0].nbytes
+        filled = self._length - (self._spilled_chunks + len(self._chunks) - 1) * self._chunk_size
+        if finalize:
+            number_of_chunks = len(self._chunks) - (filled < self._chunk_size)
+        else:
+            number_of_chunks = len(self._chunks) - max(self._max_memory // chunk_bytes, 1)
+            if number_of_chunks < 1:
+                return
+        if self._spill_file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self._spill_path)), exist_ok=True)
+            self._spill_file = open(self._spill_path, 'wb+')
+        for _ in range(number_of_chunks):
+            self._spill_file.seek(self._spilled_chunks * chunk_bytes)
+            self._spill_file.write(self._chunks.pop(0).tobytes())
+            self._spilled_chunks += 1
+        if finalize and self._chunks:
+            # Written again completely once the chunk is filled
+            self._spill_file.seek(self._spilled_chunks * chunk_bytes)
+            self._spill_file.write(self._chunks[0][:filled].tobytes())
+            self._spill_file.truncate()
+        self._spill_file.flush()
+
+
+class LineStore:
+    """
+    Store of equally shaped data lines (e.g. the sweeps of a scan) ordered newest first.
+
+    The newest <window_size> lines are kept in memory in a ring buffer which is accessible as a
+    zero-copy view (see RingBuffer). The ring buffer starts with initial_size lines and grows
+    (doubling) up to window_size lines as lines are added. The mean over all lines and over the newest <average_length>
+    lines is kept up to date with running sums, so adding a line costs O(line size) regardless of
+    the number of lines. If a spill file path is given, every line is additionally appended to this
+    raw binary file so the complete history can be read back as a memmap.
+    """
+
+    def __init__(self, line_shape, window_size, average_length=0, spill_path=None, dtype=float,
+                 initial_size=None):
+        """
+        @param tuple line_shape: shape of a single line
+        @param int window_size: maximum number of newest lines kept in memory
+        @param int average_length: number of newest lines to average, 0 for all lines
+        @param str spill_path: optional, file to append all lines to
+        @param dtype: numpy data type of the lines
+        @param int initial_size: optional, number of lines allocated in memory at first.
+                                 window_size if None.
+        """
+        self._line_shape = tuple(line_shape)
+        self._dtype = np.dtype(dtype)
+        self._window_size = max(int(window_size), 1)
+        if initial_size is None:
+            self._capacity = self._window_size
+        else:
+            self._capacity = min(max(int(initial_size), 1), self._window_size)
+        self._buffer = np.zeros((2 * self._capacity,) + self._line_shape, dtype=self._dtype)
+        self._start = 0
+        self._number_of_lines = 0
+        # number of valid lines in the memory window
+        self._lines_in_memory = 0
+        self._average_length = 0
+        self._total_sum = np.zeros(self._line_shape, dtype=np.float64)
+        self._window_sum = np.zeros(self._line_shape, dtype=np.float64)
+        # number of newest lines contained in the window sum
+        self._window_count = 0
+
+        self._spill_path = spill_path
+        self._spill_file = None
+        if self._spill_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(self._spill_path)), exist_ok=True)
+            self._spill_file = open(self._spill_path, 'wb')
+        self.set_average_length(average_length)
+
+    @property
+    def number_of_lines(self):
+        return self._number_of_lines
+
+    @property
+    def window_size(self):
+        return self._window_size
+
+    @property
+    def window(self):
+        """
+        View on the newest lines in memory, newest line first. Not yet filled lines are zero.
+        The length is the number of currently allocated lines (at most window_size).
+        """
+        return self._buffer[self._start:self._start + self._capacity]
+
+    @property
+    def mean(self):
+        """
+        Mean of the newest average_length lines (all lines if average_length is 0).
+
+        @return numpy.ndarray: float64 array of line shape. Zeros if no line has been added yet.
+        """
+        if self._number_of_lines == 0:
+            return np.zeros(self._line_shape, dtype=np.float64)
+        if self._average_length <= 0:
+            return self._total_sum / self._number_of_lines
+        return self._window_sum / max(self._window_count, 1)
+
+    def add_line(self, line):
+        """
+        Adds a new line and updates the running sums.
+
+        @param numpy.ndarray line: new data line of line_shape
+        """
+        line = np.asarray(line, dtype=self._dtype)
+        if self._lines_in_memory == self._capacity < self._window_size:
+            self._set_capacity(min(2 * self._capacity, self._window_size))
+        self._start = (self._start - 1) % self._capacity
+        self._buffer[self._start] = line
+        self._buffer[self._start + self._capacity] = line
+        self._number_of_lines += 1
+        self._lines_in_memory = min(self._lines_in_memory + 1, self._capacity)
+        if self._spill_file is not None:
+            self._spill_file.write(line.tobytes())
+
+        self._total_sum += line
+        if self._average_length > 0:
+            self._window_sum += line
+            self._window_count += 1
+            if self._window_count > self._average_length:
+                # remove the line dropping out of the averaging window
+                self._window_sum -= self._get_line(self._average_length)
+                self._window_count -= 1
+
+    def set_average_length(self, average_length):
+        """
+        Sets the number of newest lines to average and recalculates the window sum.
+        If there is no spill file, the memory window is enlarged to hold enough lines. Lines
+        already dropped from memory can not be included in the average until enough new lines
+        have been added.
+
+        @param int average_length: number of newest lines to average, 0 for all lines
+        """
+        self._average_length = max(int(average_length), 0)
+        if self._spill_file is None and self._average_length >= self._window_size:
+            self._resize_window(self._average_length + 1)
+        if self._average_length > 0:
+            lines = self.get_lines(self._average_length)
+            self._window_sum = np.sum(lines, axis=0, dtype=np.float64)
+            self._window_count = len(lines)
+
+    def get_lines(self, number_of_lines=None):
+        """
+        Returns the newest lines, newest first. Lines older than the memory window are read from
+        the spill file. Without spill file at most window_size lines are returned.
+
+        @param int number_of_lines: optional, number of lines to return. All lines if None.
+
+        @return numpy.ndarray: array of shape (lines, *line_shape)
+        """
+        if number_of_lines is None:
+            number_of_lines = self._number_of_lines
+        number_of_lines = min(int(number_of_lines), self._number_of_lines)
+        if number_of_lines <= self._lines_in_memory or self._spill_file is None:
+            return self.window[:min(number_of_lines, self._lines_in_memory)]
+        self._spill_file.flush()
+        lines = np.memmap(self._spill_path, dtype=self._dtype, mode='r',
+                          shape=(self._number_of_lines,) + self._line_shape)
+        return lines[::-1][:number_of_lines]
+
+    def clear(self):
+        """
+        Removes all lines.
+        """
+        self._buffer[...] = 0
+        self._start = 0
+        self._number_of_lines = 0
+        self._lines_in_memory = 0
+        self._total_sum[...] = 0
+        self._window_sum[...] = 0
+        self._window_count = 0
+        if self._spill_file is not None:
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+
+    def close(self):
+        """
+        Closes and removes the spill file.
+        """
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+            try:
+                os.remove(self._spill_path)
+            except OSError:
+                pass
+
+    def _get_line(self, index):
+        """
+        Returns the line with index (0 is the newest line).
+        """
+        if index < self._lines_in_memory:
+            return self.window[index]
+        line_size = int(np.prod(self._line_shape))
+        self._spill_file.flush()
+        with open(self._spill_path, 'rb') as file:
+            file.seek((self._number_of_lines - 1 - index) * line_size * self._dtype.itemsize)
+            line = np.fromfile(file, dtype=self._dtype, count=line_size)
+        return line.reshape(self._line_shape)
+
+    def _resize_window(self, window_size):
+        """
+        Changes the maximum number of lines kept in memory, keeping the newest lines.
+        """
+        self._window_size = window_size
+        if self._capacity > window_size:
+            self._set_capacity(window_size)
+
+    def _set_capacity(self, capacity):
+        """
+        Reallocates the ring buffer for capacity lines, keeping the newest lines.
+        """
+        lines = self.window[:min(capacity, self._lines_in_memory)].copy()
+        self._lines_in_memory = len(lines)
+        self._capacity = capacity
+        self._buffer = np.zeros((2 * capacity,) + self._line_shape, dtype=self._dtype)
+        self._buffer[:len(lines)] = lines
+        self._buffer[capacity:capacity + len(lines)] = lines
+        self._start = 0
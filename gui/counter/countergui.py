@@ -270,12 +270,15 @@ class CounterGui(GUIBase):
         """
 
         if self._counting_logic.module_state() == 'locked':
-            if 0 < self._counting_logic.countdata_smoothed[(self._display_trace-1), -1] < 10:
+            # The logic returns views on its ring buffers, the plot needs a snapshot to keep
+            countdata = self._counting_logic.countdata.copy()
+            countdata_smoothed = self._counting_logic.countdata_smoothed.copy()
+            if 0 < countdata_smoothed[(self._display_trace-1), -1] < 10:
                 self._mw.count_value_Label.setText(
-                    '{0:,.6f}'.format(self._counting_logic.countdata_smoothed[(self._display_trace-1), -1]))
+                    '{0:,.6f}'.format(countdata_smoothed[(self._display_trace-1), -1]))
             else:
                 self._mw.count_value_Label.setText(
-                    '{0:,.0f}'.format(self._counting_logic.countdata_smoothed[(self._display_trace-1), -1]))
+                    '{0:,.0f}'.format(countdata_smoothed[(self._display_trace-1), -1]))
 
             x_vals = (
                 np.arange(0, self._counting_logic.get_count_length())
@@ -284,14 +287,14 @@ class CounterGui(GUIBase):
             ymax = -1
             ymin = 2000000000
             for i, ch in enumerate(self._counting_logic.get_channels()):
-                self.curves[2 * i].setData(y=self._counting_logic.countdata[i], x=x_vals)
-                self.curves[2 * i + 1].setData(y=self._counting_logic.countdata_smoothed[i],
+                self.curves[2 * i].setData(y=countdata[i], x=x_vals)
+                self.curves[2 * i + 1].setData(y=countdata_smoothed[i],
                                                x=x_vals
                                                )
-                if ymax < self._counting_logic.countdata[i].max() and self._trace_selection[i]:
-                    ymax = self._counting_logic.countdata[i].max()
-                if ymin > self._counting_logic.countdata[i].min() and self._trace_selection[i]:
-                    ymin = self._counting_logic.countdata[i].min()
+                if ymax < countdata[i].max() and self._trace_selection[i]:
+                    ymax = countdata[i].max()
+                if ymin > countdata[i].min() and self._trace_selection[i]:
+                    ymin = countdata[i].min()
 
             if ymin == ymax:
                 ymax += 0.1
@@ -453,8 +453,12 @@ class TimeSeriesGui(GUIBase):
         """ The function that grabs the data and sends it to the plot.
         """
         if data_time is None and data is None and smooth_data is None and smooth_time is None:
+            # The logic returns views on its ring buffers, keep copies for the plot
             data_time, data = self._time_series_logic.trace_data
+            data = {chnl: arr.copy() for chnl, arr in data.items()}
             smooth_time, smooth_data = self._time_series_logic.averaged_trace_data
+            if smooth_data is not None:
+                smooth_data = {chnl: arr.copy() for chnl, arr in smooth_data.items()}
         elif (data_time is None) ^ (data is None) or (smooth_time is None) ^ (smooth_data is None):
             self.log.error('Must provide a full data set of x and y values. update_data failed.')
             return
@@ -25,7 +25,6 @@ import visa
 import os
 import time
 import numpy as np
-import scipy.interpolate
 from fnmatch import fnmatch
 from collections import OrderedDict
 from abc import abstractmethod
@@ -1399,7 +1398,8 @@ class AWGM819X(Base, PulserInterface):
     def float_to_sample(self, val):
        pass
 
-    def _float_to_int(self, val, n_bits):
+    def _float_to_int(self, val, n_bits, dtype='int16', shiftbits=0, markers=None, out=None,
+                      chunk_size=2 ** 20):
 
         """
         :param val: np.array(dtype=float64) of sampled values from sequencegenerator.sample_pulse_block_ensemble().
@@ -1407,7 +1407,12 @@ class AWGM819X(Base, PulserInterface):
                     If MW ampl in 'PulsedGui/Predefined methods' < as full Vpp, amplitude reduction will be
                     performed digitally (reducing the effective digital resolution in bits).
         :param n_bits: number of bits; sets the highest integer allowed. Eg. 8 bits -> int in [-128, 127]
-        :return:    np.array(dtype=int16)
+        :param dtype: int type of the returned samples
+        :param shiftbits: number of bits the integer values are shifted to the left
+        :param markers: optional, list of digital sample arrays. Marker i sets bit i of the samples.
+        :param out: optional, preallocated np.array of dtype the samples are written to
+        :param chunk_size: number of samples converted at once
+        :return:    np.array(dtype=dtype)
         """
 
         bitsize = int(2 ** n_bits)
@@ -1416,17 +1421,49 @@ class AWGM819X(Base, PulserInterface):
 
         max_u_samples = 1  # data should be normalized in (-1..1)
 
-        if max(abs(val)) > 1:
+        if out is None:
+            out = np.empty(len(val), dtype=dtype)
+        if len(val) == 0:
+            return out
+
+        val_min = np.min(val)
+        val_max = np.max(val)
+        if max(-val_min, val_max) > 1:
             self.log.warning("Samples from sequencegenerator out of range. Normalizing to -1..1. Please change the "
                              "maximum peak to peak Voltage in the Pulse Generator Settings if you want to use a higher "
                              "power.")
-            biggest_val = max([abs(np.min(val)), np.max(val)])
+            biggest_val = max([abs(val_min), val_max])
             max_u_samples = biggest_val
         # manual 8.22.4 Waveform Data Format in Direct Mode
         # 2 bits LSB reserved for markers
-        mapper = scipy.interpolate.interp1d([-max_u_samples, max_u_samples], [min_intval, max_intval])
-
-        return mapper(val)
+        # Linear mapping of [-max_u_samples, max_u_samples] to [min_intval, max_intval] with the same
+        # floating point operations and dtypes as scipy.interpolate.interp1d, so the integers are
+        # identical. Values are truncated towards zero.
+        x_lo, x_hi = np.array([-max_u_samples, max_u_samples])
+        slope = np.float64(max_intval - min_intval) / (x_hi - x_lo)
+
+        diff_buffer = np.empty(min(chunk_size, len(val)), dtype=np.result_type(val, x_lo))
+        float_buffer = np.empty(len(diff_buffer), dtype='float64')
+        marker_buffer = np.empty(len(diff_buffer), dtype=out.dtype)
+        for start in range(0, len(val), chunk_size):
+            stop = min(start + chunk_size, len(val))
+            diff_chunk = diff_buffer[:stop - start]
+            float_chunk = float_buffer[:stop - start]
+            int_chunk = out[start:stop]
+            np.subtract(val[start:stop], x_lo, out=diff_chunk)
+            np.multiply(diff_chunk, slope, out=float_chunk)
+            float_chunk += min_intval
+            np.copyto(int_chunk, float_chunk, casting='unsafe')
+            if shiftbits:
+                int_chunk <<= shiftbits
+            if markers is not None:
+                marker_chunk = marker_buffer[:stop - start]
+                for bit, marker in enumerate(markers):
+                    np.copyto(marker_chunk, marker[start:stop], casting='unsafe')
+                    marker_chunk &= 0x1
+                    marker_chunk <<= bit
+                    int_chunk |= marker_chunk
+        return out
 
     def bool_to_sample(self, val_dch_1, val_dch_2, int_type_str='int16'):
         """
@@ -1439,10 +1476,12 @@ class AWGM819X(Base, PulserInterface):
         :return:
         """
 
-        bit_dch_1 = 0x1 & np.asarray(val_dch_1).astype(int_type_str)
-        bit_dch_2 = 0x2 & (np.asarray(val_dch_2).astype(int_type_str) << 1)
+        samples = np.asarray(val_dch_2).astype(int_type_str)
+        samples <<= 1
+        samples &= 0x2
+        samples |= 0x1 & np.asarray(val_dch_1).astype(int_type_str)
 
-        return bit_dch_1 + bit_dch_2
+        return samples
 
     @abstractmethod
     def _compile_bin_samples(self, analog_samples, digital_samples, ch_num):
@@ -2306,18 +2345,16 @@ class AWGM8195A(AWGM819X):
         interleaved = self.interleaved_wavefile
         self.log.debug("Compiling samples for {}, interleaved: {}".format(ch_str, interleaved))
 
-        a_samples = self.float_to_sample(analog_samples[ch_str])
-
         if interleaved and ch_str == 'a_ch1':
-            d_samples = self.bool_to_sample(digital_samples['d_ch1'], digital_samples['d_ch2'],
-                                            int_type_str='int8')
             # the analog and digital samples are stored in the following format: a1, d1, a2, d2, a3, d3, ...
-            comb_samples = np.zeros(2 * a_samples.size, dtype=np.int8)
-            comb_samples[::2] =  a_samples
-            comb_samples[1::2] = d_samples
+            comb_samples = np.empty(2 * len(analog_samples[ch_str]), dtype=np.int8)
+            self.float_to_sample(analog_samples[ch_str], out=comb_samples[::2])
+            comb_samples[1::2] = self.bool_to_sample(digital_samples['d_ch1'],
+                                                     digital_samples['d_ch2'],
+                                                     int_type_str='int8')
 
         else:
-            comb_samples = a_samples
+            comb_samples = self.float_to_sample(analog_samples[ch_str])
 
         return comb_samples
 
@@ -2404,11 +2441,9 @@ class AWGM8195A(AWGM819X):
             else:
                 self.write('OUTP{0:d} OFF'.format(dch_num))
 
-    def float_to_sample(self, val):
-
-        val_int = self._float_to_int(val, self._dac_resolution)
+    def float_to_sample(self, val, out=None):
 
-        return val_int.astype('int8')
+        return self._float_to_int(val, self._dac_resolution, dtype='int8', out=out)
 
     def _define_new_sequence(self, name, num_steps):
         # no storage system for sequences on 8195a
@@ -2668,14 +2703,14 @@ class AWGM8190A(AWGM819X):
 
         marker = self.marker_on
 
-        a_samples = self.float_to_sample(analog_samples[ch_num])
-        marker_sample = digital_samples[self._analogue_ch_corresponding_digital_chs(ch_num)[0]]
-        marker_sync = digital_samples[self._analogue_ch_corresponding_digital_chs(ch_num)[1]]
-        d_samples = self.bool_to_sample(marker_sample, marker_sync, int_type_str='int16')
         if marker:
-            comb_samples = a_samples + d_samples
+            marker_sample = digital_samples[self._analogue_ch_corresponding_digital_chs(ch_num)[0]]
+            marker_sync = digital_samples[self._analogue_ch_corresponding_digital_chs(ch_num)[1]]
+            # the marker bits are the 2 LSB of the shifted analog samples
+            comb_samples = self.float_to_sample(analog_samples[ch_num],
+                                                markers=[marker_sample, marker_sync])
         else:
-            comb_samples = a_samples
+            comb_samples = self.float_to_sample(analog_samples[ch_num])
 
         return comb_samples
 
@@ -2752,12 +2787,12 @@ class AWGM8190A(AWGM819X):
             else:
                 self.write('OUTP{0:d}:NORM OFF'.format(ach_num))
 
-    def float_to_sample(self, val):
+    def float_to_sample(self, val, markers=None):
 
-        val_int = self._float_to_int(val, self._dac_resolution)
         shiftbits = 16 - self._dac_resolution  # 2 for marker, dac: 12 -> 2, dac: 14 -> 4
 
-        return val_int.astype('int16') << shiftbits
+        return self._float_to_int(val, self._dac_resolution, dtype='int16', shiftbits=shiftbits,
+                                  markers=markers)
 
     def _delete_all_sequences(self):
 
@@ -23,6 +23,7 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 import os
 import time
+import ftplib
 import visa
 import numpy as np
 
@@ -79,6 +80,8 @@ class AWG70K(Base, PulserInterface):
         self.awg_model = ''  # String describing the model
 
         self.ftp_working_dir = 'waves'  # subfolder of FTP root dir on AWG disk to work in
+        self._ftp = None  # persistent FTP session, see _get_ftp_session
+        self._ftp_filenames = None  # cached file list of the FTP working directory
 
         self.__max_seq_steps = 0
         self.__max_seq_repetitions = 0
@@ -106,9 +109,7 @@ class AWG70K(Base, PulserInterface):
             self.awg.timeout = self._visa_timeout * 1000
 
         # try connecting to AWG using FTP protocol
-        with FTP(self._ip_address) as ftp:
-            ftp.login(user=self._username, passwd=self._password)
-            ftp.cwd(self.ftp_working_dir)
+        self._get_ftp_session()
 
         if self.awg is not None:
             self.awg_model = self.query('*IDN?').split(',')[1]
@@ -132,6 +133,7 @@ class AWG70K(Base, PulserInterface):
             self.awg.close()
         except:
             self.log.debug('Closing AWG connection using pyvisa failed.')
+        self._close_ftp_session()
         self.log.info('Closed connection to AWG')
         return
 
@@ -388,11 +390,7 @@ class AWG70K(Base, PulserInterface):
             # Create waveform name string
             wfm_name = '{0}_ch{1:d}'.format(name, a_ch_num)
 
-            # Check if waveform already exists and delete if necessary.
-            if wfm_name in self.get_waveform_names():
-                self.delete_waveform(wfm_name)
-
-            # Write WFMX file for waveform
+            # Write WFMX file for waveform directly to the AWG
             start = time.time()
             self._write_wfmx(filename=wfm_name,
                              analog_samples=analog_samples[a_ch],
@@ -400,13 +398,18 @@ class AWG70K(Base, PulserInterface):
                              is_first_chunk=is_first_chunk,
                              is_last_chunk=is_last_chunk,
                              total_number_of_samples=total_number_of_samples)
-            self.log.debug('Write WFMX file: {0}'.format(time.time() - start))
+            self.log.debug('Write WFMX file to AWG: {0}'.format(time.time() - start))
 
-            # transfer waveform to AWG and load into workspace
-            start = time.time()
-            self._send_file(filename=wfm_name + '.wfmx')
-            self.log.debug('Send WFMX file: {0}'.format(time.time() - start))
+            # The WFMX file is complete only after the last chunk
+            if not is_last_chunk:
+                waveforms.append(wfm_name)
+                continue
 
+            # Check if waveform already exists and delete if necessary.
+            if wfm_name in self.get_waveform_names():
+                self.delete_waveform(wfm_name)
+
+            # load waveform into workspace
             start = time.time()
             self.write('MMEM:OPEN "{0}"'.format(os.path.join(
                 self._ftp_dir, self.ftp_working_dir, wfm_name + '.wfmx')))
@@ -1509,31 +1512,71 @@ class AWG70K(Base, PulserInterface):
         """
         return bool(int(self.query('AWGC:RST?')))
 
+    def _get_ftp_session(self):
+        """ Get the persistent FTP session to the AWG. Connects and logs in if there is no session
+        yet or if the existing session is not responding anymore.
+
+        @return ftplib.FTP: logged in FTP session with the working directory set to
+                            <ftproot>\\waves
+        """
+        if self._ftp is not None:
+            try:
+                self._ftp.voidcmd('NOOP')
+                return self._ftp
+            except ftplib.all_errors:
+                self.log.debug('FTP session to AWG lost. Reconnecting.')
+                self._close_ftp_session()
+
+        ftp = FTP(self._ip_address)
+        try:
+            ftp.login(user=self._username, passwd=self._password)
+            ftp.cwd(self.ftp_working_dir)
+        except ftplib.all_errors:
+            ftp.close()
+            raise
+        self._ftp = ftp
+        return self._ftp
+
+    def _close_ftp_session(self):
+        """ Closes the persistent FTP session to the AWG and drops the cached file list.
+        """
+        self._ftp_filenames = None
+        if self._ftp is None:
+            return
+        try:
+            self._ftp.quit()
+        except ftplib.all_errors:
+            self._ftp.close()
+        self._ftp = None
+
     def _get_filenames_on_device(self):
         """
+        The file list is cached and kept up to date by _delete_file and _upload_file.
 
         @return list: filenames found in <ftproot>\\waves
         """
+        if self._ftp_filenames is not None:
+            return list(self._ftp_filenames)
+
         filename_list = list()
-        with FTP(self._ip_address) as ftp:
-            ftp.login(user=self._username, passwd=self._password)
-            ftp.cwd(self.ftp_working_dir)
-            # get only the files from the dir and skip possible directories
-            log = list()
-            ftp.retrlines('LIST', callback=log.append)
-            for line in log:
-                if '<DIR>' not in line:
-                    # that is how a potential line is looking like:
-                    #   '05-10-16  05:22PM                  292 SSR aom adjusted.seq'
-                    # The first part consists of the date information. Remove this information and
-                    # separate the first number, which indicates the size of the file. This is
-                    # necessary if the filename contains whitespaces.
-                    size_filename = line[18:].lstrip()
-                    # split after the first appearing whitespace and take the rest as filename.
-                    # Remove for safety all trailing and leading whitespaces:
-                    filename = size_filename.split(' ', 1)[1].strip()
-                    filename_list.append(filename)
-        return filename_list
+        ftp = self._get_ftp_session()
+        # get only the files from the dir and skip possible directories
+        log = list()
+        ftp.retrlines('LIST', callback=log.append)
+        for line in log:
+            if '<DIR>' not in line:
+                # that is how a potential line is looking like:
+                #   '05-10-16  05:22PM                  292 SSR aom adjusted.seq'
+                # The first part consists of the date information. Remove this information and
+                # separate the first number, which indicates the size of the file. This is
+                # necessary if the filename contains whitespaces.
+                size_filename = line[18:].lstrip()
+                # split after the first appearing whitespace and take the rest as filename.
+                # Remove for safety all trailing and leading whitespaces:
+                filename = size_filename.split(' ', 1)[1].strip()
+                filename_list.append(filename)
+        self._ftp_filenames = filename_list
+        return list(filename_list)
 
     def _delete_file(self, filename):
         """
@@ -1541,48 +1584,51 @@ class AWG70K(Base, PulserInterface):
         @param str filename:
         """
         if filename in self._get_filenames_on_device():
-            with FTP(self._ip_address) as ftp:
-                ftp.login(user=self._username, passwd=self._password)
-                ftp.cwd(self.ftp_working_dir)
-                ftp.delete(filename)
+            self._get_ftp_session().delete(filename)
+            if self._ftp_filenames is not None and filename in self._ftp_filenames:
+                self._ftp_filenames.remove(filename)
         return
 
-    def _send_file(self, filename):
-        """
+    def _upload_file(self, filename, data_blocks, append=False):
+        """ Streams data to a file in <ftproot>\\waves on the AWG using the persistent FTP session.
+        An existing file by the same filename is deleted unless append is True.
 
-        @param filename:
-        @return:
+        @param str filename: name of the file on the AWG
+        @param data_blocks: iterable of bytes-like objects (e.g. numpy arrays) written in order
+        @param bool append: append the data to an existing file
         """
-        # check input
-        if not filename:
-            self.log.error('No filename provided for file upload to awg!\nCommand will be ignored.')
-            return -1
-
-        filepath = os.path.join(self._tmp_work_dir, filename)
-        if not os.path.isfile(filepath):
-            self.log.error('No file "{0}" found in "{1}". Unable to upload!'
-                           ''.format(filename, self._tmp_work_dir))
-            return -1
+        if not append:
+            # Delete old file on AWG by the same filename
+            self._delete_file(filename)
 
-        # Delete old file on AWG by the same filename
-        self._delete_file(filename)
-
-        # Transfer file
-        with FTP(self._ip_address) as ftp:
-            ftp.login(user=self._username, passwd=self._password)
-            ftp.cwd(self.ftp_working_dir)
-            with open(filepath, 'rb') as file:
-                ftp.storbinary('STOR ' + filename, file)
-        return 0
+        ftp = self._get_ftp_session()
+        try:
+            ftp.voidcmd('TYPE I')
+            with ftp.transfercmd(('APPE ' if append else 'STOR ') + filename) as conn:
+                for block in data_blocks:
+                    conn.sendall(block)
+            ftp.voidresp()
+        except ftplib.all_errors:
+            # The state of the session and the file list are unknown after a failed transfer
+            self._close_ftp_session()
+            raise
+
+        if self._ftp_filenames is not None and filename not in self._ftp_filenames:
+            self._ftp_filenames.append(filename)
+        return
 
     def _write_wfmx(self, filename, analog_samples, marker_bytes, is_first_chunk, is_last_chunk,
                     total_number_of_samples):
         """
-        Appends a sampled chunk of a whole waveform to a wfmx-file. Create the file
+        Appends a sampled chunk of a whole waveform to a wfmx-file on the AWG. Create the file
         if it is the first chunk.
         If both flags (is_first_chunk, is_last_chunk) are set to TRUE it means
         that the whole ensemble is written as a whole in one big chunk.
 
+        The header and the samples are streamed directly from the sample arrays via FTP. Since the
+        digital samples follow all analog samples in the file, the digital samples of all but the
+        last chunk are kept in a temporary file in tmp_work_dir.
+
         @param name: string, represents the name of the sampled ensemble
         @param analog_samples: dict containing float32 numpy ndarrays, contains the
                                        samples for the analog channels that
@@ -1596,58 +1642,48 @@ class AWG70K(Base, PulserInterface):
                                first write to this file.
         @param is_last_chunk: bool, indicates if the current chunk is the last
                               write to this file.
-
-        @return list: the list contains the string names of the created files for the passed
-                      presampled arrays
         """
-        # The memory overhead of the tmp file write/read process in bytes. Only used if wfmx file is
+        # The memory overhead of the tmp file read process in bytes. Only used if wfmx file is
         # written in chunks in order to avoid excessive memory usage.
         tmp_bytes_overhead = 16777216  # 16 MB
 
         if not filename.endswith('.wfmx'):
             filename += '.wfmx'
-        wfmx_path = os.path.join(self._tmp_work_dir, filename)
-        tmp_path = os.path.join(self._tmp_work_dir, 'digital_tmp.bin')
-
-        # if it is the first chunk, create the .WFMX file with header.
-        if is_first_chunk:
-            # create header
-            header = self._create_xml_header(total_number_of_samples, marker_bytes is not None)
-            # write header
-            with open(wfmx_path, 'wb') as wfmxfile:
-                wfmxfile.write(header.encode('utf8'))
-            # Check if a tmp digital samples file is present and delete it if necessary.
-            if os.path.isfile(tmp_path):
-                os.remove(tmp_path)
-
-        # append analog samples to the .WFMX file.
-        # Write digital samples in temporary file if not the entire samples are passed at once.
-        with open(wfmx_path, 'ab') as wfmxfile:
-            # append analog samples in binary format. One sample is 4 bytes (np.float32).
-            wfmxfile.write(analog_samples)
+        tmp_path = os.path.join(self._tmp_work_dir, filename[:-5] + '_digital_tmp.bin')
+
+        # Check if a tmp digital samples file is present and delete it if necessary.
+        if is_first_chunk and os.path.isfile(tmp_path):
+            os.remove(tmp_path)
 
         # Write digital samples to tmp file if chunkwise writing is used and it's not the last chunk
         if not is_last_chunk and marker_bytes is not None:
             with open(tmp_path, 'ab') as tmp_file:
                 tmp_file.write(marker_bytes)
 
-        # If this is the last chunk, write digital samples from tmp file to wfmx file (if present)
-        # and also append the currently passed digital samples to wfmx file.
-        # Read from tmp file in chunks of tmp_bytes_overhead in order to avoid too much memory
-        # overhead.
-        if is_last_chunk and marker_bytes is not None:
-            with open(wfmx_path, 'ab') as wfmxfile:
-                # Copy over digital samples from tmp file. Delete tmp file afterwards.
+        def data_blocks():
+            # if it is the first chunk, start the .WFMX file with header.
+            if is_first_chunk:
+                header = self._create_xml_header(total_number_of_samples,
+                                                 marker_bytes is not None)
+                yield header.encode('utf8')
+            # analog samples in binary format. One sample is 4 bytes (np.float32).
+            yield analog_samples
+            # If this is the last chunk, send digital samples from tmp file (if present) and also
+            # the currently passed digital samples.
+            if is_last_chunk and marker_bytes is not None:
                 if os.path.isfile(tmp_path):
                     with open(tmp_path, 'rb') as tmp_file:
                         while True:
                             tmp = tmp_file.read(tmp_bytes_overhead)
                             if not tmp:
                                 break
-                            wfmxfile.write(tmp)
-                    os.remove(tmp_path)
-                # Append current digital samples array to wfmx file
-                wfmxfile.write(marker_bytes)
+                            yield tmp
+                yield marker_bytes
+
+        self._upload_file(filename, data_blocks(), append=not is_first_chunk)
+
+        if is_last_chunk and os.path.isfile(tmp_path):
+            os.remove(tmp_path)
         return
 
     def _create_xml_header(self, number_of_samples, markers_active):
@@ -36,6 +36,7 @@ class ConfocalScannerDummy(Base, ConfocalScannerInterface):
     confocal_scanner_dummy:
         module.Class: 'confocal_scanner_dummy.ConfocalScannerDummy'
         clock_frequency: 100 # in Hz
+        number_of_points: 500 # number of simulated emitters, optional
         fitlogic: 'fitlogic' # name of the fitlogic module, see default config
 
     """
@@ -45,8 +46,14 @@ class ConfocalScannerDummy(Base, ConfocalScannerInterface):
 
     # config
     _clock_frequency = ConfigOption('clock_frequency', 100, missing='warn')
+    _num_points = ConfigOption('number_of_points', 500, missing='nothing')
     fine_scanning_mode = False
 
+    # emitters further away from the scanned line than this many standard deviations are ignored
+    _cutoff_sigmas = 5
+    # number of pixels of a line for which the emitters are looked up at once
+    _chunk_length = 64
+
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
 
@@ -56,7 +63,6 @@ class ConfocalScannerDummy(Base, ConfocalScannerInterface):
 
         self._position_range = [[0, 100e-6], [0, 100e-6], [0, 100e-6], [0, 1e-6]]
         self._current_position = [0, 0, 0, 0][0:len(self.get_scanner_axes())]
-        self._num_points = 500
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -121,6 +127,8 @@ class ConfocalScannerDummy(Base, ConfocalScannerInterface):
         # offset
         self._points_z[:, 3] = 0
 
+        self._set_up_emitter_grid()
+
     def on_deactivate(self):
         """ Deactivate properly the confocal scanner dummy.
         """
@@ -316,15 +324,14 @@ class ConfocalScannerDummy(Base, ConfocalScannerInterface):
             self._set_up_line(np.shape(line_path)[1])
 
         count_data = np.random.uniform(0, 2e4, self._line_length)
-        z_data = line_path[2, :]
-
-        #TODO: Change the gaussian function here to the one from fitlogic and delete the local modules to calculate
-        #the gaussian functions
-        x_data = np.array(line_path[0, :])
-        y_data = np.array(line_path[1, :])
-        for i in range(self._num_points):
-            count_data += self.twoD_gaussian_function((x_data, y_data), *(self._points[i])
-                ) * self.gaussian_function(np.array(z_data), *(self._points_z[i]))
+        x_data = np.asarray(line_path[0, :], dtype=float)
+        y_data = np.asarray(line_path[1, :], dtype=float)
+        z_data = np.asarray(line_path[2, :], dtype=float)
+        for start in range(0, self._line_length, self._chunk_length):
+            chunk = slice(start, start + self._chunk_length)
+            count_data[chunk] += self._get_emitter_counts(x_data[chunk],
+                                                          y_data[chunk],
+                                                          z_data[chunk])
 
         time.sleep(self._line_length * 1. / self._clock_frequency)
         time.sleep(self._line_length * 1. / self._clock_frequency)
@@ -338,6 +345,99 @@ class ConfocalScannerDummy(Base, ConfocalScannerInterface):
                 np.ones(count_data.shape) * line_path[1, 0] * 100
             ]).transpose()
 
+    def _set_up_emitter_grid(self):
+        """ Sorts the emitters into square cells of the xy plane, so that only the emitters close to
+        a scanned line need to be evaluated. The cell size is half the distance beyond which the
+        contribution of every emitter is negligible.
+        """
+        # Coefficients of the elliptical 2D gaussians (see twoD_gaussian_function)
+        amplitude, x_zero, y_zero, sigma_x, sigma_y, theta = self._points[:, :6].transpose()
+        a = np.cos(theta) ** 2 / (2 * sigma_x ** 2) + np.sin(theta) ** 2 / (2 * sigma_y ** 2)
+        b = -np.sin(2 * theta) / (4 * sigma_x ** 2) + np.sin(2 * theta) / (4 * sigma_y ** 2)
+        c = np.sin(theta) ** 2 / (2 * sigma_x ** 2) + np.cos(theta) ** 2 / (2 * sigma_y ** 2)
+        z_amplitude, z_zero, sigma_z = self._points_z[:, :3].transpose()
+        # The emitters have no offset, so the product of both gaussians is a single exponential
+        emitters = np.array([amplitude * z_amplitude,
+                             x_zero,
+                             y_zero,
+                             a,
+                             2 * b,
+                             c,
+                             z_zero,
+                             1 / (2 * sigma_z ** 2)])
+
+        if self._num_points > 0:
+            self._emitter_cutoff = self._cutoff_sigmas * np.abs(self._points[:, 3:5]).max()
+            self._emitter_z_cutoff = self._cutoff_sigmas * np.abs(sigma_z).max()
+        else:
+            self._emitter_cutoff = self._emitter_z_cutoff = 1.0
+        self._cell_size = self._emitter_cutoff / 2
+        self._grid_origin = (self._position_range[0][0], self._position_range[1][0])
+        self._grid_shape = (
+            max(int(np.ceil((self._position_range[0][1] - self._position_range[0][0])
+                            / self._cell_size)), 1),
+            max(int(np.ceil((self._position_range[1][1] - self._position_range[1][0])
+                            / self._cell_size)), 1))
+
+        cells = self._get_grid_cells(x_zero, y_zero)
+        order = np.argsort(cells, kind='stable')
+        self._emitters = emitters[:, order]
+        # The emitters of cell i are self._emitters[:, cell_starts[i]:cell_starts[i + 1]]
+        self._cell_starts = np.searchsorted(cells[order],
+                                            np.arange(self._grid_shape[0] * self._grid_shape[1] + 1))
+
+    def _get_grid_cells(self, x, y, as_indices=False):
+        """ Flat indices of the emitter grid cells containing the given positions. Positions outside
+        the scanner range are assigned to the closest cell.
+
+        @param float[] x: x positions
+        @param float[] y: y positions
+        @param bool as_indices: return the column and row indices instead of the flat index
+
+        @return int[]: flat cell indices or tuple of column and row indices
+        """
+        column = np.clip(np.floor((np.asarray(x) - self._grid_origin[0]) / self._cell_size),
+                         0, self._grid_shape[0] - 1).astype(int)
+        row = np.clip(np.floor((np.asarray(y) - self._grid_origin[1]) / self._cell_size),
+                      0, self._grid_shape[1] - 1).astype(int)
+        if as_indices:
+            return column, row
+        return row * self._grid_shape[0] + column
+
+    def _get_emitter_counts(self, x_data, y_data, z_data):
+        """ Calculates the fluorescence of all emitters along a line in a single broadcast call.
+        Only the emitters in the grid cells around the bounding box of the line are considered.
+
+        @param float[] x_data: x positions of the line
+        @param float[] y_data: y positions of the line
+        @param float[] z_data: z positions of the line
+
+        @return float[]: summed fluorescence of the emitters at each position
+        """
+        if len(x_data) == 0:
+            return np.zeros(0)
+        # Rows of cells within the cutoff distance of the bounding box of the line
+        columns, rows = self._get_grid_cells(
+            [x_data.min() - self._emitter_cutoff, x_data.max() + self._emitter_cutoff],
+            [y_data.min() - self._emitter_cutoff, y_data.max() + self._emitter_cutoff],
+            as_indices=True)
+        row_offsets = np.arange(rows[0], rows[1] + 1) * self._grid_shape[0]
+        starts = self._cell_starts[row_offsets + columns[0]]
+        lengths = self._cell_starts[row_offsets + columns[1] + 1] - starts
+        # Concatenate the index ranges of all rows
+        indices = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths,
+                                                       lengths)
+        emitters = self._emitters[:, indices]
+        emitters = emitters[:, np.abs(emitters[6] - np.clip(emitters[6], z_data.min(), z_data.max()))
+                               <= self._emitter_z_cutoff]
+
+        amplitude, x_zero, y_zero, a, b2, c, z_zero, z_coeff = emitters[:, :, np.newaxis]
+        dx = x_data - x_zero
+        dy = y_data - y_zero
+        dz = z_data - z_zero
+        exponent = a * dx ** 2 + b2 * dx * dy + c * dy ** 2 + z_coeff * dz ** 2
+        return (amplitude * np.exp(-exponent)).sum(axis=0)
+
     def close_scanner(self):
         """ Closes the scanner and cleans up afterwards.
 
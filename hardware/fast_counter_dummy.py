@@ -25,6 +25,7 @@ import os
 import numpy as np
 
 from core.module import Base
+from core.connector import Connector
 from core.configoption import ConfigOption
 from core.util.modules import get_main_dir
 from interface.fast_counter_interface import FastCounterInterface
@@ -39,12 +40,39 @@ class FastCounterDummy(Base, FastCounterInterface):
         module.Class: 'fast_counter_dummy.FastCounterDummy'
         gated: False
         #load_trace: None # path to the saved dummy trace
-
+        #synthetic_trace: True # simulate Poisson count traces instead of loading the saved trace
+        #count_rate: 2e6 # count rate during the laser pulses in counts/s
+        #dark_count_rate: 100 # background count rate in counts/s
+        #sweep_rate: 1e4 # sweeps per second, at most one sweep per loaded waveform duration
+        #contrast: 0.3 # relative fluorescence drop of the dark spin state
+        #laser_channel: 'd_ch1' # pulse generator channel switching the laser
+        #connect:
+        #    pulsegenerator: 'pulser_dummy' # simulate the laser pulses of the loaded waveform
+
+    The synthetic trace contains one laser pulse per gate (gated) or the laser pulses of the
+    waveform loaded in the connected dummy pulse generator (ungated). Without pulse generator or
+    loaded waveform, evenly spaced laser pulses are used. The spin state read out by the laser
+    pulses goes through one Rabi period over all laser pulses.
     """
 
+    # connectors
+    pulsegenerator = Connector(interface='PulserInterface', optional=True)
+
     # config option
     _gated = ConfigOption('gated', False, missing='warn')
     trace_path = ConfigOption('load_trace', None)
+    _synthetic = ConfigOption('synthetic_trace', False, missing='nothing')
+    _count_rate = ConfigOption('count_rate', 2e6, missing='nothing')
+    _dark_count_rate = ConfigOption('dark_count_rate', 100, missing='nothing')
+    _sweep_rate = ConfigOption('sweep_rate', 1e4, missing='nothing')
+    _contrast = ConfigOption('contrast', 0.3, missing='nothing')
+    _laser_channel = ConfigOption('laser_channel', 'd_ch1', missing='nothing')
+
+    # laser pulses used for the synthetic trace if the loaded waveform is unknown
+    _default_laser_length = 3e-6
+    _default_number_of_lasers = 50
+    # time constant of the spin polarization during the laser pulses in seconds
+    _polarization_time = 300e-9
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
@@ -67,6 +95,14 @@ class FastCounterDummy(Base, FastCounterInterface):
         self.statusvar = 0
         self._binwidth = 1
         self._gate_length_bins = 8192
+        self._number_of_gates = 0
+
+        # State of the synthetic measurement
+        self._sweep_counts = None
+        self._count_data = None
+        self._elapsed_sweeps = 0
+        self._elapsed_time = 0
+        self._start_time = None
         return
 
     def on_deactivate(self):
@@ -134,6 +170,7 @@ class FastCounterDummy(Base, FastCounterInterface):
         """
         self._binwidth = int(np.rint(bin_width_s * 1e9 * 950 / 1000))
         self._gate_length_bins = int(np.rint(record_length_s / bin_width_s))
+        self._number_of_gates = int(number_of_gates) if self._gated else 0
         actual_binwidth = self._binwidth * 1000 / 950e9
         actual_length = self._gate_length_bins * actual_binwidth
         self.statusvar = 1
@@ -153,6 +190,15 @@ class FastCounterDummy(Base, FastCounterInterface):
         return self.statusvar
 
     def start_measure(self):
+        if self._synthetic:
+            self._set_up_synthetic_trace()
+            self._count_data = np.zeros(self._sweep_counts.shape, dtype='int64')
+            self._elapsed_sweeps = 0
+            self._elapsed_time = 0
+            self._start_time = time.time()
+            self.statusvar = 2
+            return 0
+
         time.sleep(1)
         self.statusvar = 2
         try:
@@ -169,12 +215,23 @@ class FastCounterDummy(Base, FastCounterInterface):
 
         Fast counter must be initially in the run state to make it pause.
         """
+        if self._synthetic:
+            self._accumulate_sweeps()
+            self._start_time = None
+            self.statusvar = 3
+            return 0
+
         time.sleep(1)
         self.statusvar = 3
         return 0
 
     def stop_measure(self):
         """ Stop the fast counter. """
+        if self._synthetic:
+            self._accumulate_sweeps()
+            self._start_time = None
+            self.statusvar = 1
+            return 0
 
         time.sleep(1)
         self.statusvar = 1
@@ -185,7 +242,8 @@ class FastCounterDummy(Base, FastCounterInterface):
 
         If fast counter is in pause state, then fast counter will be continued.
         """
-
+        if self._synthetic and self._sweep_counts is not None and self._start_time is None:
+            self._start_time = time.time()
         self.statusvar = 2
         return 0
 
@@ -225,6 +283,12 @@ class FastCounterDummy(Base, FastCounterInterface):
         If the hardware does not support these features, the values should be None
         """
 
+        if self._synthetic:
+            self._accumulate_sweeps()
+            info_dict = {'elapsed_sweeps': self._elapsed_sweeps,
+                         'elapsed_time': self._elapsed_time}
+            return self._count_data.copy(), info_dict
+
         # include an artificial waiting time
         time.sleep(0.5)
         info_dict = {'elapsed_sweeps': None, 'elapsed_time': None}
@@ -234,3 +298,91 @@ class FastCounterDummy(Base, FastCounterInterface):
         freq = 950.
         time.sleep(0.5)
         return freq
+
+    def _set_up_synthetic_trace(self):
+        """ Calculates the expected counts per bin of a single sweep from the laser pulses of the
+        waveform loaded in the pulse generator.
+        """
+        binwidth = self.get_binwidth()
+        record_length = self._gate_length_bins * binwidth
+        self._sweep_duration = record_length * max(self._number_of_gates, 1)
+
+        # Laser pulse start times and durations in seconds
+        laser_starts = None
+        pulser = self.pulsegenerator()
+        if pulser is not None and hasattr(pulser, 'get_loaded_digital_edges'):
+            loaded_edges = pulser.get_loaded_digital_edges()
+            if loaded_edges is not None and self._laser_channel in loaded_edges[0]:
+                rising, falling = loaded_edges[0][self._laser_channel]
+                sample_rate = pulser.get_sample_rate()
+                # A laser pulse still on at the end of the waveform ends with it
+                falling = np.append(falling, loaded_edges[1])[:len(rising)]
+                laser_starts = rising / sample_rate
+                laser_lengths = (falling - rising) / sample_rate
+                self._sweep_duration = loaded_edges[1] / sample_rate
+        if laser_starts is None:
+            if self._gated:
+                number_of_lasers = max(self._number_of_gates, 1)
+                laser_starts = np.arange(number_of_lasers) * record_length
+                laser_lengths = np.full(number_of_lasers, min(self._default_laser_length,
+                                                              record_length))
+            else:
+                period = record_length / self._default_number_of_lasers
+                laser_starts = np.arange(self._default_number_of_lasers) * period
+                laser_lengths = np.full(self._default_number_of_lasers,
+                                        min(self._default_laser_length, period / 2))
+
+        # Population of the dark spin state read out by each laser pulse
+        dark_population = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(len(laser_starts))
+                                             / max(len(laser_starts), 1))
+
+        if self._gated:
+            # The gates start with the laser pulses
+            number_of_gates = max(self._number_of_gates, 1)
+            times = np.arange(self._gate_length_bins) * binwidth
+            sweep_counts = np.full((number_of_gates, self._gate_length_bins),
+                                   self._dark_count_rate * binwidth)
+            for gate, length in enumerate(laser_lengths[:number_of_gates]):
+                laser_on = times < length
+                sweep_counts[gate, laser_on] += self._get_laser_counts(times[laser_on],
+                                                                       dark_population[gate])
+        else:
+            times = np.arange(self._gate_length_bins) * binwidth
+            sweep_counts = np.full(self._gate_length_bins, self._dark_count_rate * binwidth)
+            first_bins = np.searchsorted(times, laser_starts)
+            last_bins = np.searchsorted(times, laser_starts + laser_lengths)
+            for laser, (first, last) in enumerate(zip(first_bins, last_bins)):
+                sweep_counts[first:last] += self._get_laser_counts(
+                    times[first:last] - laser_starts[laser], dark_population[laser])
+        self._sweep_counts = sweep_counts
+
+    def _get_laser_counts(self, times, dark_population):
+        """ Expected counts per bin during a laser pulse for a single sweep.
+
+        @param numpy.ndarray times: times of the bins since the start of the laser pulse
+        @param float dark_population: population of the dark spin state before the laser pulse
+
+        @return numpy.ndarray: expected counts of each bin
+        """
+        fluorescence = 1 - self._contrast * dark_population * np.exp(-times
+                                                                     / self._polarization_time)
+        return self._count_rate * self.get_binwidth() * fluorescence
+
+    def _accumulate_sweeps(self):
+        """ Adds the counts of all sweeps since the last call to the synthetic count data.
+        Counts summed over many sweeps are Poisson distributed with the summed expectation value,
+        so the cost does not depend on the number of sweeps.
+        """
+        if self._start_time is None:
+            return
+        now = time.time()
+        self._elapsed_time += now - self._start_time
+        self._start_time = now
+        if self._sweep_duration > 0:
+            sweep_rate = min(self._sweep_rate, 1 / self._sweep_duration)
+        else:
+            sweep_rate = self._sweep_rate
+        new_sweeps = int(self._elapsed_time * sweep_rate) - self._elapsed_sweeps
+        if new_sweeps > 0:
+            self._count_data += np.random.poisson(self._sweep_counts * new_sweeps)
+            self._elapsed_sweeps += new_sweeps
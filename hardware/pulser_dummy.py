@@ -21,6 +21,7 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 """
 
 import time
+import numpy as np
 from collections import OrderedDict
 
 from core.module import Base
@@ -72,6 +73,9 @@ class PulserDummy(Base, PulserInterface):
 
         self.waveform_set = set()
         self.sequence_dict = dict()
+        # Rising and falling edges of the digital channels of each written waveform
+        self._waveform_edges = dict()
+        self._pending_edges = None
 
         self.current_loaded_assets = dict()
 
@@ -315,6 +319,11 @@ class PulserDummy(Base, PulserInterface):
 
         self.waveform_set.update(waveforms)
 
+        self._track_digital_edges(digital_samples, is_first_chunk)
+        if is_last_chunk:
+            for waveform in waveforms:
+                self._waveform_edges[waveform] = self._pending_edges
+
         self.log.info('Waveforms with nametag "{0}" directly written on dummy pulser.'.format(name))
         return number_of_samples, waveforms
 
@@ -374,6 +383,7 @@ class PulserDummy(Base, PulserInterface):
         for waveform in waveform_name:
             if waveform in self.waveform_set:
                 self.waveform_set.remove(waveform)
+                self._waveform_edges.pop(waveform, None)
                 deleted_waveforms.append(waveform)
 
         return deleted_waveforms
@@ -543,6 +553,55 @@ class PulserDummy(Base, PulserInterface):
 
         return self.current_loaded_assets, asset_type
 
+    def get_loaded_digital_edges(self):
+        """ Dummy specific: Retrieve the rising and falling edges of the digital channels of the
+        currently loaded waveform. Used by the fast counter dummy to simulate the laser pulses.
+
+        @return (dict, int): Dictionary with the digital channel names as keys and tuples of
+                             rising and falling edge sample indices as values, total number of
+                             samples of the waveform. None if no waveform is loaded.
+                             Channels still high at the end of the waveform have one falling
+                             edge less than rising edges.
+        """
+        loaded_assets, asset_type = self.get_loaded_assets()
+        if asset_type != 'waveform':
+            return None
+        for waveform in loaded_assets.values():
+            if waveform in self._waveform_edges:
+                return self._waveform_edges[waveform]
+        return None
+
+    def _track_digital_edges(self, digital_samples, is_first_chunk):
+        """ Collects the rising and falling edges of the digital channels of the waveform that is
+        currently written.
+
+        @param dict digital_samples: the digital samples of the written chunk
+        @param bool is_first_chunk: Flag indicating if it is the first chunk of the waveform
+        """
+        if is_first_chunk or self._pending_edges is None:
+            self._pending_edges = ({chnl: (np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64'))
+                                    for chnl in digital_samples}, 0)
+        edges, offset = self._pending_edges
+        number_of_samples = 0
+        for chnl, samples in digital_samples.items():
+            rising, falling = edges.get(chnl, (np.zeros(0, dtype='int64'),) * 2)
+            samples = np.asarray(samples, dtype=bool)
+            number_of_samples = len(samples)
+            # The channel is high at the start of the chunk if there are more rising than falling
+            # edges up to here
+            was_high = len(rising) > len(falling)
+            states = np.concatenate(([was_high], samples)).astype('int8')
+            changes = np.flatnonzero(np.diff(states))
+            changes += offset
+            if was_high:
+                falling = np.concatenate((falling, changes[0::2]))
+                rising = np.concatenate((rising, changes[1::2]))
+            else:
+                rising = np.concatenate((rising, changes[0::2]))
+                falling = np.concatenate((falling, changes[1::2]))
+            edges[chnl] = (rising, falling)
+        self._pending_edges = (edges, offset + number_of_samples)
+
     def clear_all(self):
         """ Clears all loaded waveform from the pulse generators RAM.
 
@@ -554,6 +613,7 @@ class PulserDummy(Base, PulserInterface):
         self.current_loaded_assets = dict()
         self.waveform_set = set()
         self.sequence_dict = dict()
+        self._waveform_edges = dict()
         return 0
 
     def get_status(self):
@@ -24,6 +24,8 @@ from collections import OrderedDict
 from copy import copy
 import time
 import datetime
+import weakref
+import zlib
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
@@ -41,6 +43,52 @@ class OldConfigFileError(Exception):
         super().__init__('Old configuration file detected. Ignoring confocal history.')
 
 
+class ConfocalHistoryImage:
+    """ Read-only image of the confocal history.
+
+    History entries containing the same image share one instance. The wrapped array is frozen, so
+    the confocal logic has to copy it before scanning into it again (copy-on-write). Images that
+    are not displayed are kept zlib compressed and are decompressed again when accessed.
+    """
+
+    def __init__(self, image):
+        image.flags.writeable = False
+        self._image = image
+        self._source = weakref.ref(image)
+        self._compressed = None
+        self.shape = image.shape
+        self.dtype = image.dtype
+
+    @property
+    def image(self):
+        """ The image array, decompressed if needed. The array is read-only. """
+        if self._image is not None:
+            return self._image
+        image = np.frombuffer(zlib.decompress(self._compressed), dtype=self.dtype)
+        image = image.reshape(self.shape)
+        self._source = weakref.ref(image)
+        return image
+
+    def is_image(self, image):
+        """ Check if an array is the one handed out by this history image.
+
+        @param numpy.ndarray image: the array to check
+
+        @return bool: True if the array contains this history image
+        """
+        return self._source() is image
+
+    def compress(self):
+        """ Release the image array and keep a compressed copy instead.
+            Memory-mapped images are already backed by a file and are left untouched.
+        """
+        if self._image is None or isinstance(self._image, np.memmap):
+            return
+        if self._compressed is None:
+            self._compressed = zlib.compress(np.ascontiguousarray(self._image), 1)
+        self._image = None
+
+
 class ConfocalHistoryEntry(QtCore.QObject):
     """ This class contains all relevant parameters of a Confocal scan.
         It provides methods to extract, restore and serialize this data.
@@ -133,17 +181,17 @@ class ConfocalHistoryEntry(QtCore.QObject):
         confocal.initialize_image()
         try:
             if confocal.xy_image.shape == self.xy_image.shape:
-                confocal.xy_image = np.copy(self.xy_image)
+                confocal.xy_image = self.xy_image.image
         except AttributeError:
-            self.xy_image = np.copy(confocal.xy_image)
+            self.xy_image = confocal._get_history_image(confocal.xy_image)
 
         confocal._zscan = True
         confocal.initialize_image()
         try:
             if confocal.depth_image.shape == self.depth_image.shape:
-                confocal.depth_image = np.copy(self.depth_image)
+                confocal.depth_image = self.depth_image.image
         except AttributeError:
-            self.depth_image = np.copy(confocal.depth_image)
+            self.depth_image = confocal._get_history_image(confocal.depth_image)
         confocal._zscan = False
 
     def snapshot(self, confocal):
@@ -172,11 +220,17 @@ class ConfocalHistoryEntry(QtCore.QObject):
         self.point1 = np.copy(confocal.point1)
         self.point2 = np.copy(confocal.point2)
         self.point3 = np.copy(confocal.point3)
-        self.xy_image = np.copy(confocal.xy_image)
-        self.depth_image = np.copy(confocal.depth_image)
+        self.xy_image = confocal._get_history_image(confocal.xy_image)
+        self.depth_image = confocal._get_history_image(confocal.depth_image)
+
+    def serialize(self, image_refs=None, name=None):
+        """ Give out a dictionary that can be saved via the usual means
 
-    def serialize(self):
-        """ Give out a dictionary that can be saved via the usual means """
+        @param dict image_refs: optional, names of the already serialized entries with their
+                                history images as keys. Images shared with one of these entries
+                                are replaced by the name of that entry.
+        @param str name: optional, name of this entry to register its images in image_refs
+        """
         serialized = dict()
         serialized['focus_position'] = [self.current_x, self.current_y, self.current_z, self.current_a]
         serialized['x_range'] = list(self.image_x_range)
@@ -197,12 +251,22 @@ class ConfocalHistoryEntry(QtCore.QObject):
         serialized['tilt_point3'] = list(self.point3)
         serialized['tilt_reference'] = [self.tilt_reference_x, self.tilt_reference_y]
         serialized['tilt_slope'] = [self.tilt_slope_x, self.tilt_slope_y]
-        serialized['xy_image'] = self.xy_image
-        serialized['depth_image'] = self.depth_image
+        for key, history_image in (('xy_image', self.xy_image),
+                                   ('depth_image', self.depth_image)):
+            if image_refs is not None and history_image in image_refs:
+                serialized[key] = image_refs[history_image]
+            else:
+                serialized[key] = history_image.image
+                if image_refs is not None:
+                    image_refs[history_image] = name
         return serialized
 
-    def deserialize(self, serialized):
-        """ Restore Confocal history object from a dict """
+    def deserialize(self, serialized, history=None):
+        """ Restore Confocal history object from a dict
+
+        @param dict serialized: the serialized entry
+        @param dict history: optional, already restored entries by name to resolve shared images
+        """
         if 'focus_position' in serialized and len(serialized['focus_position']) == 4:
             self.current_x = serialized['focus_position'][0]
             self.current_y = serialized['focus_position'][1]
@@ -236,14 +300,16 @@ class ConfocalHistoryEntry(QtCore.QObject):
             self.point2 = np.array(serialized['tilt_point2'])
         if 'tilt_point3' in serialized and len(serialized['tilt_point3']) == 3:
             self.point3 = np.array(serialized['tilt_point3'])
-        if 'xy_image' in serialized:
-            if isinstance(serialized['xy_image'], np.ndarray):
-                self.xy_image = serialized['xy_image']
-            else:
-                raise OldConfigFileError()
-        if 'depth_image' in serialized:
-            if isinstance(serialized['depth_image'], np.ndarray):
-                self.depth_image = serialized['depth_image'].copy()
+        for key in ('xy_image', 'depth_image'):
+            if key not in serialized:
+                continue
+            image = serialized[key]
+            if isinstance(image, np.ndarray):
+                setattr(self, key, ConfocalHistoryImage(image))
+            elif isinstance(image, str) and image.startswith('history_'):
+                if history is None or image not in history:
+                    raise ValueError('Image shared with {0} is not available.'.format(image))
+                setattr(self, key, getattr(history[image], key))
             else:
                 raise OldConfigFileError()
 
@@ -316,12 +382,14 @@ class ConfocalLogic(GenericLogic):
 
         # restore here ...
         self.history = []
+        restored_history = dict()
         for i in reversed(range(1, self.max_history_length)):
             try:
                 new_history_item = ConfocalHistoryEntry(self)
                 new_history_item.deserialize(
-                    self._statusVariables['history_{0}'.format(i)])
+                    self._statusVariables['history_{0}'.format(i)], restored_history)
                 self.history.append(new_history_item)
+                restored_history['history_{0}'.format(i)] = new_history_item
             except KeyError:
                 pass
             except OldConfigFileError:
@@ -332,7 +400,7 @@ class ConfocalLogic(GenericLogic):
                         'Restoring history {0} failed.'.format(i))
         try:
             new_state = ConfocalHistoryEntry(self)
-            new_state.deserialize(self._statusVariables['history_0'])
+            new_state.deserialize(self._statusVariables['history_0'], restored_history)
             new_state.restore(self)
         except:
             new_state = ConfocalHistoryEntry(self)
@@ -341,6 +409,7 @@ class ConfocalLogic(GenericLogic):
             self.history.append(new_state)
 
         self.history_index = len(self.history) - 1
+        self._compress_history()
 
         # Sets connections between signals and functions
         self.signal_scan_lines_next.connect(self._scan_line, QtCore.Qt.QueuedConnection)
@@ -364,10 +433,14 @@ class ConfocalLogic(GenericLogic):
         closing_state = ConfocalHistoryEntry(self)
         closing_state.snapshot(self)
         self.history.append(closing_state)
-        histindex = 0
-        for state in reversed(self.history):
-            self._statusVariables['history_{0}'.format(histindex)] = state.serialize()
-            histindex += 1
+        # Older entries are saved first, so newer entries sharing an image can refer to them.
+        saved_history = self.history[-max(self.max_history_length, 1):]
+        image_refs = dict()
+        histindex = len(saved_history) - 1
+        for state in saved_history:
+            name = 'history_{0}'.format(histindex)
+            self._statusVariables[name] = state.serialize(image_refs, name)
+            histindex -= 1
         return 0
 
     def switch_hardware(self, to_on=False):
@@ -756,9 +829,17 @@ class ConfocalLogic(GenericLogic):
                 if len(self.history) > self.max_history_length:
                     self.history.pop(0)
                 self.history_index = len(self.history) - 1
+                self._compress_history()
                 return
 
         image = self.depth_image if self._zscan else self.xy_image
+        if not image.flags.writeable:
+            # The image is shared with the history, scan into a copy of it
+            image = image.copy()
+            if self._zscan:
+                self.depth_image = image
+            else:
+                self.xy_image = image
         n_ch = len(self.get_scanner_axes())
         s_ch = len(self.get_scanner_count_channels())
 
@@ -1269,12 +1350,46 @@ class ConfocalLogic(GenericLogic):
         self._scanning_device.tilt_reference_y = self._scanning_device.get_scanner_position()[1]
         self.signal_tilt_correction_active.emit(enabled)
 
+    def _get_history_image(self, image):
+        """ Get the history image of an image array, shared with existing history entries.
+
+        @param numpy.ndarray image: xy or depth image array
+
+        @return ConfocalHistoryImage: history image containing the array
+        """
+        for history_image in self._get_history_images():
+            if history_image.is_image(image):
+                return history_image
+        return ConfocalHistoryImage(image)
+
+    def _get_history_images(self):
+        """ Get all images held by the history entries.
+
+        @return list(ConfocalHistoryImage): history images
+        """
+        history_images = list()
+        for state in self.history:
+            for key in ('xy_image', 'depth_image'):
+                history_image = getattr(state, key, None)
+                if history_image is not None and history_image not in history_images:
+                    history_images.append(history_image)
+        return history_images
+
+    def _compress_history(self):
+        """ Compress all history images that are not currently displayed.
+        """
+        for history_image in self._get_history_images():
+            if not (history_image.is_image(self.xy_image)
+                    or history_image.is_image(self.depth_image)):
+                history_image.compress()
+
     def history_forward(self):
         """ Move forward in confocal image history.
         """
         if self.history_index < len(self.history) - 1:
             self.history_index += 1
             self.history[self.history_index].restore(self)
+            self._compress_history()
             self.signal_xy_image_updated.emit()
             self.signal_depth_image_updated.emit()
             self.signal_tilt_correction_update.emit()
@@ -1289,6 +1404,7 @@ class ConfocalLogic(GenericLogic):
         if self.history_index > 0:
             self.history_index -= 1
             self.history[self.history_index].restore(self)
+            self._compress_history()
             self.signal_xy_image_updated.emit()
             self.signal_depth_image_updated.emit()
             self.signal_tilt_correction_update.emit()
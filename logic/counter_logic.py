@@ -27,6 +27,7 @@ import matplotlib.pyplot as plt
 
 from core.connector import Connector
 from core.statusvariable import StatusVar
+from core.util.buffers import RecordBuffer, RingBuffer
 from logic.generic_logic import GenericLogic
 from interface.slow_counter_interface import CountingMode
 from core.util.mutex import Mutex
@@ -111,11 +112,10 @@ class CounterLogic(GenericLogic):
         number_of_detectors = constraints.max_detectors
 
         # initialize data arrays
-        self.countdata = np.zeros([len(self.get_channels()), self._count_length])
-        self.countdata_smoothed = np.zeros([len(self.get_channels()), self._count_length])
+        self._init_count_buffers()
         self.rawdata = np.zeros([len(self.get_channels()), self._counting_samples])
         self._already_counted_samples = 0  # For gated counting
-        self._data_to_save = []
+        self._data_to_save = RecordBuffer()
 
         # Flag to stop the loop
         self.stopRequested = False
@@ -139,6 +139,35 @@ class CounterLogic(GenericLogic):
         self.sigCountDataNext.disconnect()
         return
 
+    @property
+    def countdata(self):
+        """ Count trace of all channels (oldest sample first) as a view on the ring buffer.
+
+        The view is not a snapshot: the ring buffer is rotated when new counts arrive, so the view
+        then shows the trace shifted with the newest samples at the front. Copy the data if it is
+        kept beyond the sigCounterUpdated handler, e.g. when it is passed to a plot.
+
+        @return numpy.ndarray: 2D array, dim 0: channel, dim 1: sample
+        """
+        return self._countdata_buffer.data
+
+    @property
+    def countdata_smoothed(self):
+        """ Median filtered count trace of all channels as a view on the ring buffer. Like
+        countdata, the view is overwritten with newer samples and has to be copied to be kept.
+
+        @return numpy.ndarray: 2D array, dim 0: channel, dim 1: sample
+        """
+        return self._countdata_smoothed_buffer.data
+
+    def _init_count_buffers(self):
+        """ Creates empty ring buffers of count_length samples for the count traces.
+        """
+        channels = len(self.get_channels())
+        self._countdata_buffer = RingBuffer(self._count_length, channels=channels)
+        self._countdata_smoothed_buffer = RingBuffer(self._count_length, channels=channels)
+        return
+
     def get_hardware_constraints(self):
         """
         Retrieve the hardware constrains from the counter device.
@@ -262,7 +291,7 @@ class CounterLogic(GenericLogic):
         @return bool: saving state
         """
         if not resume:
-            self._data_to_save = []
+            self._data_to_save = RecordBuffer()
             self._saving_start_time = time.time()
 
         self._saving = True
@@ -307,11 +336,11 @@ class CounterLogic(GenericLogic):
             for i, detector in enumerate(self.get_channels()):
                 header = header + ',Signal{0} (counts/s)'.format(i)
 
-            data = {header: self._data_to_save}
+            data = {header: self._data_to_save.data}
             filepath = self._save_logic.get_path_for_module(module_name='Counter')
 
             if save_figure:
-                fig = self.draw_figure(data=np.array(self._data_to_save))
+                fig = self.draw_figure(data=self._data_to_save.data)
             else:
                 fig = None
             self._save_logic.save_data(data, filepath=filepath, parameters=parameters,
@@ -425,8 +454,7 @@ class CounterLogic(GenericLogic):
 
             # initialising the data arrays
             self.rawdata = np.zeros([len(self.get_channels()), self._counting_samples])
-            self.countdata = np.zeros([len(self.get_channels()), self._count_length])
-            self.countdata_smoothed = np.zeros([len(self.get_channels()), self._count_length])
+            self._init_count_buffers()
             self._sampling_data = np.empty([len(self.get_channels()), self._counting_samples])
 
             # the sample index for gated counting
@@ -552,39 +580,27 @@ class CounterLogic(GenericLogic):
         Processes the raw data from the counting device
         @return:
         """
-        for i, ch in enumerate(self.get_channels()):
-            # remember the new count data in circular array
-            self.countdata[i, 0] = np.average(self.rawdata[i])
-        # move the array to the left to make space for the new data
-        self.countdata = np.roll(self.countdata, -1, axis=1)
-        # also move the smoothing array
-        self.countdata_smoothed = np.roll(self.countdata_smoothed, -1, axis=1)
-        # calculate the median and save it
-        window = -int(self._smooth_window_length / 2) - 1
-        for i, ch in enumerate(self.get_channels()):
-            self.countdata_smoothed[i, window:] = np.median(self.countdata[i,
-                                                            -self._smooth_window_length:])
+        # remember the averaged new count data in the circular buffer
+        self._countdata_buffer.append(np.average(self.rawdata, axis=1))
+        self._update_smoothed_countdata()
 
         # save the data if necessary
         if self._saving:
-             # if oversampling is necessary
+            timestamp = time.time() - self._saving_start_time
+            # if oversampling is necessary
             if self._counting_samples > 1:
                 # TODO: Incorrect time and count rate for first point in oversampled series
-                chans = self.get_channels()
-                self._sampling_data = np.empty([len(chans) + 1, self._counting_samples])
-                self._sampling_data[0, :] = time.time() - self._saving_start_time
-                for i, ch in enumerate(chans):
-                    self._sampling_data[i+1, 0] = self.rawdata[i]
-
-                self._data_to_save.extend(list(self._sampling_data))
+                # one record (timestamp, counts of each channel) for each sample
+                self._sampling_data = np.empty([self._counting_samples, self.rawdata.shape[0] + 1])
+                self._sampling_data[:, 0] = timestamp
+                self._sampling_data[:, 1:] = np.transpose(self.rawdata)
+                self._data_to_save.extend(self._sampling_data)
             # if we don't want to use oversampling
             else:
                 # append tuple to data stream (timestamp, average counts)
-                chans = self.get_channels()
-                newdata = np.empty((len(chans) + 1, ))
-                newdata[0] = time.time() - self._saving_start_time
-                for i, ch in enumerate(chans):
-                    newdata[i+1] = self.countdata[i, -1]
+                newdata = np.empty((self.rawdata.shape[0] + 1, ))
+                newdata[0] = timestamp
+                newdata[1:] = self.countdata[:, -1]
                 self._data_to_save.append(newdata)
         return
 
@@ -593,15 +609,9 @@ class CounterLogic(GenericLogic):
         Processes the raw data from the counting device
         @return:
         """
-        # remember the new count data in circular array
-        self.countdata[0] = np.average(self.rawdata[0])
-        # move the array to the left to make space for the new data
-        self.countdata = np.roll(self.countdata, -1)
-        # also move the smoothing array
-        self.countdata_smoothed = np.roll(self.countdata_smoothed, -1)
-        # calculate the median and save it
-        self.countdata_smoothed[-int(self._smooth_window_length / 2) - 1:] = np.median(
-            self.countdata[-self._smooth_window_length:])
+        # remember the averaged new count data in the circular buffer
+        self._countdata_buffer.append(np.average(self.rawdata, axis=1))
+        self._update_smoothed_countdata()
 
         # save the data if necessary
         if self._saving:
@@ -610,12 +620,12 @@ class CounterLogic(GenericLogic):
                 self._sampling_data = np.empty((self._counting_samples, 2))
                 self._sampling_data[:, 0] = time.time() - self._saving_start_time
                 self._sampling_data[:, 1] = self.rawdata[0]
-                self._data_to_save.extend(list(self._sampling_data))
+                self._data_to_save.extend(self._sampling_data)
             # if we don't want to use oversampling
             else:
                 # append tuple to data stream (timestamp, average counts)
-                self._data_to_save.append(np.array((time.time() - self._saving_start_time,
-                                                    self.countdata[-1])))
+                self._data_to_save.append((time.time() - self._saving_start_time,
+                                           self.countdata[0, -1]))
         return
 
     def _process_data_finite_gated(self):
@@ -623,19 +633,31 @@ class CounterLogic(GenericLogic):
         Processes the raw data from the counting device
         @return:
         """
-        if self._already_counted_samples+len(self.rawdata[0]) >= len(self.countdata):
-            needed_counts = len(self.countdata) - self._already_counted_samples
-            self.countdata[0:needed_counts] = self.rawdata[0][0:needed_counts]
-            self.countdata = np.roll(self.countdata, -needed_counts)
+        samples = self.rawdata
+        if self._already_counted_samples + samples.shape[1] >= self._count_length:
+            # only take the samples needed to complete the trace
+            needed_counts = self._count_length - self._already_counted_samples
+            self._countdata_buffer.append(samples[:, :needed_counts])
             self._already_counted_samples = 0
             self.stopRequested = True
         else:
-            # replace the first part of the array with the new data:
-            self.countdata[0:len(self.rawdata[0])] = self.rawdata[0]
-            # roll the array by the amount of data it had been inserted:
-            self.countdata = np.roll(self.countdata, -len(self.rawdata[0]))
+            self._countdata_buffer.append(samples)
             # increment the index counter:
-            self._already_counted_samples += len(self.rawdata[0])
+            self._already_counted_samples += samples.shape[1]
+        return
+
+    def _update_smoothed_countdata(self):
+        """
+        Calculates the median of the newest smooth_window_length samples and writes it to the
+        newest half window of the smoothed count trace. Only the window is evaluated, so the cost
+        does not depend on count_length.
+        """
+        window = max(min(int(self._smooth_window_length), self._count_length), 1)
+        median = np.median(self.countdata[:, -window:], axis=1)
+        # the smoothed trace is advanced along with the count trace
+        self._countdata_smoothed_buffer.append(median)
+        self._countdata_smoothed_buffer.fill_newest(int(self._smooth_window_length / 2) + 1,
+                                                    median)
         return
 
     def _stopCount_wait(self, timeout=5.0):
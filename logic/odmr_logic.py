@@ -25,12 +25,14 @@ from collections import OrderedDict
 from interface.microwave_interface import MicrowaveMode
 from interface.microwave_interface import TriggerEdge
 import numpy as np
+import os
 import time
 import datetime
 import matplotlib.pyplot as plt
 
 from logic.generic_logic import GenericLogic
 from core.util.mutex import Mutex
+from core.util.buffers import LineStore
 from core.connector import Connector
 from core.configoption import ConfigOption
 from core.statusvariable import StatusVar
@@ -54,6 +56,10 @@ class ODMRLogic(GenericLogic):
         'LIST',
         missing='warn',
         converter=lambda x: MicrowaveMode[x.upper()])
+    # Number of the newest sweeps kept in memory. Older sweeps are dropped unless a spill directory
+    # is given, in which case all sweeps are also written to a raw data file in this directory.
+    raw_data_memory_lines = ConfigOption('raw_data_memory_lines', 10000, missing='nothing')
+    raw_data_spill_dir = ConfigOption('raw_data_spill_dir', None, missing='nothing')
 
     clock_frequency = StatusVar('clock_frequency', 200)
     cw_mw_frequency = StatusVar('cw_mw_frequency', 2870e6)
@@ -132,12 +138,9 @@ class ODMRLogic(GenericLogic):
 
         # Initalize the ODMR data arrays (mean signal and sweep matrix)
         self._initialize_odmr_plots()
-        # Raw data array
-        self.odmr_raw_data = np.zeros(
-            [self.number_of_lines,
-             len(self._odmr_counter.get_odmr_channels()),
-             self.odmr_plot_x.size]
-        )
+        # Raw data store
+        self._raw_data_store = None
+        self._initialize_raw_data_store()
 
         # Switch off microwave and set CW frequency and power
         self.mw_off()
@@ -164,6 +167,8 @@ class ODMRLogic(GenericLogic):
                 break
         # Switch off microwave source for sure (also if CW mode is active or module is still locked)
         self._mw_device.off()
+        # Remove the raw data spill file
+        self._raw_data_store.close()
         # Disconnect signals
         self.sigNextLine.disconnect()
 
@@ -241,6 +246,30 @@ class ODMRLogic(GenericLogic):
         self.sigOdmrFitUpdated.emit(self.odmr_fit_x, self.odmr_fit_y, {}, current_fit)
         return
 
+    @property
+    def odmr_raw_data(self):
+        """ The sweeps kept in memory, newest sweep first.
+
+        @return numpy.ndarray: 3D array, dim 0: sweep, dim 1: channel, dim 2: frequency
+        """
+        return self._raw_data_store.window
+
+    def _initialize_raw_data_store(self):
+        """ Creates an empty raw data store for the current frequency list and channels. """
+        if self._raw_data_store is not None:
+            self._raw_data_store.close()
+        if self.raw_data_spill_dir is None:
+            spill_path = None
+        else:
+            spill_path = os.path.join(self.raw_data_spill_dir, 'odmr_raw_data.dat')
+        self._raw_data_store = LineStore(
+            line_shape=(len(self._odmr_counter.get_odmr_channels()), self.odmr_plot_x.size),
+            window_size=max(self.raw_data_memory_lines, self.number_of_lines),
+            average_length=self.lines_to_average,
+            spill_path=spill_path,
+            initial_size=self.number_of_lines)
+        return
+
     def set_trigger(self, trigger_pol, frequency):
         """
         Set trigger polarity of external microwave trigger (for list and sweep mode).
@@ -272,18 +301,9 @@ class ODMRLogic(GenericLogic):
         """
         self.lines_to_average = int(lines_to_average)
 
-        if self.lines_to_average <= 0:
-            self.odmr_plot_y = np.mean(
-                self.odmr_raw_data[:max(1, self.elapsed_sweeps), :, :],
-                axis=0,
-                dtype=np.float64
-            )
-        else:
-            self.odmr_plot_y = np.mean(
-                self.odmr_raw_data[:max(1, min(self.lines_to_average, self.elapsed_sweeps)), :, :],
-                axis=0,
-                dtype=np.float64
-            )
+        with self.threadlock:
+            self._raw_data_store.set_average_length(self.lines_to_average)
+            self.odmr_plot_y = self._raw_data_store.mean
 
         self.sigOdmrPlotsUpdated.emit(self.odmr_plot_x, self.odmr_plot_y, self.odmr_plot_xy)
         self.sigParameterUpdated.emit({'average_length': self.lines_to_average})
@@ -668,18 +688,8 @@ class ODMRLogic(GenericLogic):
                 return -1
 
             self._initialize_odmr_plots()
-            # initialize raw_data array
-            estimated_number_of_lines = self.run_time * self.clock_frequency / self.odmr_plot_x.size
-            estimated_number_of_lines = int(1.5 * estimated_number_of_lines)  # Safety
-            if estimated_number_of_lines < self.number_of_lines:
-                estimated_number_of_lines = self.number_of_lines
-            self.log.debug('Estimated number of raw data lines: {0:d}'
-                           ''.format(estimated_number_of_lines))
-            self.odmr_raw_data = np.zeros(
-                [estimated_number_of_lines,
-                 len(self._odmr_counter.get_odmr_channels()),
-                 self.odmr_plot_x.size]
-            )
+            # initialize raw data store
+            self._initialize_raw_data_store()
             self.sigNextLine.emit()
             return 0
 
@@ -774,45 +784,17 @@ class ODMRLogic(GenericLogic):
                 self.sigNextLine.emit()
                 return
 
-            # Add new count data to raw_data array and append if array is too small
+            # Add new count data to the raw data store (newest sweep first)
             if self._clearOdmrData:
-                self.odmr_raw_data[:, :, :] = 0
+                self._raw_data_store.clear()
                 self._clearOdmrData = False
-            if self.elapsed_sweeps == (self.odmr_raw_data.shape[0] - 1):
-                expanded_array = np.zeros(self.odmr_raw_data.shape)
-                self.odmr_raw_data = np.concatenate((self.odmr_raw_data, expanded_array), axis=0)
-                self.log.warning('raw data array in ODMRLogic was not big enough for the entire '
-                                 'measurement. Array will be expanded.\nOld array shape was '
-                                 '({0:d}, {1:d}), new shape is ({2:d}, {3:d}).'
-                                 ''.format(self.odmr_raw_data.shape[0] - self.number_of_lines,
-                                           self.odmr_raw_data.shape[1],
-                                           self.odmr_raw_data.shape[0],
-                                           self.odmr_raw_data.shape[1]))
-
-            # shift data in the array "up" and add new data at the "bottom"
-            self.odmr_raw_data = np.roll(self.odmr_raw_data, 1, axis=0)
-
-            self.odmr_raw_data[0] = new_counts
-
-            # Add new count data to mean signal
-            if self._clearOdmrData:
-                self.odmr_plot_y[:, :] = 0
-
-            if self.lines_to_average <= 0:
-                self.odmr_plot_y = np.mean(
-                    self.odmr_raw_data[:max(1, self.elapsed_sweeps), :, :],
-                    axis=0,
-                    dtype=np.float64
-                )
-            else:
-                self.odmr_plot_y = np.mean(
-                    self.odmr_raw_data[:max(1, min(self.lines_to_average, self.elapsed_sweeps)), :, :],
-                    axis=0,
-                    dtype=np.float64
-                )
+            self._raw_data_store.add_line(new_counts)
+
+            # Mean signal from the running sums of the raw data store
+            self.odmr_plot_y = self._raw_data_store.mean
 
             # Set plot slice of matrix
-            self.odmr_plot_xy = self.odmr_raw_data[:self.number_of_lines, :, :]
+            self.odmr_plot_xy = self._raw_data_store.window[:self.number_of_lines].copy()
 
             # Update elapsed time/sweeps
             self.elapsed_sweeps += 1
@@ -897,8 +879,13 @@ class ODMRLogic(GenericLogic):
             else:
                 filelabel_raw = 'ODMR_data_ch{0}_raw'.format(nch)
 
+            raw_data = self._raw_data_store.get_lines(self.elapsed_sweeps)
+            if len(raw_data) < self.elapsed_sweeps:
+                self.log.warning('Only the newest {0:d} of {1:d} sweeps are kept in memory and '
+                                 'will be saved. Set the config option "raw_data_spill_dir" to '
+                                 'keep all sweeps.'.format(len(raw_data), self.elapsed_sweeps))
             data_raw = OrderedDict()
-            data_raw['count data (counts/s)'] = self.odmr_raw_data[:self.elapsed_sweeps, nch, :]
+            data_raw['count data (counts/s)'] = raw_data[:, nch, :]
             parameters = OrderedDict()
             parameters['Microwave CW Power (dBm)'] = self.cw_mw_power
             parameters['Microwave Sweep Power (dBm)'] = self.sweep_mw_power
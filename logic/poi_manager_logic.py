@@ -31,6 +31,7 @@ from core.statusvariable import StatusVar
 from datetime import datetime
 from logic.generic_logic import GenericLogic
 from qtpy import QtCore
+from scipy import ndimage
 from core.util.mutex import Mutex
 
 
@@ -1209,71 +1210,138 @@ class PoiManagerLogic(GenericLogic):
         arr_size = int(spot_size / pixel_size)
         return arr_size
 
-    def _is_spot_shape(self, local_arr):
-        unspot_e = 0
-        ensem_e = 0
-        len_arr = len(local_arr)
-        mid_f = int(0.5 * len_arr)
-        hm_local_arr = local_arr[mid_f].mean()
-        vm_local_arr = local_arr[:, mid_f].mean()
-        for i in range(0, len_arr):
-            if local_arr[i].mean() > hm_local_arr:
-                ensem_e += 1
-            if local_arr[:, i].mean() > vm_local_arr:
-                ensem_e += 1
-            if hm_local_arr > vm_local_arr * 1.2:
-                unspot_e += 1
-            if vm_local_arr > hm_local_arr * 1.2:
-                unspot_e += 1
-        if ensem_e > 4:
-            return False
-        elif unspot_e > 1:
-            return False
-        else:
-            return True
+    @staticmethod
+    def _window_sums(scan, size, axis):
+        """ Sums over all windows of a given size along one axis of an image.
+
+        @param numpy.ndarray scan: 2D image
+        @param int size: window size in pixels
+        @param int axis: axis to sum along
+
+        @return numpy.ndarray: window sums, index i along axis is the window starting at pixel i
+        """
+        cumulative = np.insert(np.cumsum(scan, axis=axis), 0, 0, axis=axis)
+        length = cumulative.shape[axis]
+        return (np.take(cumulative, np.arange(size, length), axis=axis)
+                - np.take(cumulative, np.arange(length - size), axis=axis))
 
     def _local_max(self, scan):
-        scan = np.asarray(scan, order="C")  # scan has to be a 2-D array
+        """ Finds the spot-shaped local maxima of a scan image.
+
+        A pixel is a local maximum if it is the maximum of the filter window around it, the mean of
+        the window exceeds half the POI threshold and the window is spot-shaped: At most 4 rows and
+        columns of the window have a higher mean than the middle row and column, respectively, and
+        the means of the middle row and column differ by less than 20%.
+
+        @param numpy.ndarray scan: 2D scan image
+
+        @return (numpy.ndarray, numpy.ndarray): first and second indices of the local maxima
+        """
+        scan = np.asarray(scan, dtype=float)
         filter_size = self._spot_filter(scan)
-        scan_m = scan.mean()
-        mid_f = int(filter_size / 2)
-        xc = []
-        yc = []
-        for i in range(0, len(scan) - filter_size):
-            for j in range(0, len(scan[i]) - filter_size):
-                local_arr = scan[i:i + filter_size, j:j + filter_size]
-                local_arr = np.asarray(local_arr)
-                arr_threshold = scan_m * self._poi_threshold * 0.5
-                if scan[i + mid_f][j + mid_f] == local_arr.max() and self._is_spot_shape(local_arr) and local_arr.mean() > arr_threshold:
-                    xc.append(i + mid_f)
-                    yc.append(j + mid_f)
-        return xc, yc
-
-    def auto_catch_poi(self):
-        scan_image = self.roi_scan_image.T
+        # Top left corners of all windows considered
+        n_first = scan.shape[0] - filter_size
+        n_second = scan.shape[1] - filter_size
+        if filter_size < 1 or n_first < 1 or n_second < 1:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        mid_f = filter_size // 2
+        arr_threshold = scan.mean() * self._poi_threshold * 0.5
+
+        # Sums of the rows and columns of all windows
+        row_sums = self._window_sums(scan, filter_size, axis=1)
+        column_sums = self._window_sums(scan, filter_size, axis=0)
+        window_means = self._window_sums(row_sums, filter_size, axis=0) / filter_size ** 2
+
+        is_max = ndimage.maximum_filter(scan, size=filter_size, mode='nearest') == scan
+        candidates = is_max[mid_f:mid_f + n_first, mid_f:mid_f + n_second]
+        candidates &= window_means[:n_first, :n_second] > arr_threshold
+        first, second = np.nonzero(candidates)
+
+        # Shape criterion for the remaining candidates
+        offsets = np.arange(filter_size)
+        row_means = row_sums[first[:, np.newaxis] + offsets, second[:, np.newaxis]] / filter_size
+        column_means = column_sums[first[:, np.newaxis], second[:, np.newaxis] + offsets] \
+            / filter_size
+        hm_local_arr = row_means[:, mid_f]
+        vm_local_arr = column_means[:, mid_f]
+        ensem_e = np.count_nonzero(row_means > hm_local_arr[:, np.newaxis], axis=1) \
+            + np.count_nonzero(column_means > vm_local_arr[:, np.newaxis], axis=1)
+        unspot = (hm_local_arr > vm_local_arr * 1.2) | (vm_local_arr > hm_local_arr * 1.2)
+        if filter_size < 2:
+            unspot[:] = False
+        is_spot = (ensem_e <= 4) & ~unspot
+        return first[is_spot] + mid_f, second[is_spot] + mid_f
+
+    def _centroid_offsets(self, scan, first, second):
+        """ Sub-pixel offsets of the intensity centroids around local maxima.
+
+        @param numpy.ndarray scan: 2D scan image
+        @param numpy.ndarray first: first indices of the local maxima
+        @param numpy.ndarray second: second indices of the local maxima
+
+        @return (numpy.ndarray, numpy.ndarray): centroid offsets in pixels along both axes
+        """
+        mid_f = self._spot_filter(scan) // 2
+        offsets = np.arange(-mid_f, mid_f + 1)
+        first_idx = np.clip(first[:, np.newaxis, np.newaxis] + offsets[:, np.newaxis],
+                            0, scan.shape[0] - 1)
+        second_idx = np.clip(second[:, np.newaxis, np.newaxis] + offsets, 0, scan.shape[1] - 1)
+        windows = scan[first_idx, second_idx]
+        # Weights above the local background
+        windows = windows - windows.min(axis=(1, 2), keepdims=True)
+        total = windows.sum(axis=(1, 2))
+        total[total == 0] = 1
+        first_offset = (windows.sum(axis=2) * offsets).sum(axis=1) / total
+        second_offset = (windows.sum(axis=1) * offsets).sum(axis=1) / total
+        return first_offset, second_offset
+
+    @QtCore.Slot()
+    @QtCore.Slot(bool)
+    def auto_catch_poi(self, subpixel=False):
+        """ Adds POIs at all spot-shaped local maxima of the ROI scan image exceeding the POI
+        threshold.
+
+        @param bool subpixel: optional, place the POIs at the intensity centroids of the spots
+                              instead of the brightest pixels
+        """
+        scan_image = np.trunc(np.asarray(self.roi_scan_image, dtype=float).T)
         x_range = self.roi_scan_image_extent[0]
         y_range = self.roi_scan_image_extent[1]
-        x_axis = np.arange(x_range[0], x_range[1], (x_range[1] - x_range[0]) / len(scan_image))
-        y_axis = np.arange(y_range[0], y_range[1], (y_range[1] - y_range[0]) / len(scan_image[0]))
-
-        for i in range(0, len(scan_image)):
-            for j in range(0, len(scan_image[i])):
-                scan_image[i][j] = int(scan_image[i][j])  # data here somehow needs to be reset, otherwise shit happens.
+        x_step = (x_range[1] - x_range[0]) / scan_image.shape[0]
+        y_step = (y_range[1] - y_range[0]) / scan_image.shape[1]
 
         threshold = scan_image.mean() * self._poi_threshold
 
-        xc1, yc1 = self._local_max(scan_image)
-        xc2 = []
-        yc2 = []
-        for i in range(0, len(xc1)):
-            if scan_image[xc1[i], yc1[i]] > threshold:
-                xc2.append(xc1[i])
-                yc2.append(yc1[i])
-
-        pois = np.zeros((len(xc2), 3))
-        z = self.scanner_position[2]
-        for i in range(0, len(pois)):
-            pois[i] = [x_axis[xc2[i]], y_axis[yc2[i]], z]
-            self.add_poi(pois[i])
-            if self.poi_nametag is None:
-                time.sleep(0.1)
+        xc, yc = self._local_max(scan_image)
+        above_threshold = scan_image[xc, yc] > threshold
+        xc = xc[above_threshold]
+        yc = yc[above_threshold]
+        if len(xc) == 0:
+            return
+
+        x_pos = xc.astype(float)
+        y_pos = yc.astype(float)
+        if subpixel:
+            x_offset, y_offset = self._centroid_offsets(scan_image, xc, yc)
+            x_pos += x_offset
+            y_pos += y_offset
+
+        pois = np.empty((len(xc), 3))
+        pois[:, 0] = x_range[0] + x_pos * x_step
+        pois[:, 1] = y_range[0] + y_pos * y_step
+        pois[:, 2] = self.scanner_position[2]
+
+        # Add all POIs and notify about the new POI set once. Without POI name tag, unique names
+        # are created from a common time stamp.
+        if self.poi_nametag is None:
+            name_base = datetime.now().strftime('poi_%Y%m%d%H%M%S%f')
+            names = ['{0}_{1:d}'.format(name_base, i) for i in range(len(pois))]
+        else:
+            names = [None] * len(pois)
+        current_poi_set = set(self.poi_names)
+        for position, name in zip(pois, names):
+            self._roi.add_poi(position=position, name=name)
+        new_pois = [name for name in self.poi_names if name not in current_poi_set]
+        self.sigRoiUpdated.emit({'pois': self.poi_positions})
+        self.set_active_poi(new_pois[-1])
+        return
@@ -217,6 +217,7 @@ class PressureMonitorLogic(GenericLogic):
             # Only save figure if list is not empty to prevent IndexError
             fig = self.draw_figure(data=np.array(self._data_to_save))
             self._save_logic.save_figure(plotfig=fig, filepath=self.filepath, filename=self.filename)
+        self._save_logic.close_stream(filepath=self.filepath, filename=self.filename)
 
         self._saving = False
         self.sigSavingStatusChanged.emit(self._saving)
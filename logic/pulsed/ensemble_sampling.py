@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi helper functions to sample compiled PulseBlockEnsembles, also in
+separate worker processes.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import importlib.util
+import numpy as np
+
+
+def sample_compiled_chunk(compiled, chunk_start, chunk_length, analog_samples, digital_samples):
+    """ Calculates the samples of a compiled PulseBlockEnsemble for the sample range
+    [chunk_start, chunk_start + chunk_length) and writes them into the provided sample arrays.
+
+    Element occurrences are clipped to the chunk boundaries. All clipped occurrences of each
+    channel sharing the same sampling function and length are evaluated with a single call on
+    a 2D (time offset x sample) grid, unless the sampling function is not elementwise.
+    The resulting samples are identical to sampling each element on its own.
+
+    @param dict compiled: compiled ensemble (see SequenceGeneratorLogic._compile_block_ensemble)
+    @param int chunk_start: index of the first sample of the chunk within the ensemble
+    @param int chunk_length: number of samples in the chunk
+    @param dict analog_samples: float32 sample arrays of at least chunk_length for each analog
+                                channel to write into
+    @param dict digital_samples: bool sample arrays of at least chunk_length for each digital
+                                 channel to write into
+    """
+    chunk_end = chunk_start + chunk_length
+    starts = compiled['starts']
+    ends = starts + compiled['lengths']
+
+    # Element occurrences overlapping with the chunk and their clipped ranges
+    first = np.searchsorted(ends, chunk_start, side='right')
+    last = np.searchsorted(starts, chunk_end, side='left')
+    indices = compiled['element_indices'][first:last]
+    piece_starts = np.maximum(starts[first:last], chunk_start)
+    piece_lengths = np.minimum(ends[first:last], chunk_end) - piece_starts
+    positions = piece_starts - chunk_start
+    if compiled['rotating_frame']:
+        time_offsets = compiled['offset_bin'] + piece_starts
+    else:
+        time_offsets = np.full(len(piece_starts), compiled['offset_bin'], dtype='int64')
+
+    # Digital channels are constant within each element
+    for chnl, states in compiled['digital_states'].items():
+        digital_samples[chnl][:chunk_length] = np.repeat(states[indices], piece_lengths)
+
+    # Group the pieces of each analog channel by sampling function and length
+    sample_rate = compiled['sample_rate']
+    for chnl, functions in compiled['functions'].items():
+        norm = compiled['analog_norms'][chnl]
+        key_base = int(piece_lengths.max()) + 1 if len(piece_lengths) > 0 else 1
+        keys = compiled['function_indices'][chnl][indices] * key_base + piece_lengths
+        unique_keys, group_indices = np.unique(keys, return_inverse=True)
+        order = np.argsort(group_indices, kind='stable')
+        boundaries = np.cumsum(np.bincount(group_indices, minlength=len(unique_keys)))[:-1]
+        for key, members in zip(unique_keys, np.split(order, boundaries)):
+            func = functions[key // key_base]
+            length = key % key_base
+            sample_arange = np.arange(length, dtype='float64')
+            if func.elementwise:
+                # Each distinct time offset only needs to be evaluated once
+                offsets, offset_indices = np.unique(time_offsets[members], return_inverse=True)
+                time_grid = (offsets[:, np.newaxis] + sample_arange) / sample_rate
+                samples = func.get_samples(time_grid.ravel()) / norm
+                samples = samples.reshape(time_grid.shape)[offset_indices.ravel()]
+                write_indices = positions[members, np.newaxis] + np.arange(length)
+                analog_samples[chnl][write_indices] = samples
+            else:
+                for member in members:
+                    time_arr = (time_offsets[member] + sample_arange) / sample_rate
+                    analog_samples[chnl][positions[member]:positions[member] + length] = \
+                        func.get_samples(time_arr) / norm
+    return
+
+
+def sample_compiled_into_shared_buffer(compiled, buffer_spec, chunk_size=2 ** 22):
+    """ Samples an entire compiled PulseBlockEnsemble into a SharedSampleBuffer.
+    Meant to be run in a worker process. The ensemble is sampled in chunks of chunk_size to limit
+    the size of temporary arrays.
+
+    @param dict compiled: compiled ensemble (see SequenceGeneratorLogic._compile_block_ensemble)
+    @param tuple buffer_spec: specification of the shared buffer (see SharedSampleBuffer.spec)
+    @param int chunk_size: maximum number of samples calculated at once
+    """
+    sample_buffer = SharedSampleBuffer.attach(buffer_spec)
+    try:
+        for chunk_start in range(0, sample_buffer.number_of_samples, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, sample_buffer.number_of_samples)
+            analog_samples = {chnl: samples[chunk_start:chunk_end] for chnl, samples in
+                              sample_buffer.analog_samples.items()}
+            digital_samples = {chnl: samples[chunk_start:chunk_end] for chnl, samples in
+                               sample_buffer.digital_samples.items()}
+            sample_compiled_chunk(compiled, chunk_start, chunk_end - chunk_start, analog_samples,
+                                  digital_samples)
+    finally:
+        sample_buffer.close()
+    return
+
+
+class SharedSampleBuffer:
+    """
+    Sample arrays of a whole waveform residing in a single shared memory block so they can be
+    filled by worker processes without pickling the samples.
+
+    The float32 analog channels are placed first followed by the bool digital channels, both in
+    sorted channel order.
+
+    Needs multiprocessing.shared_memory (Python >= 3.8), see is_supported.
+    """
+
+    def __init__(self, analog_channels, digital_channels, number_of_samples, shm_name=None):
+        from multiprocessing import shared_memory
+
+        self.number_of_samples = int(number_of_samples)
+        self._analog_channels = sorted(analog_channels)
+        self._digital_channels = sorted(digital_channels)
+        size = self.get_size(self._analog_channels, self._digital_channels, self.number_of_samples)
+        if shm_name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        else:
+            # Worker processes share the resource tracker of the creating process, so the block is
+            # only unlinked by the creating process (see release).
+            self._shm = shared_memory.SharedMemory(name=shm_name)
+
+        offset = 0
+        self.analog_samples = dict()
+        for chnl in self._analog_channels:
+            self.analog_samples[chnl] = np.ndarray(self.number_of_samples,
+                                                   dtype='float32',
+                                                   buffer=self._shm.buf,
+                                                   offset=offset)
+            offset += 4 * self.number_of_samples
+        self.digital_samples = dict()
+        for chnl in self._digital_channels:
+            self.digital_samples[chnl] = np.ndarray(self.number_of_samples,
+                                                    dtype=bool,
+                                                    buffer=self._shm.buf,
+                                                    offset=offset)
+            offset += self.number_of_samples
+
+    @staticmethod
+    def is_supported():
+        """
+        Checks if shared memory blocks are available in this Python version.
+
+        @return bool: True if SharedSampleBuffer can be used
+        """
+        return importlib.util.find_spec('multiprocessing.shared_memory') is not None
+
+    @staticmethod
+    def get_size(analog_channels, digital_channels, number_of_samples):
+        """
+        Size in bytes of a buffer with the given channels and number of samples.
+        """
+        return int(number_of_samples) * (4 * len(analog_channels) + len(digital_channels))
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        Attaches to an existing shared sample buffer.
+
+        @param tuple spec: specification of the shared buffer (see SharedSampleBuffer.spec)
+        """
+        analog_channels, digital_channels, number_of_samples, shm_name = spec
+        return cls(analog_channels, digital_channels, number_of_samples, shm_name=shm_name)
+
+    @property
+    def spec(self):
+        """
+        Picklable specification to attach to this buffer from another process.
+        """
+        return self._analog_channels, self._digital_channels, self.number_of_samples, \
+            self._shm.name
+
+    def close(self):
+        """
+        Releases the sample arrays and detaches from the shared memory block.
+        """
+        self.analog_samples = dict()
+        self.digital_samples = dict()
+        try:
+            self._shm.close()
+        except BufferError:
+            # Views on the samples are still referenced somewhere. The mapping is released as soon
+            # as they are garbage collected.
+            pass
+
+    def release(self):
+        """
+        Releases the sample arrays and frees the shared memory block. Only to be called by the
+        process that created the buffer.
+        """
+        self.close()
+        self._shm.unlink()
@@ -21,6 +21,7 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 import numpy as np
 from scipy import ndimage
+from scipy import signal
 
 from logic.pulsed.pulse_extractor import PulseExtractorBase
 
@@ -31,6 +32,9 @@ class BasicPulseExtractor(PulseExtractorBase):
     """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # Flank indices found by ungated_conv_deriv_peaks together with the parameters and the
+        # fraction of counts inside the laser pulses at the time of detection.
+        self._flank_cache = None
 
     def gated_conv_deriv(self, count_data, conv_std_dev=20.0, flank_width=0):
         """
@@ -254,6 +258,197 @@ class BasicPulseExtractor(PulseExtractorBase):
         return_dict['laser_indices_falling'] = falling_ind
         return return_dict
 
+    def ungated_conv_deriv_peaks(self, count_data, conv_std_dev=20.0, redetect_threshold=0.02):
+        """ Detects the laser pulses in the ungated timetrace data and extracts them.
+        Same edge detection as ungated_conv_deriv but all flanks are found in a single pass.
+
+        @param numpy.ndarray count_data: The raw timetrace data (1D) from an ungated fast counter
+        @param float conv_std_dev: The standard deviation of the gaussian used for smoothing
+        @param float redetect_threshold: Maximum change of the fraction of counts inside the
+                                         detected laser pulses before the flanks are detected anew
+
+        @return 2D numpy.ndarray:   2D array, the extracted laser pulses of the timetrace.
+                                    dimensions: 0: laser number, 1: time bin
+
+        Procedure:
+            Edge Detection:
+            ---------------
+
+            The rising and falling flanks are the maxima and minima of the derivative of the
+            gaussian smoothed time trace (see ungated_conv_deriv). Instead of searching the
+            derivative iteratively for the global extremum, all local extrema at least
+            2*conv_std_dev apart are found (with scipy.signal.find_peaks if available) and the
+            number_of_lasers most prominent ones are kept. Each flank position is then refined by
+            the extremum of the derivative smoothed with a fixed standard deviation of 10 bins
+            within conv_std_dev around it. This reference smoothing is only calculated in these
+            small windows instead of the whole trace.
+
+            Flank caching:
+            --------------
+
+            The flank positions do not change while a measurement is running. They are kept and
+            reused as long as the trace length, number_of_lasers and conv_std_dev are unchanged
+            and the fraction of all counts inside the cached laser pulses does not deviate more
+            than redetect_threshold from the fraction at detection time.
+        """
+        return_dict = {'laser_counts_arr': np.empty(0, dtype='int64'),
+                       'laser_indices_rising': np.empty(0, dtype='int64'),
+                       'laser_indices_falling': np.empty(0, dtype='int64')}
+
+        number_of_lasers = self.measurement_settings.get('number_of_lasers')
+        if not isinstance(number_of_lasers, int):
+            return return_dict
+
+        count_data = np.asarray(count_data)
+        cumulative_counts = np.concatenate(([0], np.cumsum(count_data, dtype='int64')))
+        total_counts = cumulative_counts[-1]
+
+        # Reuse the cached flanks if the trace shape did not drift
+        cache = self._flank_cache
+        if cache is not None and total_counts > 0 and cache['size'] == count_data.size and \
+                cache['number_of_lasers'] == number_of_lasers and \
+                cache['conv_std_dev'] == conv_std_dev:
+            rising_ind = cache['rising_ind']
+            falling_ind = cache['falling_ind']
+            fraction = self._window_count_fraction(cumulative_counts, rising_ind, falling_ind)
+            if abs(fraction - cache['fraction']) <= redetect_threshold:
+                return self._slice_laser_pulses(count_data, rising_ind, falling_ind)
+        self._flank_cache = None
+
+        # apply gaussian filter to remove noise and compute the gradient of the timetrace
+        try:
+            conv = ndimage.filters.gaussian_filter1d(count_data.astype(float), conv_std_dev)
+            conv_deriv = np.gradient(conv)
+        except:
+            conv_deriv = np.zeros(count_data.size)
+
+        # if gaussian smoothing or derivative failed, the returned array only contains zeros.
+        # Check for that and return also only zeros to indicate a failed pulse extraction.
+        if len(conv_deriv.nonzero()[0]) == 0:
+            return_dict['laser_counts_arr'] = np.zeros((number_of_lasers, 10), dtype='int64')
+            return return_dict
+
+        # Find the number_of_lasers strongest maxima and minima of the derivative
+        min_distance = max(int(2 * conv_std_dev), 1)
+        rising_ind = self._find_strongest_peaks(conv_deriv, number_of_lasers, min_distance)
+        falling_ind = self._find_strongest_peaks(-conv_deriv, number_of_lasers, min_distance)
+        if rising_ind.size != number_of_lasers or falling_ind.size != number_of_lasers:
+            return_dict['laser_counts_arr'] = np.zeros((number_of_lasers, 10), dtype='int64')
+            return return_dict
+
+        # refine the flank positions with a small and fixed conv_std_dev to find the inflection
+        # points more precisely
+        rising_ind, falling_ind = self._refine_flanks(count_data, rising_ind, falling_ind,
+                                                      int(conv_std_dev))
+        rising_ind.sort()
+        falling_ind.sort()
+
+        self._flank_cache = {
+            'size': count_data.size,
+            'number_of_lasers': number_of_lasers,
+            'conv_std_dev': conv_std_dev,
+            'rising_ind': rising_ind,
+            'falling_ind': falling_ind,
+            'fraction': self._window_count_fraction(cumulative_counts, rising_ind, falling_ind)}
+        return self._slice_laser_pulses(count_data, rising_ind, falling_ind)
+
+    @staticmethod
+    def _find_strongest_peaks(data, number_of_peaks, min_distance):
+        """
+        Returns the indices of the number_of_peaks highest local maxima in data that are at least
+        min_distance apart.
+        """
+        if not hasattr(signal, 'find_peaks'):
+            # scipy < 1.1
+            return BasicPulseExtractor._find_strongest_peaks_numpy(data, number_of_peaks,
+                                                                   min_distance)
+        peaks, properties = signal.find_peaks(data, height=0, distance=min_distance)
+        if peaks.size > number_of_peaks:
+            strongest = np.argpartition(properties['peak_heights'], -number_of_peaks)
+            peaks = np.sort(peaks[strongest[-number_of_peaks:]])
+        return peaks.astype('int64')
+
+    @staticmethod
+    def _find_strongest_peaks_numpy(data, number_of_peaks, min_distance):
+        """
+        Same as _find_strongest_peaks without scipy.signal.find_peaks. Local maxima (the middle of
+        flat maxima) are selected by height, dropping maxima closer than min_distance to an already
+        selected higher one, until number_of_peaks are found.
+        """
+        data = np.asarray(data)
+        # Collapse runs of equal values, maxima are runs higher than both neighbouring runs
+        run_starts = np.flatnonzero(np.concatenate(([True], data[1:] != data[:-1])))
+        run_ends = np.concatenate((run_starts[1:], [data.size])) - 1
+        run_values = data[run_starts]
+        is_peak = np.zeros(run_starts.size, dtype=bool)
+        is_peak[1:-1] = (run_values[1:-1] > run_values[:-2]) & (run_values[1:-1] > run_values[2:])
+        is_peak &= run_values >= 0
+        peaks = (run_starts[is_peak] + run_ends[is_peak]) // 2
+        heights = run_values[is_peak]
+
+        selected = list()
+        blocked = np.zeros(data.size, dtype=bool)
+        for peak in peaks[np.argsort(heights)[::-1]]:
+            if len(selected) == number_of_peaks:
+                break
+            if not blocked[peak]:
+                selected.append(peak)
+                blocked[max(peak - min_distance + 1, 0):peak + min_distance] = True
+        return np.sort(np.array(selected, dtype='int64'))
+
+    @staticmethod
+    def _refine_flanks(count_data, rising_ind, falling_ind, half_width, ref_std_dev=10):
+        """
+        Moves each flank to the extremum of the derivative of the trace smoothed with ref_std_dev
+        within [index - half_width, index + half_width). The smoothing is only evaluated in these
+        windows.
+        """
+        half_width = max(half_width, 1)
+        flanks = np.concatenate((rising_ind, falling_ind))
+        # margin needed for the gaussian kernel and the central differences of the gradient
+        margin = int(4 * ref_std_dev + 0.5) + 1
+        # 'symmetric' padding corresponds to the 'reflect' mode of ndimage
+        padded = np.pad(count_data.astype(float), margin + half_width, mode='symmetric')
+        window_offsets = np.arange(-half_width - margin, half_width + margin)
+        windows = padded[flanks[:, np.newaxis] + margin + half_width + window_offsets]
+        conv_ref = ndimage.filters.gaussian_filter1d(windows, ref_std_dev, axis=1)
+        deriv_ref = np.gradient(conv_ref, axis=1)[:, margin:-margin]
+
+        # exclude window positions outside of the trace
+        positions = flanks[:, np.newaxis] + np.arange(-half_width, half_width)
+        outside = (positions < 0) | (positions >= count_data.size)
+        rising_deriv = np.where(outside[:rising_ind.size], -np.inf, deriv_ref[:rising_ind.size])
+        falling_deriv = np.where(outside[rising_ind.size:], np.inf, deriv_ref[rising_ind.size:])
+        rising_ind = rising_ind - half_width + np.argmax(rising_deriv, axis=1)
+        falling_ind = falling_ind - half_width + np.argmin(falling_deriv, axis=1)
+        return rising_ind, falling_ind
+
+    @staticmethod
+    def _window_count_fraction(cumulative_counts, rising_ind, falling_ind):
+        """
+        Fraction of all counts within the laser pulses [rising_ind, falling_ind).
+        """
+        total_counts = cumulative_counts[-1]
+        if total_counts == 0:
+            return 0.0
+        window_counts = cumulative_counts[falling_ind] - cumulative_counts[rising_ind]
+        return np.sum(np.clip(window_counts, 0, None)) / total_counts
+
+    @staticmethod
+    def _slice_laser_pulses(count_data, rising_ind, falling_ind):
+        """
+        Cuts the laser pulses starting at rising_ind with the maximum laser length out of the
+        trace. Bins beyond the end of the trace are filled with zeros.
+        """
+        laser_length = max(int(np.max(falling_ind - rising_ind)), 0)
+        bin_indices = rising_ind[:, np.newaxis] + np.arange(laser_length)
+        laser_arr = np.where(bin_indices < count_data.size,
+                             count_data[np.minimum(bin_indices, count_data.size - 1)],
+                             0)
+        return {'laser_counts_arr': laser_arr.astype('int64'),
+                'laser_indices_rising': rising_ind.copy(),
+                'laser_indices_falling': falling_ind.copy()}
+
     def ungated_threshold(self, count_data, count_threshold=10, min_laser_length=200e-9,
                           threshold_tolerance=20e-9):
         """
@@ -56,34 +56,28 @@ class BasicPulseAnalyzer(PulseAnalyzerBase):
         norm_start_bin = round(norm_start / bin_width)
         norm_end_bin = round(norm_end / bin_width)
 
-        # initialize data arrays for signal and measurement error
-        signal_data = np.empty(num_of_lasers, dtype=float)
-        error_data = np.empty(num_of_lasers, dtype=float)
-
-        # loop over all laser pulses and analyze them
-        for ii, laser_arr in enumerate(laser_data):
-            # calculate the sum and mean of the data in the normalization window
-            tmp_data = laser_arr[norm_start_bin:norm_end_bin]
-            reference_sum = np.sum(tmp_data)
-            reference_mean = (reference_sum / len(tmp_data)) if len(tmp_data) != 0 else 0.0
-
-            # calculate the sum and mean of the data in the signal window
-            tmp_data = laser_arr[signal_start_bin:signal_end_bin]
-            signal_sum = np.sum(tmp_data)
-            signal_mean = (signal_sum / len(tmp_data)) if len(tmp_data) != 0 else 0.0
-
-            # Calculate normalized signal while avoiding division by zero
-            if reference_mean > 0 and signal_mean >= 0:
-                signal_data[ii] = signal_mean / reference_mean
-            else:
-                signal_data[ii] = 0.0
-
-            # Calculate measurement error while avoiding division by zero
-            if reference_sum > 0 and signal_sum > 0:
-                # calculate with respect to gaussian error 'evolution'
-                error_data[ii] = signal_data[ii] * np.sqrt(1 / signal_sum + 1 / reference_sum)
-            else:
-                error_data[ii] = 0.0
+        # calculate the sum and mean of the data in the normalization and signal window of all
+        # laser pulses
+        reference_sum, reference_mean = self._window_sum_and_mean(laser_data, norm_start_bin,
+                                                                  norm_end_bin)
+        signal_sum, signal_mean = self._window_sum_and_mean(laser_data, signal_start_bin,
+                                                            signal_end_bin)
+
+        # Calculate normalized signal while avoiding division by zero
+        signal_data = np.zeros(num_of_lasers, dtype=float)
+        np.divide(signal_mean, reference_mean, out=signal_data,
+                  where=(reference_mean > 0) & (signal_mean >= 0))
+
+        # Calculate measurement error while avoiding division by zero
+        # (with respect to gaussian error 'evolution')
+        valid = (reference_sum > 0) & (signal_sum > 0)
+        error_data = np.zeros(num_of_lasers, dtype=float)
+        reference_error = np.zeros(num_of_lasers, dtype=float)
+        np.divide(1, signal_sum, out=error_data, where=valid)
+        np.divide(1, reference_sum, out=reference_error, where=valid)
+        error_data += reference_error
+        np.sqrt(error_data, out=error_data)
+        error_data *= signal_data
 
         return signal_data, error_data
 
@@ -106,23 +100,13 @@ class BasicPulseAnalyzer(PulseAnalyzerBase):
         signal_start_bin = round(signal_start / bin_width)
         signal_end_bin = round(signal_end / bin_width)
 
-        # initialize data arrays for signal and measurement error
-        signal_data = np.empty(num_of_lasers, dtype=float)
-        error_data = np.empty(num_of_lasers, dtype=float)
+        # calculate the sum of the data in the signal window of all laser pulses
+        signal_sum = self._window_sum_and_mean(laser_data, signal_start_bin, signal_end_bin)[0]
+        signal_data = signal_sum.astype(float)
 
-        # loop over all laser pulses and analyze them
-        for ii, laser_arr in enumerate(laser_data):
-            # calculate the sum of the data in the signal window
-            signal = laser_arr[signal_start_bin:signal_end_bin].sum()
-            signal_error = np.sqrt(signal)
-
-            # Avoid numpy C type variables overflow and NaN values
-            if signal < 0 or signal != signal:
-                signal_data[ii] = 0.0
-                error_data[ii] = 0.0
-            else:
-                signal_data[ii] = signal
-                error_data[ii] = signal_error
+        # Avoid numpy C type variables overflow and NaN values
+        signal_data[(signal_data < 0) | np.isnan(signal_data)] = 0.0
+        error_data = np.sqrt(signal_data)
 
         return signal_data, error_data
 
@@ -146,24 +130,18 @@ class BasicPulseAnalyzer(PulseAnalyzerBase):
         signal_start_bin = round(signal_start / bin_width)
         signal_end_bin = round(signal_end / bin_width)
 
-        # initialize data arrays for signal and measurement error
-        signal_data = np.empty(num_of_lasers, dtype=float)
-        error_data = np.empty(num_of_lasers, dtype=float)
-
-        # loop over all laser pulses and analyze them
-        for ii, laser_arr in enumerate(laser_data):
-            # calculate the mean of the data in the signal window
-            signal = laser_arr[signal_start_bin:signal_end_bin].mean()
-            signal_sum = laser_arr[signal_start_bin:signal_end_bin].sum()
-            signal_error = np.sqrt(signal_sum) / (signal_end_bin - signal_start_bin)
-
-            # Avoid numpy C type variables overflow and NaN values
-            if signal < 0 or signal != signal:
-                signal_data[ii] = 0.0
-                error_data[ii] = 0.0
-            else:
-                signal_data[ii] = signal
-                error_data[ii] = signal_error
+        # The mean of an empty signal window is not defined
+        if laser_data[:, signal_start_bin:signal_end_bin].shape[1] == 0:
+            return np.zeros(num_of_lasers), np.zeros(num_of_lasers)
+
+        # calculate the mean of the data in the signal window of all laser pulses
+        signal_sum, signal_data = self._window_sum_and_mean(laser_data, signal_start_bin,
+                                                            signal_end_bin)
+
+        # Avoid numpy C type variables overflow and NaN values
+        invalid = (signal_data < 0) | np.isnan(signal_data)
+        signal_data[invalid] = 0.0
+        error_data = np.sqrt(np.where(invalid, 0, signal_sum)) / (signal_end_bin - signal_start_bin)
 
         return signal_data, error_data
 
@@ -214,25 +192,36 @@ class BasicPulseAnalyzer(PulseAnalyzerBase):
         norm_start_bin = round(norm_start / bin_width)
         norm_end_bin = round(norm_end / bin_width)
 
-        # initialize data arrays for signal and measurement error
-        signal_data = np.empty(num_of_lasers, dtype=float)
-        error_data = np.empty(num_of_lasers, dtype=float)
+        # calculate the sum and mean of the data in the normalization and signal window of all
+        # laser pulses
+        reference_sum, reference_mean = self._window_sum_and_mean(laser_data, norm_start_bin,
+                                                                  norm_end_bin)
+        signal_sum, signal_mean = self._window_sum_and_mean(laser_data, signal_start_bin,
+                                                            signal_end_bin)
 
-        # loop over all laser pulses and analyze them
-        for ii, laser_arr in enumerate(laser_data):
-            # calculate the sum and mean of the data in the normalization window
-            tmp_data = laser_arr[norm_start_bin:norm_end_bin]
-            reference_sum = np.sum(tmp_data)
-            reference_mean = (reference_sum / len(tmp_data)) if len(tmp_data) != 0 else 0.0
+        signal_data = signal_mean - reference_mean
 
-            # calculate the sum and mean of the data in the signal window
-            tmp_data = laser_arr[signal_start_bin:signal_end_bin]
-            signal_sum = np.sum(tmp_data)
-            signal_mean = (signal_sum / len(tmp_data)) if len(tmp_data) != 0 else 0.0
+        # calculate with respect to gaussian error 'evolution'
+        with np.errstate(divide='ignore', invalid='ignore'):
+            error_data = signal_data * np.sqrt(1 / np.abs(signal_sum) + 1 / np.abs(reference_sum))
 
-            signal_data[ii] = signal_mean - reference_mean
+        return signal_data, error_data
 
-            # calculate with respect to gaussian error 'evolution'
-            error_data[ii] = signal_data[ii] * np.sqrt(1 / abs(signal_sum) + 1 / abs(reference_sum))
+    @staticmethod
+    def _window_sum_and_mean(laser_data, start_bin, stop_bin):
+        """
+        Sums up the bins [start_bin, stop_bin) of all laser pulses at once. The window is a view on
+        laser_data, so no temporary copy of the data is created.
 
-        return signal_data, error_data
+        @param 2D numpy.ndarray laser_data: laser pulses, dim 0: laser number; dim 1: time bin
+        @param int start_bin: first bin of the window
+        @param int stop_bin: bin after the last bin of the window
+
+        @return (numpy.ndarray, numpy.ndarray): sum and mean of the window for each laser pulse.
+                                                The mean of an empty window is 0.
+        """
+        window = laser_data[:, start_bin:stop_bin]
+        window_sum = np.add.reduce(window, axis=1)
+        if window.shape[1] == 0:
+            return window_sum, np.zeros(laser_data.shape[0], dtype=float)
+        return window_sum, window_sum / window.shape[1]
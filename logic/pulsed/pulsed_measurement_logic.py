@@ -58,6 +58,9 @@ class PulsedMeasurementLogic(GenericLogic):
     analysis_import_path = ConfigOption(name='additional_analysis_path', default=None)
     # Optional file type descriptor for saving raw data to file
     _raw_data_save_type = ConfigOption(name='raw_data_save_type', default='text')
+    # Optional incremental analysis of the accumulated fast counter data. Laser pulses are only
+    # extracted again if the total counts doubled since the last extraction.
+    _incremental_analysis = ConfigOption(name='incremental_analysis', default=False)
 
     # status variables
     # ext. microwave settings
@@ -138,6 +141,8 @@ class PulsedMeasurementLogic(GenericLogic):
         self.measurement_error = np.empty((2, 0), dtype=float)
         self.laser_data = np.zeros((10, 20), dtype='int64')
         self.raw_data = np.zeros((10, 20), dtype='int64')
+        # raw data snapshot, laser pulse positions and analysis results for incremental analysis
+        self._incremental_state = None
 
         self._saved_raw_data = OrderedDict()  # temporary saved raw data
         self._recalled_raw_data_tag = None  # the currently recalled raw data dict key
@@ -679,6 +684,7 @@ class PulsedMeasurementLogic(GenericLogic):
         # Use threadlock to update settings during a running measurement
         with self._threadlock:
             self._pulseanalyzer.analysis_settings = settings_dict
+            self._incremental_state = None
             self.sigAnalysisSettingsUpdated.emit(self.analysis_settings)
         return
 
@@ -704,6 +710,7 @@ class PulsedMeasurementLogic(GenericLogic):
         # Use threadlock to update settings during a running measurement
         with self._threadlock:
             self._pulseextractor.extraction_settings = settings_dict
+            self._incremental_state = None
             self.sigExtractionSettingsUpdated.emit(self.extraction_settings)
         return
 
@@ -1141,9 +1148,11 @@ class PulsedMeasurementLogic(GenericLogic):
             if self.module_state() == 'locked':
                 # Update elapsed time
 
-                self._extract_laser_pulses()
-
-                tmp_signal, tmp_error = self._analyze_laser_pulses()
+                if self._incremental_analysis:
+                    tmp_signal, tmp_error = self._update_laser_pulses_incremental()
+                else:
+                    self._extract_laser_pulses()
+                    tmp_signal, tmp_error = self._analyze_laser_pulses()
 
                 # exclude laser pulses to ignore
                 if len(self._laser_ignore_list) > 0:
@@ -1193,7 +1202,7 @@ class PulsedMeasurementLogic(GenericLogic):
         # extract laser pulses from raw data
         return_dict = self._pulseextractor.extract_laser_pulses(self.raw_data)
         self.laser_data = return_dict['laser_counts_arr']
-        return
+        return return_dict
 
     def _analyze_laser_pulses(self):
         # analyze pulses and get data points for signal array. Also check if extraction
@@ -1206,6 +1215,120 @@ class PulsedMeasurementLogic(GenericLogic):
             tmp_error = np.zeros(self.laser_data.shape[0])
         return tmp_signal, tmp_error
 
+    def _update_laser_pulses_incremental(self):
+        """
+        Incremental version of _extract_laser_pulses and _analyze_laser_pulses.
+
+        Since the fast counter accumulates, only the counts added since the previous call are
+        added to the laser pulses at the positions known from the last full extraction. Only the
+        laser pulses which received new counts are analyzed again. The laser pulses are extracted
+        and analyzed in full if the raw data shape changed, counts were lost (counter restarted),
+        the total counts doubled since the last extraction or the extraction or analysis settings
+        changed. Extraction methods whose laser pulses are no plain slices of the raw data are
+        always evaluated in full.
+
+        @return (numpy.ndarray, numpy.ndarray): signal and error for each laser pulse
+        """
+        fc_data, info_dict = self._get_raw_data()
+        state = self._incremental_state
+        if state is not None and state['raw_data'].shape == fc_data.shape and \
+                state['laser_data'] is self.laser_data:
+            delta = (fc_data - state['raw_data']).ravel()
+            if not (delta < 0).any() and fc_data.sum() < 2 * state['extraction_counts']:
+                self.raw_data = fc_data
+                self.__elapsed_sweeps = info_dict['elapsed_sweeps']
+                self.__elapsed_time = info_dict['elapsed_time']
+                state['raw_data'] = fc_data
+
+                laser_data = self.laser_data.ravel()
+                changed_bins = np.flatnonzero(delta)
+                if changed_bins.size > state['sorted_bins'].size // 4:
+                    # Most bins received counts. Gathering all laser pulse bins is cheaper.
+                    laser_positions = state['sorted_positions']
+                    laser_delta = delta[state['sorted_bins']]
+                    laser_positions = laser_positions[laser_delta != 0]
+                    laser_data[laser_positions] += laser_delta[laser_delta != 0]
+                else:
+                    # Positions in the laser pulses of all raw data bins that received counts
+                    first = np.searchsorted(state['sorted_bins'], changed_bins, side='left')
+                    occurrences = np.searchsorted(state['sorted_bins'], changed_bins,
+                                                  side='right') - first
+                    group_starts = np.cumsum(occurrences) - occurrences
+                    positions = np.repeat(first - group_starts, occurrences) + np.arange(
+                        occurrences.sum())
+                    laser_positions = state['sorted_positions'][positions]
+                    laser_data[laser_positions] += np.repeat(delta[changed_bins], occurrences)
+
+                changed_lasers = np.flatnonzero(np.bincount(
+                    laser_positions // self.laser_data.shape[1],
+                    minlength=self.laser_data.shape[0]))
+                if changed_lasers.size > 0 and self.laser_data.any():
+                    tmp_signal, tmp_error = self._pulseanalyzer.analyse_laser_pulses(
+                        self.laser_data[changed_lasers])
+                    state['signal'][changed_lasers] = tmp_signal
+                    state['error'][changed_lasers] = tmp_error
+                return state['signal'].copy(), state['error'].copy()
+
+        # Full extraction and analysis
+        self._incremental_state = None
+        self.raw_data = fc_data
+        self.__elapsed_sweeps = info_dict['elapsed_sweeps']
+        self.__elapsed_time = info_dict['elapsed_time']
+        return_dict = self._pulseextractor.extract_laser_pulses(self.raw_data)
+        self.laser_data = np.ascontiguousarray(return_dict['laser_counts_arr'])
+        tmp_signal, tmp_error = self._analyze_laser_pulses()
+
+        laser_bins = self._get_laser_pulse_bins(return_dict)
+        if laser_bins is not None:
+            # raw data bin index for each laser pulse bin (-1 for padding)
+            laser_bins = laser_bins.ravel()
+            positions = np.flatnonzero(laser_bins >= 0)
+            order = np.argsort(laser_bins[positions], kind='stable')
+            self._incremental_state = {
+                'raw_data': self.raw_data,
+                'laser_data': self.laser_data,
+                'extraction_counts': max(int(self.raw_data.sum()), 1),
+                'sorted_bins': laser_bins[positions][order],
+                'sorted_positions': positions[order],
+                'signal': np.array(tmp_signal, dtype=float).ravel(),
+                'error': np.broadcast_to(np.asarray(tmp_error, dtype=float),
+                                         (self.laser_data.shape[0],)).copy()}
+        return tmp_signal, tmp_error
+
+    def _get_laser_pulse_bins(self, return_dict):
+        """
+        Determines the flattened raw data bin index of each laser pulse bin from the flank indices
+        returned by the pulse extractor. Zero padded laser pulse bins are marked with -1.
+
+        @param dict return_dict: return dictionary of the pulse extraction
+
+        @return numpy.ndarray: integer array with the shape of the laser data. None if the laser
+                               pulses are no slices of the raw data starting at the rising flanks.
+        """
+        laser_data = self.laser_data
+        rising_ind = np.asarray(return_dict.get('laser_indices_rising', -1), dtype='int64')
+        if laser_data.ndim != 2 or laser_data.size == 0:
+            return None
+        laser_length = laser_data.shape[1]
+
+        if self.raw_data.ndim == 1 and rising_ind.shape == (laser_data.shape[0],):
+            laser_bins = rising_ind[:, np.newaxis] + np.arange(laser_length)
+            laser_bins[(laser_bins < 0) | (laser_bins >= self.raw_data.size)] = -1
+        elif self.raw_data.ndim == 2 and rising_ind.ndim == 0 and \
+                self.raw_data.shape[0] == laser_data.shape[0] and \
+                0 <= rising_ind and rising_ind + laser_length <= self.raw_data.shape[1]:
+            laser_bins = np.arange(laser_data.shape[0])[:, np.newaxis] * self.raw_data.shape[1]
+            laser_bins = laser_bins + rising_ind + np.arange(laser_length)
+        else:
+            return None
+
+        # Make sure the extraction method actually sliced the laser pulses this way
+        flat_raw = self.raw_data.ravel()
+        expected = np.where(laser_bins >= 0, flat_raw[np.maximum(laser_bins, 0)], 0)
+        if not np.array_equal(expected, laser_data):
+            return None
+        return laser_bins
+
     def _get_raw_data(self):
         """
         Get the raw count data from the fast counting hardware and perform sanity checks.
@@ -1272,6 +1395,7 @@ class PulsedMeasurementLogic(GenericLogic):
         number_of_bins = int(self.__fast_counter_record_length / self.__fast_counter_binwidth)
         laser_length = number_of_bins if self.__fast_counter_gates > 0 else 500
         self.laser_data = np.zeros((self._number_of_lasers, laser_length), dtype='int64')
+        self._incremental_state = None
 
         if self.__fast_counter_gates > 0:
             self.raw_data = np.zeros((self._number_of_lasers, number_of_bins), dtype='int64')
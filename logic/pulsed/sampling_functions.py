@@ -104,6 +104,9 @@ class SamplingBase:
     """
     params = OrderedDict()
     log = logging.getLogger(__name__)
+    # Set to True if get_samples evaluates every time point independently of the others.
+    # Such functions can be sampled for many elements at once by passing concatenated time arrays.
+    elementwise = False
 
     def __repr__(self):
         kwargs = []
@@ -126,15 +129,13 @@ class SamplingBase:
     def __eq__(self, other):
         if not isinstance(other, SamplingBase):
             return False
+        return hash(self) == hash(other)
+
+    def __hash__(self):
         hash_list = [type(self).__name__]
         for param in self.params:
             hash_list.append(getattr(self, param))
-        hash_self = hash(tuple(hash_list))
-        hash_list = [type(other).__name__]
-        for param in other.params:
-            hash_list.append(getattr(other, param))
-        hash_other = hash(tuple(hash_list))
-        return hash_self == hash_other
+        return hash(tuple(hash_list))
 
     def get_dict_representation(self):
         dict_repr = dict()
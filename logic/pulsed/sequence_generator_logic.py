@@ -27,6 +27,10 @@ import time
 import copy
 import traceback
 import datetime
+import queue
+import threading
+import multiprocessing
+import concurrent.futures
 
 from qtpy import QtCore
 from collections import OrderedDict
@@ -41,6 +45,9 @@ from logic.generic_logic import GenericLogic
 from logic.pulsed.pulse_objects import PulseBlock, PulseBlockEnsemble, PulseSequence
 from logic.pulsed.pulse_objects import PulseObjectGenerator, PulseBlockElement
 from logic.pulsed.sampling_functions import SamplingFunctions
+from logic.pulsed.waveform_cache import WaveformCache
+from logic.pulsed.ensemble_sampling import sample_compiled_chunk, sample_compiled_into_shared_buffer
+from logic.pulsed.ensemble_sampling import SharedSampleBuffer
 from interface.pulser_interface import SequenceOption
 
 
@@ -76,6 +83,16 @@ class SequenceGeneratorLogic(GenericLogic):
                                                    missing='nothing')
     _info_on_estimated_upload_time = ConfigOption(name='info_on_estimated_upload_time', default=60, missing='nothing')
     _disable_bench_prompt = ConfigOption(name='disable_benchmark_prompt', default=False, missing='nothing')
+    # Disk-backed cache of sampled waveforms. Size budget in bytes, 0 disables the cache.
+    _waveform_cache_size = ConfigOption(name='waveform_cache_size', default=0, missing='nothing')
+    _waveform_cache_dir = ConfigOption(name='waveform_cache_path', default=None, missing='nothing')
+    # Sample the next chunk in a worker thread while the current chunk is written to the device.
+    # Only applies to chunked writing (see overhead_bytes) and needs memory for two chunks.
+    _pipelined_sampling = ConfigOption(name='pipelined_sampling', default=False, missing='nothing')
+    # Number of worker processes to sample the ensembles of a PulseSequence without rotating frame
+    # in parallel. 1 disables parallel sampling. Needs Python >= 3.8. At most this number of
+    # ensembles is held in memory ahead of the upload.
+    _sampling_processes = ConfigOption(name='sampling_processes', default=1, missing='nothing')
 
     # status vars
     # Global parameters describing the channel usage and common parameters used during pulsed object
@@ -147,6 +164,18 @@ class SequenceGeneratorLogic(GenericLogic):
 
         # Get instance of PulseObjectGenerator which takes care of collecting all predefined methods
         self._pog = None
+        # Memoized results of analyze_block_ensemble (least recently used first)
+        self._ensemble_analysis_memo = OrderedDict()
+        self._ensemble_analysis_memo_size = 64
+        # Cache of sampled waveforms
+        self._waveform_cache = None
+        # Process pool for parallel sampling of sequence ensembles (created on demand)
+        self._sampling_executor = None
+        # Ensembles being sampled in worker processes. Keys are the waveform names, items are
+        # tuples of (<concurrent.futures.Future>, <SharedSampleBuffer>).
+        self._presampled_ensembles = dict()
+        # Names of ensembles waiting to be submitted for parallel sampling (in upload order)
+        self._parallel_sampling_queue = list()
 
         # The created pulse objects (PulseBlock, PulseBlockEnsemble, PulseSequence) are saved in
         # these dictionaries. The keys are the names.
@@ -199,6 +228,11 @@ class SequenceGeneratorLogic(GenericLogic):
                                'a list of strings.')
         SamplingFunctions.import_sampling_functions(sf_path_list)
 
+        # Set up the cache for sampled waveforms
+        if not self._waveform_cache_dir:
+            self._waveform_cache_dir = os.path.join(self._assets_storage_dir, 'waveform_cache')
+        self._waveform_cache = WaveformCache(self._waveform_cache_dir, self._waveform_cache_size)
+
         # Read back settings from device and update instance variables accordingly
         self._read_settings_from_device()
 
@@ -220,6 +254,10 @@ class SequenceGeneratorLogic(GenericLogic):
     def on_deactivate(self):
         """ Deinitialisation performed during deactivation of the module.
         """
+        self._release_presampled_ensembles()
+        if self._sampling_executor is not None:
+            self._sampling_executor.shutdown(wait=True)
+            self._sampling_executor = None
         return
 
     # @_saved_pulse_blocks.constructor
@@ -1258,13 +1296,16 @@ class SequenceGeneratorLogic(GenericLogic):
 
     def analyze_block_ensemble(self, ensemble):
         """
-        This helper method runs through each element of a PulseBlockEnsemble object and extracts
-        important information about the Waveform that can be created out of this object.
+        This helper method extracts important information about the Waveform that can be created
+        out of a PulseBlockEnsemble object. All elements (incl. repetitions) are processed at once
+        using numpy arrays.
         Especially the discretization due to the set self.sample_rate is taken into account.
         The positions in time (as integer time bins) of the PulseBlockElement transitions are
         determined here (all the "rounding-to-best-match-value").
         Additional information like the total number of samples, total number of PulseBlockElements
         and the timebins for digital channel low-to-high transitions get returned as well.
+        The result is memoized for the current sample rate and laser channel until the ensemble or
+        one of its blocks changes.
 
         This method assumes that sanity checking has been already performed on the
         PulseBlockEnsemble (via _sampling_ensemble_sanity_check). Meaning it assumes that all
@@ -1301,94 +1342,93 @@ class SequenceGeneratorLogic(GenericLogic):
         laser_channel = self.generation_parameters['gate_channel'] if self.generation_parameters[
             'gate_channel'] else self.generation_parameters['laser_channel']
 
-        # memorize the digital channel state of the previous element
-        tmp_digital_high = dict()
-        # memorize the laser_on flag of the previous element (in case of non-digital laser channel)
-        tmp_laser_on = False
+        # Return a copy of the memoized result if the ensemble has been analyzed before with the
+        # same blocks, sample rate and laser channel.
+        memo_key = (self.__sample_rate,
+                    laser_channel,
+                    tuple((block_name, reps) for block_name, reps in ensemble.block_list),
+                    tuple(repr(self.get_block(block_name)) for block_name in
+                          OrderedDict.fromkeys(block_name for block_name, _ in ensemble.block_list)))
+        if memo_key in self._ensemble_analysis_memo:
+            self._ensemble_analysis_memo.move_to_end(memo_key)
+            return_dict = copy.deepcopy(self._ensemble_analysis_memo[memo_key])
+            return_dict['generation_parameters'] = self.generation_parameters.copy()
+            return return_dict
+
+        # Collect all elements (incl. repetitions) in chronological order. Each block is only
+        # stored once and repetitions are expressed by tiling the element indices.
+        unique_elements = list()
+        element_indices = list()
+        rep_numbers = list()
+        for block_name, reps in ensemble.block_list:
+            block = self.get_block(block_name)
+            first_index = len(unique_elements)
+            unique_elements.extend(block.element_list)
+            element_indices.append(
+                np.tile(np.arange(first_index, len(unique_elements), dtype='int64'), reps + 1))
+            rep_numbers.append(np.repeat(np.arange(reps + 1, dtype='int64'), len(block)))
+        if unique_elements:
+            element_indices = np.concatenate(element_indices)
+            rep_numbers = np.concatenate(rep_numbers)
+        else:
+            element_indices = np.zeros(0, dtype='int64')
+            rep_numbers = np.zeros(0, dtype='int64')
+
         # Set of used analog and digital channels
         digital_channels = set()
         analog_channels = set()
-        # check for active channels and initialize tmp_digital_high/tmp_laser_on with the state of
-        # the very last element in the ensemble
+        # check for active channels and get the digital channel states/laser_on flag of the very
+        # last element in the ensemble, which precedes the first element.
+        initial_digital_high = dict()
+        initial_laser_on = False
         if len(ensemble) > 0:
             block = self.get_block(ensemble[0][0])
             digital_channels = block.digital_channels
             analog_channels = block.analog_channels
             block = self.get_block(ensemble[-1][0])
             if len(block) > 0:
-                tmp_digital_high = block[-1].digital_high.copy()
-                tmp_laser_on = block[-1].laser_on
+                initial_digital_high = block[-1].digital_high.copy()
+                initial_laser_on = block[-1].laser_on
             else:
-                tmp_digital_high = {chnl: False for chnl in digital_channels}
-                tmp_laser_on = False
+                initial_digital_high = {chnl: False for chnl in digital_channels}
+                initial_laser_on = False
+
+        # Calculate the ideal end time of each element with the current repetition count in sec.
+        # The cumulative sum is accumulated sequentially, i.e. the same way the times would add up
+        # element by element. The nearest possible match including the discretization in bins
+        # gives the element transitions.
+        init_lengths = np.array([element.init_length_s for element in unique_elements],
+                                dtype='float64')
+        increments = np.array([element.increment_s for element in unique_elements],
+                              dtype='float64')
+        end_times = np.cumsum(init_lengths[element_indices] +
+                              rep_numbers * increments[element_indices])
+        end_bins = np.rint(end_times * self.__sample_rate).astype('int64')
+        elements_length_bins = np.diff(np.concatenate(([0], end_bins)))
+        start_bins = end_bins - elements_length_bins
+
+        def get_transition_bins(states, initial_state):
+            previous_states = np.concatenate(([initial_state], states[:-1]))
+            rising = np.unique(start_bins[states & ~previous_states])
+            falling = np.unique(start_bins[~states & previous_states])
+            return rising.astype('int64'), falling.astype('int64')
 
         # dicts containing the bins where the digital channels are rising/falling
-        digital_rising_bins = {chnl: list() for chnl in digital_channels}
-        digital_falling_bins = {chnl: list() for chnl in digital_channels}
-        laser_rising_bins = list()
-        laser_falling_bins = list()
-
-        # Array to store the length in bins for all elements including repetitions in the order
-        # they are occuring in the waveform later on.
-        elements_length_bins = list()
-
-        # variables to keep track of the current timeframe
-        current_end_time = 0.0
-        current_start_bin = 0
-
-        # Loop through all blocks in the ensemble
-        for block_name, reps in ensemble:
-            # Get the stored PulseBlock instance
-            block = self.get_block(block_name)
-
-            # Iterate over all repetitions of the current block
-            for rep_no in range(reps + 1):
-                # Iterate over the Block_Elements inside the current block
-                for element in block:
-                    # save bin position if a transition from low to high or vice versa has occurred
-                    # in a digital channel
-                    if tmp_digital_high != element.digital_high:
-                        for chnl, state in element.digital_high.items():
-                            if not tmp_digital_high[chnl] and state:
-                                digital_rising_bins[chnl].append(current_start_bin)
-                            elif tmp_digital_high[chnl] and not state:
-                                digital_falling_bins[chnl].append(current_start_bin)
-                        tmp_digital_high = element.digital_high.copy()
-
-                    if not laser_channel.startswith('d') and tmp_laser_on != element.laser_on:
-                        if not tmp_laser_on and element.laser_on:
-                            laser_rising_bins.append(current_start_bin)
-                        else:
-                            laser_falling_bins.append(current_start_bin)
-                        tmp_laser_on = element.laser_on
-
-                    # Calculate length of the current element with current repetition count in sec
-                    # and add this to the ideal end time for the sequence up until this point.
-                    current_end_time += element.init_length_s + rep_no * element.increment_s
-
-                    # Nearest possible match including the discretization in bins
-                    current_end_bin = int(np.rint(current_end_time * self.__sample_rate))
-
-                    # append current element length in discrete bins to temporary array
-                    elements_length_bins.append(current_end_bin - current_start_bin)
-
-                    # advance bin offset for next element
-                    current_start_bin = current_end_bin
-
-        elements_length_bins = np.array(elements_length_bins, dtype='int64')
-
-        # convert rising/falling indices to numpy.ndarrays. Remove duplicates.
+        digital_rising_bins = dict()
+        digital_falling_bins = dict()
         for chnl in digital_channels:
-            digital_rising_bins[chnl] = sorted(set(digital_rising_bins[chnl]))
-            digital_falling_bins[chnl] = sorted(set(digital_falling_bins[chnl]))
-            digital_rising_bins[chnl] = np.array(digital_rising_bins[chnl], dtype='int64')
-            digital_falling_bins[chnl] = np.array(digital_falling_bins[chnl], dtype='int64')
+            states = np.array([element.digital_high[chnl] for element in unique_elements],
+                              dtype=bool)[element_indices]
+            digital_rising_bins[chnl], digital_falling_bins[chnl] = get_transition_bins(
+                states, bool(initial_digital_high[chnl]))
         if laser_channel.startswith('d'):
             laser_rising_bins = digital_rising_bins[laser_channel]
             laser_falling_bins = digital_falling_bins[laser_channel]
         else:
-            laser_rising_bins = np.array(sorted(set(laser_rising_bins)), dtype='int64')
-            laser_falling_bins = np.array(sorted(set(laser_falling_bins)), dtype='int64')
+            states = np.array([element.laser_on for element in unique_elements],
+                              dtype=bool)[element_indices]
+            laser_rising_bins, laser_falling_bins = get_transition_bins(states,
+                                                                        bool(initial_laser_on))
 
         return_dict = dict()
         return_dict['number_of_samples'] = np.sum(elements_length_bins)
@@ -1400,9 +1440,13 @@ class SequenceGeneratorLogic(GenericLogic):
         return_dict['digital_channels'] = digital_channels
         return_dict['channel_set'] = analog_channels.union(digital_channels)
         return_dict['generation_parameters'] = self.generation_parameters.copy()
-        return_dict['ideal_length'] = current_end_time
+        return_dict['ideal_length'] = float(end_times[-1]) if len(end_times) > 0 else 0.0
         return_dict['laser_rising_bins'] = laser_rising_bins
         return_dict['laser_falling_bins'] = laser_falling_bins
+
+        self._ensemble_analysis_memo[memo_key] = copy.deepcopy(return_dict)
+        while len(self._ensemble_analysis_memo) > self._ensemble_analysis_memo_size:
+            self._ensemble_analysis_memo.popitem(last=False)
         return return_dict
 
     def analyze_sequence(self, sequence):
@@ -1690,9 +1734,11 @@ class SequenceGeneratorLogic(GenericLogic):
 
         This method is creating the actual samples (voltages and logic states) for each time step
         of the analog and digital channels specified in the PulseBlockEnsemble.
-        Therefore it iterates through all blocks, repetitions and elements of the ensemble and
-        calculates the exact voltages (float64) according to the specified math_function. The
-        samples are later on stored inside a float32 array.
+        Therefore the ensemble is first compiled into flat arrays of all elements (incl.
+        repetitions) and the exact voltages (float64) are calculated according to the specified
+        math_function. Elements sharing the same sampling function and length are sampled together
+        in a single vectorized call (see ensemble_sampling.sample_compiled_chunk). The samples are later on stored
+        inside a float32 array.
         So each element is calculated with high precision (float64) and then down-converted to
         float32 to be stored.
 
@@ -1704,6 +1750,8 @@ class SequenceGeneratorLogic(GenericLogic):
         The chunkwise write mode is used to save memory usage at the expense of time.
         In other words: The whole sample arrays are never created at any time. This results in more
         function calls and general overhead causing much longer time to complete.
+        With the ConfigOption "pipelined_sampling" the next chunk is sampled in a worker thread
+        while the current chunk is written to the device, at the cost of memory for two chunks.
 
         In addition the pulse_block_ensemble gets analyzed and important parameters used during
         sampling get stored in the ensemble object "sampling_information" attribute.
@@ -1739,47 +1787,8 @@ class SequenceGeneratorLogic(GenericLogic):
         # Take current time
         start_time = time.time()
 
-        # get important parameters from the ensemble
-        ensemble_info = self.analyze_block_ensemble(ensemble)
-
-        # Make sure the length of the channel is a multiple of the step size.
-        # This is done by appending an idle block
-        granularity = self.pulse_generator_constraints.waveform_length.step
-        self.log.debug('length: {0}, mod {1}'.format(
-            ensemble_info['number_of_samples'], ensemble_info['number_of_samples'] % granularity))
-        if ensemble_info['number_of_samples'] % granularity != 0:
-            self.log.warn('Length {0} does not fulfil step constraint {1}.'.format(
-                ensemble_info['number_of_samples'], granularity))
-            # TODO: take care of rounding errors!
-            extension_samples = granularity - ensemble_info['number_of_samples'] % granularity
-            target_total_samples = ensemble_info['number_of_samples'] + extension_samples
-            extension_seconds = (target_total_samples / self.__sample_rate) - ensemble_info[
-                'ideal_length']
-
-            pb_element = PulseBlockElement(
-                init_length_s=extension_seconds,
-                increment_s=0,
-                pulse_function={chnl: SamplingFunctions.Idle() for chnl in self.analog_channels},
-                digital_high={chnl: False for chnl in self.digital_channels})
-            idle_extension = PulseBlock('idle_extension', element_list=[pb_element])
-            temp_measurement_info = copy.deepcopy(ensemble.measurement_information)
-            ensemble.append((idle_extension.name, 0))
-            ensemble.measurement_information = temp_measurement_info
-
-            self.save_block(idle_extension)
-            self.save_ensemble(ensemble)
-
-            # get important parameters from the ensemble
-            ensemble_info = self.analyze_block_ensemble(ensemble)
-            if ensemble_info['number_of_samples'] != target_total_samples:
-                self.log.error('Expanding the PulseBlockEnsemble to match the waveform granularity '
-                               'has failed.\nTarget number of samples was {0:d}.\nfinal number of '
-                               'samples is {1:d}.\nThis is probably due to a rounding error in '
-                               'SequenceGeneratorLogic.sample_pulse_block_ensemble.'
-                               ''.format(target_total_samples, ensemble_info['number_of_samples']))
-            else:
-                self.log.warn('Extending waveform {0} by {2} bins. New length {1}.'.format(
-                    ensemble.name, ensemble_info['number_of_samples'], extension_samples))
+        # get important parameters from the ensemble (padded to the waveform granularity)
+        ensemble_info = self._analyze_padded_block_ensemble(ensemble)
 
         # Calculate the byte size per sample.
         # One analog sample per channel is 4 bytes (np.float32) and one digital sample per channel
@@ -1806,23 +1815,70 @@ class SequenceGeneratorLogic(GenericLogic):
             self.sigSampleEnsembleComplete.emit(None)
             return -1, list(), dict()
 
-        # Allocate the sample arrays that are used for a single write command
-        analog_samples = dict()
-        digital_samples = dict()
-        try:
-            for chnl in ensemble_info['analog_channels']:
-                analog_samples[chnl] = np.empty(array_length, dtype='float32')
-            for chnl in ensemble_info['digital_channels']:
-                digital_samples[chnl] = np.empty(array_length, dtype=bool)
-        except MemoryError:
-            self.log.error('Sampling of PulseBlockEnsemble "{0}" failed due to a MemoryError.\n'
-                           'The sample array needed is too large to allocate in memory.\n'
-                           'Try using the overhead_bytes ConfigOption to limit memory usage.'
-                           ''.format(ensemble.name))
-            if not self.__sequence_generation_in_progress:
-                self.module_state.unlock()
-            self.sigSampleEnsembleComplete.emit(None)
-            return -1, list(), dict()
+        # Look up the samples in the waveform cache. On a cache hit the samples are streamed from
+        # disk and sampling is skipped entirely. Otherwise the samples are stored in a new cache
+        # entry while sampling.
+        cached_samples = None
+        cache_entry = None
+        if self._waveform_cache.enabled:
+            cache_key = self._waveform_cache.get_key(
+                ensemble=ensemble,
+                blocks={name: self.get_block(name) for name, reps in ensemble.block_list},
+                offset_bin=offset_bin,
+                sample_rate=self.__sample_rate,
+                analog_levels=self.__analog_levels,
+                activation_config=self.__activation_config[1])
+            cached_samples = self._waveform_cache.load(cache_key)
+            if cached_samples is None:
+                cache_entry = self._waveform_cache.create_entry(
+                    cache_key,
+                    analog_channels=ensemble_info['analog_channels'],
+                    digital_channels=ensemble_info['digital_channels'],
+                    number_of_samples=ensemble_info['number_of_samples'])
+            else:
+                self.log.debug('Waveform cache hit for PulseBlockEnsemble "{0}".'
+                               ''.format(ensemble.name))
+
+        # Use the samples if the ensemble has already been sampled by a worker process
+        stored_samples = cached_samples
+        if cached_samples is None and waveform_name in self._presampled_ensembles:
+            future, shared_buffer = self._presampled_ensembles[waveform_name]
+            try:
+                future.result()
+            except Exception:
+                self.log.exception('Parallel sampling of PulseBlockEnsemble "{0}" failed. '
+                                   'Sampling it again.'.format(ensemble.name))
+            else:
+                if shared_buffer.number_of_samples == ensemble_info['number_of_samples']:
+                    stored_samples = (shared_buffer.analog_samples, shared_buffer.digital_samples)
+
+        # Allocate the sample arrays that are used for a single write command. In pipelined mode a
+        # second set of arrays is needed to sample the next chunk while the current one is written.
+        sample_buffers = list()
+        if stored_samples is None:
+            n_buffers = 2 if self._pipelined_sampling and array_length < ensemble_info[
+                'number_of_samples'] else 1
+            try:
+                for buffer_index in range(n_buffers):
+                    analog_samples = dict()
+                    digital_samples = dict()
+                    for chnl in ensemble_info['analog_channels']:
+                        analog_samples[chnl] = np.empty(array_length, dtype='float32')
+                    for chnl in ensemble_info['digital_channels']:
+                        digital_samples[chnl] = np.empty(array_length, dtype=bool)
+                    sample_buffers.append((analog_samples, digital_samples))
+            except MemoryError:
+                self.log.error('Sampling of PulseBlockEnsemble "{0}" failed due to a MemoryError.\n'
+                               'The sample array needed is too large to allocate in memory.\n'
+                               'Try using the overhead_bytes ConfigOption to limit memory usage.'
+                               ''.format(ensemble.name))
+                if cache_entry is not None:
+                    cache_entry = None
+                    self._waveform_cache.discard_entry(cache_key)
+                if not self.__sequence_generation_in_progress:
+                    self.module_state.unlock()
+                self.sigSampleEnsembleComplete.emit(None)
+                return -1, list(), dict()
 
         # t_est_upload = self._benchmark_write.estimate_time(ensemble_info['number_of_samples'])
         # if t_est_upload > self._info_on_estimated_upload_time:
@@ -1831,108 +1887,76 @@ class SequenceGeneratorLogic(GenericLogic):
         #                   " {0:%Y-%m-%d %H:%M:%S} ({1:d} s)".format(
         #         (now + datetime.timedelta(0, t_est_upload)), int(t_est_upload)))
 
+        # Get an iterator over all chunks of sample arrays to write
+        if stored_samples is not None:
+            chunk_iterator = self._iter_stored_chunks(
+                stored_samples, ensemble_info['number_of_samples'], array_length,
+                None if stored_samples is cached_samples else cache_entry)
+        else:
+            # Compile the ensemble into flat element arrays. This allows to sample all elements
+            # sharing the same sampling function and length with a single vectorized call per chunk.
+            compiled_ensemble = self._compile_block_ensemble(ensemble, ensemble_info, offset_bin)
+            if len(sample_buffers) > 1:
+                chunk_iterator = self._iter_sampled_chunks_pipelined(
+                    compiled_ensemble, ensemble_info['number_of_samples'], sample_buffers,
+                    cache_entry)
+            else:
+                chunk_iterator = self._iter_sampled_chunks(
+                    compiled_ensemble, ensemble_info['number_of_samples'], sample_buffers[0],
+                    cache_entry)
+
         # integer to keep track of the sampls already processed
         processed_samples = 0
-        # Index to keep track of the samples written into the preallocated samples array
-        array_write_index = 0
-        # Keep track of the number of elements already written
-        element_count = 0
         # set of written waveform names on the device
         written_waveforms = set()
-        # Iterate over all blocks within the PulseBlockEnsemble object
-        for block_name, reps in ensemble.block_list:
-            block = self.get_block(block_name)
-            # Iterate over all repetitions of the current block
-            for rep_no in range(reps + 1):
-                # Iterate over the PulseBlockElement instances inside the current block
-                for element in block.element_list:
-                    digital_high = element.digital_high
-                    pulse_function = element.pulse_function
-                    element_length_bins = ensemble_info['elements_length_bins'][element_count]
-
-                    # Indicator on how many samples of this element have been written already
-                    element_samples_written = 0
-
-                    while element_samples_written != element_length_bins:
-                        samples_to_add = min(array_length - array_write_index,
-                                             element_length_bins - element_samples_written)
-                        # create floating point time array for the current element inside rotating
-                        # frame if analog samples are to be calculated.
-                        if pulse_function:
-                            time_arr = (offset_bin + np.arange(
-                                samples_to_add, dtype='float64')) / self.__sample_rate
-
-                        # Calculate respective part of the sample arrays
-                        for chnl in digital_high:
-                            digital_samples[chnl][array_write_index:array_write_index + samples_to_add] = digital_high[
-                                chnl]
-                        for chnl in pulse_function:
-                            analog_samples[chnl][array_write_index:array_write_index + samples_to_add] = \
-                                pulse_function[chnl].get_samples(time_arr) / (self.__analog_levels[0][chnl] / 2)
-                            # Above is the old version, what is the purpose of diving by analog levels here?
-                            # Dividing completely breaks the output waveforms
-                            # analog_samples[chnl][array_write_index:array_write_index + samples_to_add] = \
-                            #     pulse_function[chnl].get_samples(time_arr)
-
-                        # Free memory
-                        if pulse_function:
-                            del time_arr
-
-                        element_samples_written += samples_to_add
-                        array_write_index += samples_to_add
-                        processed_samples += samples_to_add
-                        # if the rotating frame should be preserved (default) increment the offset
-                        # counter for the time array.
-                        if ensemble.rotating_frame:
-                            offset_bin += samples_to_add
-
-                        # Check if the temporary sample array is full and write to the device if so.
-                        if array_write_index == array_length:
-                            # Set first/last chunk flags
-                            is_first_chunk = array_write_index == processed_samples
-                            is_last_chunk = processed_samples == ensemble_info['number_of_samples']
-                            written_samples, wfm_list = self.pulsegenerator().write_waveform(
-                                name=waveform_name,
-                                analog_samples=analog_samples,
-                                digital_samples=digital_samples,
-                                is_first_chunk=is_first_chunk,
-                                is_last_chunk=is_last_chunk,
-                                total_number_of_samples=ensemble_info['number_of_samples'])
-
-                            # Update written waveforms set
-                            written_waveforms.update(wfm_list)
-
-                            # check if write process was successful
-                            if written_samples != array_length:
-                                self.log.error('Sampling of block "{0}" in ensemble "{1}" failed. '
-                                               'Write to device was unsuccessful.\nThe number of '
-                                               'actually written samples ({2:d}) does not match '
-                                               'the number of samples staged to write ({3:d}).'
-                                               ''.format(block_name, ensemble.name, written_samples,
-                                                         array_length))
-                                if not self.__sequence_generation_in_progress:
-                                    self.module_state.unlock()
-                                self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
-                                self.sigSampleEnsembleComplete.emit(None)
-                                return -1, list(), dict()
-
-                            # Reset array write start pointer
-                            array_write_index = 0
-
-                            # check if the temporary write array needs to be truncated for the next
-                            # part. (because it is the last part of the ensemble to write which can
-                            # be shorter than the previous chunks)
-                            if array_length > ensemble_info['number_of_samples'] - processed_samples:
-                                array_length = ensemble_info['number_of_samples'] - processed_samples
-                                analog_samples = dict()
-                                digital_samples = dict()
-                                for chnl in ensemble_info['analog_channels']:
-                                    analog_samples[chnl] = np.empty(array_length, dtype='float32')
-                                for chnl in ensemble_info['digital_channels']:
-                                    digital_samples[chnl] = np.empty(array_length, dtype=bool)
-
-                    # Increment element index
-                    element_count += 1
+        for analog_samples, digital_samples in chunk_iterator:
+            if analog_samples:
+                array_length = len(next(iter(analog_samples.values())))
+            else:
+                array_length = len(next(iter(digital_samples.values())))
+
+            # Set first/last chunk flags
+            is_first_chunk = processed_samples == 0
+            processed_samples += array_length
+            is_last_chunk = processed_samples == ensemble_info['number_of_samples']
+            written_samples, wfm_list = self.pulsegenerator().write_waveform(
+                name=waveform_name,
+                analog_samples=analog_samples,
+                digital_samples=digital_samples,
+                is_first_chunk=is_first_chunk,
+                is_last_chunk=is_last_chunk,
+                total_number_of_samples=ensemble_info['number_of_samples'])
+
+            # Update written waveforms set
+            written_waveforms.update(wfm_list)
+
+            # check if write process was successful
+            if written_samples != array_length:
+                self.log.error('Sampling of ensemble "{0}" failed. Write to device was '
+                               'unsuccessful.\nThe number of actually written samples ({1:d}) '
+                               'does not match the number of samples staged to write ({2:d}).'
+                               ''.format(ensemble.name, written_samples, array_length))
+                chunk_iterator.close()
+                if cache_entry is not None:
+                    cache_entry = None
+                    self._waveform_cache.discard_entry(cache_key)
+                if not self.__sequence_generation_in_progress:
+                    self.module_state.unlock()
+                self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
+                self.sigSampleEnsembleComplete.emit(None)
+                return -1, list(), dict()
+
+        # Store the freshly sampled waveform in the cache
+        if cache_entry is not None:
+            cache_entry = None
+            self._waveform_cache.commit_entry(cache_key)
+        cached_samples = None
+        stored_samples = None
+
+        # if the rotating frame should be preserved (default) increment the offset counter for the
+        # time array.
+        if ensemble.rotating_frame:
+            offset_bin += int(ensemble_info['number_of_samples'])
 
         # Save sampling related parameters to the sampling_information container within the
         # PulseBlockEnsemble.
@@ -1964,6 +1988,326 @@ class SequenceGeneratorLogic(GenericLogic):
         self.sigSampleEnsembleComplete.emit(ensemble)
         return offset_bin, natural_sort(written_waveforms), ensemble_info
 
+    def _analyze_padded_block_ensemble(self, ensemble):
+        """ Analyzes a PulseBlockEnsemble (see analyze_block_ensemble) and makes sure its length is
+        a multiple of the waveform length step size of the pulse generator. This is done by
+        appending an idle block to the ensemble and saving it.
+
+        @param PulseBlockEnsemble ensemble: The ensemble to analyze and pad
+
+        @return dict: ensemble_info of the (padded) ensemble as returned by analyze_block_ensemble
+        """
+        ensemble_info = self.analyze_block_ensemble(ensemble)
+
+        # Make sure the length of the channel is a multiple of the step size.
+        # This is done by appending an idle block
+        granularity = self.pulse_generator_constraints.waveform_length.step
+        self.log.debug('length: {0}, mod {1}'.format(
+            ensemble_info['number_of_samples'], ensemble_info['number_of_samples'] % granularity))
+        if ensemble_info['number_of_samples'] % granularity != 0:
+            self.log.warn('Length {0} does not fulfil step constraint {1}.'.format(
+                ensemble_info['number_of_samples'], granularity))
+            # TODO: take care of rounding errors!
+            extension_samples = granularity - ensemble_info['number_of_samples'] % granularity
+            target_total_samples = ensemble_info['number_of_samples'] + extension_samples
+            extension_seconds = (target_total_samples / self.__sample_rate) - ensemble_info[
+                'ideal_length']
+
+            pb_element = PulseBlockElement(
+                init_length_s=extension_seconds,
+                increment_s=0,
+                pulse_function={chnl: SamplingFunctions.Idle() for chnl in self.analog_channels},
+                digital_high={chnl: False for chnl in self.digital_channels})
+            idle_extension = PulseBlock('idle_extension', element_list=[pb_element])
+            temp_measurement_info = copy.deepcopy(ensemble.measurement_information)
+            ensemble.append((idle_extension.name, 0))
+            ensemble.measurement_information = temp_measurement_info
+
+            self.save_block(idle_extension)
+            self.save_ensemble(ensemble)
+
+            # get important parameters from the ensemble
+            ensemble_info = self.analyze_block_ensemble(ensemble)
+            if ensemble_info['number_of_samples'] != target_total_samples:
+                self.log.error('Expanding the PulseBlockEnsemble to match the waveform granularity '
+                               'has failed.\nTarget number of samples was {0:d}.\nfinal number of '
+                               'samples is {1:d}.\nThis is probably due to a rounding error in '
+                               'SequenceGeneratorLogic.sample_pulse_block_ensemble.'
+                               ''.format(target_total_samples, ensemble_info['number_of_samples']))
+            else:
+                self.log.warn('Extending waveform {0} by {2} bins. New length {1}.'.format(
+                    ensemble.name, ensemble_info['number_of_samples'], extension_samples))
+        return ensemble_info
+
+    def _compile_block_ensemble(self, ensemble, ensemble_info, offset_bin=0):
+        """ Compiles a PulseBlockEnsemble into flat arrays describing each element occurrence
+        (incl. repetitions) in chronological order.
+
+        Identical sampling functions are collected per channel and referenced by an integer index
+        so that all occurrences of the same function can later be grouped and sampled at once.
+        Elements with a length of 0 bins are dropped since they do not contribute any samples.
+
+        @param PulseBlockEnsemble ensemble: The ensemble to compile
+        @param dict ensemble_info: The analysis result of the ensemble (see analyze_block_ensemble)
+        @param int offset_bin: The time offset in bins of the first sample of the ensemble
+
+        @return dict: compiled ensemble containing the element start bins, lengths, time offsets
+                      as well as the digital states and sampling function indices for each channel
+        """
+        # Collect all elements in chronological order. Each block is only stored once and its
+        # repetitions are expressed by tiling the element indices.
+        unique_elements = list()
+        element_indices = list()
+        for block_name, reps in ensemble.block_list:
+            block = self.get_block(block_name)
+            first_index = len(unique_elements)
+            unique_elements.extend(block.element_list)
+            block_indices = np.arange(first_index, len(unique_elements), dtype='int64')
+            element_indices.append(np.tile(block_indices, reps + 1))
+        if element_indices:
+            element_indices = np.concatenate(element_indices)
+        else:
+            element_indices = np.zeros(0, dtype='int64')
+
+        lengths = ensemble_info['elements_length_bins']
+        starts = np.cumsum(lengths) - lengths
+        non_empty = lengths > 0
+
+        # Digital states of each unique element
+        digital_states = dict()
+        for chnl in ensemble_info['digital_channels']:
+            digital_states[chnl] = np.array(
+                [element.digital_high[chnl] for element in unique_elements], dtype=bool)
+
+        # Sampling function indices of each unique element
+        function_indices = dict()
+        functions = dict()
+        for chnl in ensemble_info['analog_channels']:
+            function_dict = dict()
+            indices = np.empty(len(unique_elements), dtype='int64')
+            for ii, element in enumerate(unique_elements):
+                indices[ii] = function_dict.setdefault(element.pulse_function[chnl],
+                                                       len(function_dict))
+            function_indices[chnl] = indices
+            functions[chnl] = list(function_dict)
+
+        compiled = dict()
+        compiled['element_indices'] = element_indices[non_empty]
+        compiled['starts'] = starts[non_empty]
+        compiled['lengths'] = lengths[non_empty]
+        compiled['offset_bin'] = offset_bin
+        compiled['rotating_frame'] = ensemble.rotating_frame
+        compiled['digital_states'] = digital_states
+        compiled['function_indices'] = function_indices
+        compiled['functions'] = functions
+        compiled['sample_rate'] = self.__sample_rate
+        compiled['analog_norms'] = {chnl: self.__analog_levels[0][chnl] / 2 for chnl in functions}
+        return compiled
+
+    def _iter_sampled_chunks(self, compiled, number_of_samples, sample_buffer, cache_entry=None):
+        """ Generator sampling a compiled PulseBlockEnsemble chunk by chunk into the same
+        preallocated sample arrays. The chunk size is given by the length of the sample arrays, the
+        last chunk may be shorter.
+
+        @param dict compiled: compiled ensemble as returned by _compile_block_ensemble
+        @param int number_of_samples: total number of samples in the ensemble
+        @param tuple sample_buffer: (<analog sample arrays dict>, <digital sample arrays dict>)
+        @param tuple cache_entry: optional (<analog>, <digital>) memmaps of a waveform cache entry
+                                  to store the samples in
+
+        @return (dict, dict): analog and digital sample arrays of the next chunk
+        """
+        analog_buffer, digital_buffer = sample_buffer
+        buffer_length = len(next(iter(analog_buffer.values() or digital_buffer.values())))
+        for chunk_start in range(0, number_of_samples, buffer_length):
+            yield self._sample_chunk_into_buffer(compiled, chunk_start,
+                                                 min(buffer_length, number_of_samples - chunk_start),
+                                                 sample_buffer, cache_entry)
+
+    def _iter_sampled_chunks_pipelined(self, compiled, number_of_samples, sample_buffers,
+                                       cache_entry=None):
+        """ Generator sampling a compiled PulseBlockEnsemble chunk by chunk in a worker thread.
+
+        While the consumer processes (i.e. writes to the device) the chunk yielded last, the worker
+        thread already samples the next chunk into another set of sample arrays. A buffer is handed
+        back to the worker as soon as the consumer asks for the next chunk, so memory usage is
+        capped by the number of sample buffers provided.
+        Exceptions raised during sampling are re-raised in the consumer thread.
+
+        @param dict compiled: compiled ensemble as returned by _compile_block_ensemble
+        @param int number_of_samples: total number of samples in the ensemble
+        @param list sample_buffers: list of (<analog sample arrays>, <digital sample arrays>) tuples
+        @param tuple cache_entry: optional (<analog>, <digital>) memmaps of a waveform cache entry
+                                  to store the samples in
+
+        @return (dict, dict): analog and digital sample arrays of the next chunk
+        """
+        analog_buffer, digital_buffer = sample_buffers[0]
+        buffer_length = len(next(iter(analog_buffer.values() or digital_buffer.values())))
+        chunk_starts = range(0, number_of_samples, buffer_length)
+
+        free_buffers = queue.Queue()
+        for buffer_index in range(len(sample_buffers)):
+            free_buffers.put(buffer_index)
+        sampled_chunks = queue.Queue(maxsize=len(sample_buffers))
+        stop_event = threading.Event()
+
+        def sample_chunks():
+            try:
+                for chunk_start in chunk_starts:
+                    buffer_index = free_buffers.get()
+                    if stop_event.is_set():
+                        return
+                    chunk = self._sample_chunk_into_buffer(
+                        compiled, chunk_start, min(buffer_length, number_of_samples - chunk_start),
+                        sample_buffers[buffer_index], cache_entry)
+                    sampled_chunks.put((buffer_index, chunk))
+            except Exception as err:
+                sampled_chunks.put((None, err))
+
+        worker = threading.Thread(target=sample_chunks, name='sample_chunks', daemon=True)
+        worker.start()
+        try:
+            for chunk_start in chunk_starts:
+                buffer_index, chunk = sampled_chunks.get()
+                if buffer_index is None:
+                    raise chunk
+                yield chunk
+                free_buffers.put(buffer_index)
+        finally:
+            stop_event.set()
+            free_buffers.put(None)
+            worker.join()
+
+    def _sample_chunk_into_buffer(self, compiled, chunk_start, chunk_length, sample_buffer,
+                                  cache_entry=None):
+        """ Samples a single chunk of a compiled PulseBlockEnsemble into the given sample arrays
+        and optionally stores it in a waveform cache entry.
+
+        @return (dict, dict): analog and digital sample arrays (views) of length chunk_length
+        """
+        analog_samples = {chnl: samples[:chunk_length] for chnl, samples in
+                          sample_buffer[0].items()}
+        digital_samples = {chnl: samples[:chunk_length] for chnl, samples in
+                           sample_buffer[1].items()}
+        sample_compiled_chunk(compiled,
+                              chunk_start=chunk_start,
+                              chunk_length=chunk_length,
+                              analog_samples=analog_samples,
+                              digital_samples=digital_samples)
+        if cache_entry is not None:
+            chunk_end = chunk_start + chunk_length
+            for chnl, samples in analog_samples.items():
+                cache_entry[0][chnl][chunk_start:chunk_end] = samples
+            for chnl, samples in digital_samples.items():
+                cache_entry[1][chnl][chunk_start:chunk_end] = samples
+        return analog_samples, digital_samples
+
+    @staticmethod
+    def _iter_stored_chunks(stored_samples, number_of_samples, chunk_size, cache_entry=None):
+        """ Generator streaming the sample arrays of an already sampled waveform (e.g. from the
+        waveform cache or from a worker process) chunk by chunk.
+
+        @param tuple stored_samples: (<analog>, <digital>) sample arrays of the whole waveform
+        @param int number_of_samples: total number of samples in the waveform
+        @param int chunk_size: maximum number of samples per chunk
+        @param tuple cache_entry: optional (<analog>, <digital>) memmaps of a waveform cache entry
+                                  to store the samples in
+
+        @return (dict, dict): analog and digital sample arrays of the next chunk
+        """
+        for chunk_start in range(0, number_of_samples, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, number_of_samples)
+            analog_samples = {chnl: np.asarray(samples[chunk_start:chunk_end]) for
+                              chnl, samples in stored_samples[0].items()}
+            digital_samples = {chnl: np.asarray(samples[chunk_start:chunk_end]) for
+                               chnl, samples in stored_samples[1].items()}
+            if cache_entry is not None:
+                for chnl, samples in analog_samples.items():
+                    cache_entry[0][chnl][chunk_start:chunk_end] = samples
+                for chnl, samples in digital_samples.items():
+                    cache_entry[1][chnl][chunk_start:chunk_end] = samples
+            yield analog_samples, digital_samples
+
+    def _sample_ensembles_parallel(self, ensemble_names):
+        """ Starts sampling the given PulseBlockEnsembles without rotating frame in worker
+        processes. The samples are written into shared memory and picked up in order by
+        sample_pulse_block_ensemble which still performs the upload to the device.
+        Only a limited number of ensembles is sampled ahead of the upload, see
+        _submit_parallel_sampling.
+
+        @param list ensemble_names: names of saved PulseBlockEnsembles to sample in upload order
+        """
+        if not SharedSampleBuffer.is_supported():
+            self.log.warning('Parallel sampling needs Python 3.8 or newer. PulseBlockEnsembles are '
+                             'sampled sequentially.')
+            return
+
+        if self._sampling_executor is None:
+            # Use fresh interpreters instead of forking the running Qt application
+            self._sampling_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._sampling_processes,
+                mp_context=multiprocessing.get_context('spawn'))
+
+        self._parallel_sampling_queue = [name for name in OrderedDict.fromkeys(ensemble_names)
+                                         if name not in self._presampled_ensembles]
+        self._submit_parallel_sampling()
+        return
+
+    def _submit_parallel_sampling(self):
+        """ Submits queued PulseBlockEnsembles to the worker processes until sampling_processes
+        ensembles are sampled ahead of the upload. Each one needs a shared buffer for all of its
+        samples, so ensembles larger than overhead_bytes (if set) are left to the chunked sampling
+        in sample_pulse_block_ensemble.
+        """
+        while self._parallel_sampling_queue and \
+                len(self._presampled_ensembles) < self._sampling_processes:
+            name = self._parallel_sampling_queue.pop(0)
+            ensemble = self.get_ensemble(name)
+            ensemble_info = self._analyze_padded_block_ensemble(ensemble)
+            if ensemble_info['number_of_samples'] == 0:
+                continue
+            buffer_size = SharedSampleBuffer.get_size(ensemble_info['analog_channels'],
+                                                      ensemble_info['digital_channels'],
+                                                      ensemble_info['number_of_samples'])
+            if 0 < self._overhead_bytes < buffer_size:
+                continue
+            compiled = self._compile_block_ensemble(ensemble, ensemble_info, offset_bin=0)
+            try:
+                shared_buffer = SharedSampleBuffer(ensemble_info['analog_channels'],
+                                                   ensemble_info['digital_channels'],
+                                                   ensemble_info['number_of_samples'])
+            except OSError:
+                self.log.warning('Unable to allocate shared memory for parallel sampling of '
+                                 'PulseBlockEnsemble "{0}".'.format(name))
+                continue
+            future = self._sampling_executor.submit(sample_compiled_into_shared_buffer,
+                                                    compiled,
+                                                    shared_buffer.spec)
+            self._presampled_ensembles[name] = (future, shared_buffer)
+        return
+
+    def _release_presampled_ensemble(self, name):
+        """ Waits for a pending parallel sampling job and frees its shared memory.
+
+        @param str name: name of the PulseBlockEnsemble
+        """
+        if name not in self._presampled_ensembles:
+            return
+        future, shared_buffer = self._presampled_ensembles.pop(name)
+        future.cancel()
+        concurrent.futures.wait([future])
+        shared_buffer.release()
+        return
+
+    def _release_presampled_ensembles(self):
+        """ Waits for all pending parallel sampling jobs and frees their shared memory.
+        """
+        self._parallel_sampling_queue = list()
+        for name in list(self._presampled_ensembles):
+            self._release_presampled_ensemble(name)
+        return
+
     @QtCore.Slot(str)
     def sample_pulse_sequence(self, sequence):
         """ Samples the PulseSequence object, which serves as the construction plan.
@@ -2034,6 +2378,18 @@ class SequenceGeneratorLogic(GenericLogic):
         # of the sampled Pulse_Block_Ensembles one has to introduce a running number as an
         # additional name tag, so keep the sampled files separate.
         offset_bin = 0  # that will be used for phase preservation
+
+        # Ensembles without rotating frame dependency can be sampled in parallel by worker
+        # processes. The upload to the device still happens in order below.
+        if not sequence.rotating_frame and self._sampling_processes > 1:
+            ensembles_to_sample = list()
+            for seq_step in sequence:
+                sampling_info = self.get_ensemble(seq_step.ensemble).sampling_information
+                if not sampling_info or sampling_info[
+                        'pulse_generator_settings'] != self.pulse_generator_settings:
+                    ensembles_to_sample.append(seq_step.ensemble)
+            self._sample_ensembles_parallel(ensembles_to_sample)
+
         for step_index, seq_step in enumerate(sequence):
             if sequence.rotating_frame:
                 # to make something like 001
@@ -2056,6 +2412,7 @@ class SequenceGeneratorLogic(GenericLogic):
                     self.log.error('Sampling of PulseBlockEnsemble "{0}" failed during sampling of '
                                    'PulseSequence "{1}".\nFailed to create waveforms on device.'
                                    ''.format(seq_step.ensemble, sequence.name))
+                    self._release_presampled_ensembles()
                     self.module_state.unlock()
                     self.__sequence_generation_in_progress = False
                     self.sigSampleSequenceComplete.emit(None)
@@ -2080,6 +2437,13 @@ class SequenceGeneratorLogic(GenericLogic):
             sequence_param_dict_list.append(
                 (tuple(generated_ensembles[name_tag]['waveforms']), seq_step))
 
+            # Free the shared memory of the uploaded ensemble and sample the next ones
+            if self._presampled_ensembles or self._parallel_sampling_queue:
+                self._release_presampled_ensemble(name_tag)
+                self._submit_parallel_sampling()
+
+        self._release_presampled_ensembles()
+
         # pass the whole information to the sequence creation method:
         steps_written = self.pulsegenerator().write_sequence(sequence.name,
                                                              sequence_param_dict_list)
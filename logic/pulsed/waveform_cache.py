@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi helper class for caching sampled waveforms on disk.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import numpy as np
+from collections import OrderedDict
+
+
+class WaveformCache:
+    """
+    Disk-backed cache of sampled waveforms with least-recently-used eviction.
+
+    Each entry is a directory named by a content hash of everything that determines the samples
+    (see get_key) and holds one memory-mappable .npy file per channel (float32 for analog, bool for
+    digital channels). The total size of all entries is kept below max_size bytes by removing the
+    least recently used entries first. A max_size of 0 disables the cache.
+    """
+    _tmp_suffix = '.tmp'
+
+    def __init__(self, path, max_size=0):
+        self.log = logging.getLogger(__name__)
+        self._path = path
+        self._max_size = int(max_size)
+        # key: size in bytes. Ordered from least to most recently used.
+        self._entries = OrderedDict()
+        # key: (analog, digital) dicts of open sample memmaps for entries currently being written
+        self._pending = dict()
+        if self.enabled:
+            self._scan_entries()
+
+    @property
+    def enabled(self):
+        return self._max_size > 0
+
+    @property
+    def size(self):
+        return sum(self._entries.values())
+
+    @staticmethod
+    def get_key(ensemble, blocks, offset_bin, sample_rate, analog_levels, activation_config):
+        """
+        Calculates a stable hash of all parameters determining the samples of a PulseBlockEnsemble.
+        The names of the ensemble and of the blocks do not contribute to the key.
+
+        @param PulseBlockEnsemble ensemble: The ensemble to sample
+        @param dict blocks: PulseBlock instances used in the ensemble with the names as keys
+        @param int offset_bin: time offset in bins of the first sample (rotating frame)
+        @param float sample_rate: sample rate in samples/s
+        @param tuple analog_levels: (<pp_amplitude dict>, <offset dict>) of the analog channels
+        @param set activation_config: set of active channel descriptors
+
+        @return str: hexadecimal content hash
+        """
+        block_list = list()
+        for block_name, reps in ensemble.block_list:
+            elements = blocks[block_name].get_dict_representation()['element_list']
+            block_list.append((elements, reps))
+        content = {'block_list': block_list,
+                   'rotating_frame': ensemble.rotating_frame,
+                   'offset_bin': int(offset_bin),
+                   'sample_rate': float(sample_rate),
+                   'analog_levels': analog_levels,
+                   'activation_config': sorted(activation_config)}
+        serialized = json.dumps(content, sort_keys=True, default=repr)
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+    def load(self, key):
+        """
+        Opens the sample arrays of a cached waveform as read-only memmaps.
+
+        @param str key: content hash of the waveform (see get_key)
+
+        @return (dict, dict): analog and digital sample memmaps with channel descriptors as keys.
+                              None if the key is not present in the cache.
+        """
+        if not self.enabled or key not in self._entries:
+            return None
+        entry_dir = os.path.join(self._path, key)
+        analog_samples = dict()
+        digital_samples = dict()
+        try:
+            for file_name in os.listdir(entry_dir):
+                chnl = os.path.splitext(file_name)[0]
+                samples = np.load(os.path.join(entry_dir, file_name), mmap_mode='r')
+                if chnl.startswith('a'):
+                    analog_samples[chnl] = samples
+                else:
+                    digital_samples[chnl] = samples
+        except (OSError, ValueError):
+            self.log.warning('Corrupt waveform cache entry "{0}" removed.'.format(key))
+            self._remove_entry(key)
+            return None
+        # Mark as most recently used
+        self._entries.move_to_end(key)
+        os.utime(entry_dir)
+        return analog_samples, digital_samples
+
+    def create_entry(self, key, analog_channels, digital_channels, number_of_samples):
+        """
+        Creates writable sample memmaps for a new cache entry. The entry becomes visible only after
+        calling commit_entry.
+
+        @param str key: content hash of the waveform (see get_key)
+        @param set analog_channels: analog channel descriptors
+        @param set digital_channels: digital channel descriptors
+        @param int number_of_samples: total number of samples per channel
+
+        @return (dict, dict): analog and digital sample memmaps to write into.
+                              None if the entry can not be cached.
+        """
+        if not self.enabled:
+            return None
+        number_of_samples = int(number_of_samples)
+        entry_size = number_of_samples * (4 * len(analog_channels) + len(digital_channels))
+        if entry_size > self._max_size or number_of_samples == 0:
+            return None
+        self.discard_entry(key)
+        tmp_dir = os.path.join(self._path, key + self._tmp_suffix)
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            analog_samples = dict()
+            digital_samples = dict()
+            for chnl in analog_channels:
+                analog_samples[chnl] = np.lib.format.open_memmap(
+                    os.path.join(tmp_dir, chnl + '.npy'),
+                    mode='w+',
+                    dtype='float32',
+                    shape=(number_of_samples,))
+            for chnl in digital_channels:
+                digital_samples[chnl] = np.lib.format.open_memmap(
+                    os.path.join(tmp_dir, chnl + '.npy'),
+                    mode='w+',
+                    dtype=bool,
+                    shape=(number_of_samples,))
+        except OSError:
+            self.log.exception('Unable to create waveform cache entry. Caching skipped.')
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return None
+        self._pending[key] = (analog_samples, digital_samples)
+        return analog_samples, digital_samples
+
+    def commit_entry(self, key):
+        """
+        Flushes the sample memmaps of an entry created by create_entry to disk and adds it to the
+        cache. Least recently used entries are evicted if the size budget is exceeded.
+
+        @param str key: content hash of the waveform (see get_key)
+        """
+        if key not in self._pending:
+            return
+        # Flush and release the memmaps before moving the files
+        for sample_dict in self._pending.pop(key):
+            for samples in sample_dict.values():
+                samples.flush()
+            sample_dict.clear()
+        samples = None
+        tmp_dir = os.path.join(self._path, key + self._tmp_suffix)
+        entry_dir = os.path.join(self._path, key)
+        try:
+            if os.path.exists(entry_dir):
+                self._remove_entry(key)
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            self.log.exception('Unable to store waveform cache entry "{0}".'.format(key))
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        self._entries[key] = self._get_dir_size(entry_dir)
+        self._evict()
+
+    def discard_entry(self, key):
+        """
+        Removes an uncommitted entry created by create_entry, e.g. after a failed write.
+
+        @param str key: content hash of the waveform (see get_key)
+        """
+        self._pending.pop(key, None)
+        shutil.rmtree(os.path.join(self._path, key + self._tmp_suffix), ignore_errors=True)
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        for key in list(self._entries):
+            self._remove_entry(key)
+
+    def _scan_entries(self):
+        """
+        Builds the entry index from the cache directory ordered by last usage. Left-over
+        uncommitted entries are removed.
+        """
+        os.makedirs(self._path, exist_ok=True)
+        entries = list()
+        for name in os.listdir(self._path):
+            entry_dir = os.path.join(self._path, name)
+            if not os.path.isdir(entry_dir):
+                continue
+            if name.endswith(self._tmp_suffix):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            entries.append((os.path.getmtime(entry_dir), name, self._get_dir_size(entry_dir)))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+        self._evict()
+
+    def _evict(self):
+        """
+        Removes the least recently used entries until the size budget is met.
+        """
+        total_size = self.size
+        while total_size > self._max_size and self._entries:
+            key = next(iter(self._entries))
+            total_size -= self._entries[key]
+            self._remove_entry(key)
+
+    def _remove_entry(self, key):
+        self._entries.pop(key, None)
+        shutil.rmtree(os.path.join(self._path, key), ignore_errors=True)
+
+    @staticmethod
+    def _get_dir_size(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
@@ -20,16 +20,21 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 """
 
 from cycler import cycler
+import concurrent.futures
+import copy
 import datetime
 import inspect
+import json
 import logging
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+import queue
 import sys
+import threading
 import time
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from core.configoption import ConfigOption
 from core.util import units
 from core.util.mutex import Mutex
@@ -39,6 +44,11 @@ from matplotlib.backends.backend_pdf import PdfPages
 from PIL import Image
 from PIL import PngImagePlugin
 
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
 
 class DailyLogHandler(logging.FileHandler):
     """
@@ -129,6 +139,16 @@ class SaveLogic(GenericLogic):
         log_into_daily_directory: True
         save_pdf: True
         save_png: True
+        default_filetype: 'text'    # optional, one of 'text', 'npz', 'npy' or 'hdf5'
+        save_queue_size: 16         # optional, maximum number of pending jobs of save_data_async
+
+    Besides the human readable 'text' format, data can be saved in binary formats:
+        'npz':  compressed numpy archive and a text file containing the parameters
+        'npy':  one uncompressed (memory-mappable) .npy file per data array and a JSON sidecar
+                file containing the parameters and the data labels
+        'hdf5': a single HDF5 file containing the data arrays as datasets and the parameters as
+                attributes. Needs the optional package h5py.
+    All formats can be read back with load_data.
     """
 
     _win_data_dir = ConfigOption('win_data_directory', 'C:/Data/')
@@ -136,6 +156,10 @@ class SaveLogic(GenericLogic):
     log_into_daily_directory = ConfigOption('log_into_daily_directory', False, missing='warn')
     save_pdf = ConfigOption('save_pdf', False)
     save_png = ConfigOption('save_png', True)
+    _default_filetype = ConfigOption('default_filetype', 'text', missing='nothing')
+    _save_queue_size = ConfigOption('save_queue_size', 16, missing='nothing')
+
+    _binary_filetypes = ('npz', 'npy', 'hdf5')
 
     # Matplotlib style definition for saving plots
     mpl_qd_style = {
@@ -220,8 +244,18 @@ class SaveLogic(GenericLogic):
                     'boolean. Falling back to default setting: False.')
                 self.log_into_daily_directory = False
 
+        if self._default_filetype not in ('text', ) + self._binary_filetypes:
+            self.log.warning('Unknown default_filetype "{0}" in configuration. Falling back to '
+                             'default setting: "text".'.format(self._default_filetype))
+            self._default_filetype = 'text'
+
         self._daily_loghandler = None
 
+        # queue of pending save_data_async jobs and the writer thread handling them
+        self._save_queue = None
+        self._save_thread = None
+        self._save_latencies = deque(maxlen=100)
+
     def on_activate(self):
         """ Definition, configuration and initialisation of the SaveLogic.
         """
@@ -237,7 +271,20 @@ class SaveLogic(GenericLogic):
         else:
             self._daily_loghandler = None
 
+        self._save_latencies.clear()
+        self._save_queue = queue.Queue(maxsize=max(int(self._save_queue_size), 1))
+        self._save_thread = threading.Thread(target=self._save_worker,
+                                             name='save_worker',
+                                             daemon=True)
+        self._save_thread.start()
+
     def on_deactivate(self):
+        # Save all pending data before stopping the writer thread
+        if self._save_thread is not None:
+            self._save_queue.put(None)
+            self._save_thread.join()
+            self._save_thread = None
+
         if self._daily_loghandler is not None:
             # removes the log handler logging into the daily directory
             logging.getLogger().removeHandler(self._daily_loghandler)
@@ -258,7 +305,7 @@ class SaveLogic(GenericLogic):
         self._daily_loghandler.setLevel(level)
 
     def save_data(self, data, filepath=None, parameters=None, filename=None, filelabel=None,
-                  timestamp=None, filetype='text', fmt='%.15e', delimiter='\t', plotfig=None):
+                  timestamp=None, filetype=None, fmt='%.15e', delimiter='\t', plotfig=None):
         """
         General save routine for data.
 
@@ -304,7 +351,10 @@ class SaveLogic(GenericLogic):
                                    filename and a timestamp, because then the timestamp will be
                                    ignored.
         @param string filetype: optional, the file format the data should be saved in. Valid inputs
-                                are 'text', 'xml' and 'npz'. Default is 'text'.
+                                are 'text', 'npz', 'npy' and 'hdf5'. Default is the configured
+                                default_filetype ('text' if not configured). For the binary formats
+                                the ending of the filename is replaced by the format specific one
+                                and the data arrays can have any dimension.
         @param string or list of strings fmt: optional, format specifier for saved data. See python
                                               documentation for
                                               "Format Specification Mini-Language". If you want for
@@ -349,7 +399,166 @@ class SaveLogic(GenericLogic):
         YOU ARE RESPONSIBLE FOR THE IDENTIFIER! DO NOT FORGET THE UNITS FOR THE SAVED TIME
         TRACE/MATRIX.
         """
+        return self._save_data(data=data,
+                               module_name=self._get_caller_module_name(),
+                               poi_name=self.active_poi_name,
+                               filepath=filepath,
+                               parameters=parameters,
+                               filename=filename,
+                               filelabel=filelabel,
+                               timestamp=timestamp,
+                               filetype=filetype,
+                               fmt=fmt,
+                               delimiter=delimiter,
+                               plotfig=plotfig)
+
+    def save_data_async(self, data, filepath=None, parameters=None, filename=None,
+                        filelabel=None, timestamp=None, filetype=None, fmt='%.15e', delimiter='\t',
+                        plotfig=None, save_figure=True, timeout=None):
+        """
+        Non-blocking version of save_data. A snapshot of the data and the parameters is put into
+        the save queue and written to disk by the writer thread of the SaveLogic, including the
+        rendering of the figure. The calling thread only blocks while the queue is full
+        (back-pressure) until a slot is free or the timeout has passed.
+
+        Do not modify or close the passed figure afterwards, it is closed by the writer thread.
+
+        @param bool save_figure: optional, if False plotfig is closed without rendering and saving
+        @param float timeout: optional, maximum time in seconds to wait for a free slot if the save
+                              queue is full. Wait indefinitely if None.
+
+        For all other parameters see save_data.
+
+        @return concurrent.futures.Future: future of the save job. The result is the return value
+                                           of save_data. None if the job could not be queued.
+        """
+        if not save_figure and plotfig is not None:
+            plt.close(plotfig)
+            plotfig = None
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+        try:
+            data = OrderedDict((key, np.array(value)) for key, value in data.items())
+        except:
+            self.log.error('Casting data arrays into numpy.ndarray failed. Could not save data.')
+            return None
+        if isinstance(parameters, dict):
+            try:
+                parameters = copy.deepcopy(parameters)
+            except:
+                parameters = dict(parameters)
+
+        job_kwargs = {'data': data,
+                      'module_name': self._get_caller_module_name(),
+                      'poi_name': self.active_poi_name,
+                      'filepath': filepath,
+                      'parameters': parameters,
+                      'filename': filename,
+                      'filelabel': filelabel,
+                      'timestamp': timestamp,
+                      'filetype': filetype,
+                      'fmt': fmt,
+                      'delimiter': delimiter,
+                      'plotfig': plotfig}
+        future = concurrent.futures.Future()
+        if self._save_thread is None or not self._save_thread.is_alive():
+            self.log.warning('Save queue is not running. Saving data synchronously.')
+            future.set_running_or_notify_cancel()
+            future.set_result(self._save_data(**job_kwargs))
+            return future
+        try:
+            self._save_queue.put((future, time.perf_counter(), job_kwargs), timeout=timeout)
+        except queue.Full:
+            self.log.error('Save queue is full. Data of module "{0}" could not be saved.'
+                           ''.format(job_kwargs['module_name']))
+            if plotfig is not None:
+                plt.close(plotfig)
+            return None
+        return future
+
+    def flush_save_queue(self):
+        """
+        Blocks until all data passed to save_data_async so far has been saved.
+        """
+        if self._save_thread is not None and self._save_thread.is_alive():
+            self._save_queue.join()
+        return
+
+    def get_save_latencies(self):
+        """
+        Returns the latencies of the last (up to 100) jobs handled by the save queue.
+
+        @return numpy.ndarray: 2D array with the time in seconds each job waited in the queue (first
+                               column) and the time needed to save it (second column)
+        """
+        with self.lock:
+            return np.array(self._save_latencies, dtype=float).reshape((-1, 2))
+
+    def _save_worker(self):
+        """
+        Writer thread saving the jobs of the save queue until it receives None.
+        """
+        while True:
+            job = self._save_queue.get()
+            if job is None:
+                self._save_queue.task_done()
+                break
+            future, enqueue_time, job_kwargs = job
+            if future.set_running_or_notify_cancel():
+                start_time = time.perf_counter()
+                try:
+                    future.set_result(self._save_data(**job_kwargs))
+                except Exception as e:
+                    self.log.exception('Saving data of module "{0}" failed.'
+                                       ''.format(job_kwargs['module_name']))
+                    future.set_exception(e)
+                stop_time = time.perf_counter()
+                with self.lock:
+                    self._save_latencies.append((start_time - enqueue_time,
+                                                 stop_time - start_time))
+                self.log.debug('Saved data of module "{0}" in {1:.3f}s after waiting {2:.3f}s in '
+                               'the save queue.'.format(job_kwargs['module_name'],
+                                                        stop_time - start_time,
+                                                        start_time - enqueue_time))
+            self._save_queue.task_done()
+        return
+
+    @staticmethod
+    def _get_caller_module_name():
+        """
+        Returns the name of the module calling the public save method which called this method.
+        """
+        try:
+            # this will get the object, which called the save method.
+            mod = inspect.getmodule(sys._getframe(2))
+            # that will extract the name of the class.
+            return mod.__name__.split('.')[-1]
+        except:
+            # Sometimes it is not possible to get the object which called the save method
+            # (such as when calling this from the console).
+            return 'UNSPECIFIED'
+
+    def _save_data(self, data, module_name, poi_name, filepath=None, parameters=None,
+                   filename=None, filelabel=None, timestamp=None, filetype=None, fmt='%.15e',
+                   delimiter='\t', plotfig=None):
+        """
+        Saves the data for save_data and the save queue. See save_data for the parameters.
+
+        @param str module_name: name of the module the data is saved for
+        @param str poi_name: name of the POI the data was measured at. Empty string if none.
+        """
         start_time = time.time()
+        if filetype is None:
+            filetype = self._default_filetype
+        if filetype == 'hdf5' and h5py is None:
+            self.log.error('Saving data as HDF5 file requires the package h5py. Saving data as npy '
+                           'files with JSON sidecar instead.')
+            filetype = 'npy'
+        elif filetype != 'text' and filetype not in self._binary_filetypes:
+            self.log.error('Filetype "{0}" is not supported. Saving data as textfile.'
+                           ''.format(filetype))
+            filetype = 'text'
+
         # Create timestamp if none is present
         if timestamp is None:
             timestamp = datetime.datetime.now()
@@ -388,7 +597,7 @@ class SaveLogic(GenericLogic):
                     found_1d = True
                     max_row_num += 1
             else:
-                if filetype != "npz":
+                if filetype not in self._binary_filetypes:
                     self.log.error('Found data array with dimension >2. Unable to save data.')
                     return -1
 
@@ -399,24 +608,12 @@ class SaveLogic(GenericLogic):
             arr_dtype.append(data[keyname].dtype)
 
         # Raise error if data contains a mixture of 1D and 2D arrays
-        if found_2d and found_1d:
+        if found_2d and found_1d and filetype == 'text':
             self.log.error('Passed data dictionary contains 1D AND 2D arrays. This is not allowed. '
                            'Either fit all data arrays into a single 2D array or pass multiple 1D '
                            'arrays only. Saving data failed!')
             return -1
 
-        # try to trace back the functioncall to the class which was calling it.
-        try:
-            frm = inspect.stack()[1]
-            # this will get the object, which called the save_data function.
-            mod = inspect.getmodule(frm[0])
-            # that will extract the name of the class.
-            module_name = mod.__name__.split('.')[-1]
-        except:
-            # Sometimes it is not possible to get the object which called the save_data function
-            # (such as when calling this from the console).
-            module_name = 'UNSPECIFIED'
-
         # determine proper file path
         if filepath is None:
             filepath = self.get_path_for_module(module_name)
@@ -428,8 +625,8 @@ class SaveLogic(GenericLogic):
         # create filelabel if none has been passed
         if filelabel is None:
             filelabel = module_name
-        if self.active_poi_name != '':
-            filelabel = self.active_poi_name.replace(' ', '_') + '_' + filelabel
+        if poi_name != '':
+            filelabel = poi_name.replace(' ', '_') + '_' + filelabel
 
         # determine proper unique filename to save if none has been passed
         if filename is None:
@@ -447,8 +644,8 @@ class SaveLogic(GenericLogic):
                  ''.format(module_name, timestamp.strftime('%d.%m.%Y at %Hh%Mm%Ss'))
         header += '\nParameters:\n===========\n\n'
         # Include the active POI name (if not empty) as a parameter in the header
-        if self.active_poi_name != '':
-            header += 'Measured at POI: {0}\n'.format(self.active_poi_name)
+        if poi_name != '':
+            header += 'Measured at POI: {0}\n'.format(poi_name)
         # add the parameters if specified:
         if parameters is not None:
             # check whether the format for the parameters have a dict type:
@@ -468,7 +665,6 @@ class SaveLogic(GenericLogic):
         header += '\nData:\n=====\n'
 
         # write data to file
-        # FIXME: Implement other file formats
         # write to textfile
         if filetype == 'text':
             # Reshape data if multiple 1D arrays have been passed to this method.
@@ -519,12 +715,27 @@ class SaveLogic(GenericLogic):
             self.save_array_as_text(data=[], filename=filename[:-4]+'_params.dat', filepath=filepath,
                                     fmt=fmt, header=header, delimiter=delimiter, comments='#',
                                     append=False)
+        # write binary files and save parameters as JSON sidecar or HDF5 attributes
         else:
-            self.log.error('Only saving of data as textfile and npz-file is implemented. Filetype "{0}" is not '
-                           'supported yet. Saving as textfile.'.format(filetype))
-            self.save_array_as_text(data=data[identifier_str], filename=filename, filepath=filepath,
-                                    fmt=fmt, header=header, delimiter=delimiter, comments='#',
-                                    append=False)
+            metadata = {'module': module_name,
+                        'timestamp': timestamp.isoformat(),
+                        'poi': poi_name}
+            if isinstance(parameters, dict):
+                parameter_dict = parameters
+            elif parameters is not None:
+                parameter_dict = {'not specified parameters': str(parameters)}
+            else:
+                parameter_dict = dict()
+            if filetype == 'hdf5':
+                self._save_hdf5(data=data,
+                                file_path=os.path.join(filepath, os.path.splitext(filename)[0]),
+                                parameters=parameter_dict,
+                                metadata=metadata)
+            else:
+                self._save_npy(data=data,
+                               file_path=os.path.join(filepath, os.path.splitext(filename)[0]),
+                               parameters=parameter_dict,
+                               metadata=metadata)
 
         #--------------------------------------------------------------------------------------------
         # Save thumbnail figure of plot
@@ -604,6 +815,178 @@ class SaveLogic(GenericLogic):
                            comments=comments)
         return
 
+    def _save_npy(self, data, file_path, parameters, metadata):
+        """
+        Saves each data array as uncompressed .npy file and the parameters, metadata and data
+        labels in a JSON sidecar file.
+
+        @param dict data: data arrays with the data labels as keys
+        @param str file_path: path of the files without file ending
+        @param dict parameters: parameters to save
+        @param dict metadata: module name, timestamp and POI of the measurement
+        """
+        datasets = list()
+        for index, (label, array) in enumerate(data.items()):
+            array_path = '{0}_data{1:d}.npy'.format(file_path, index)
+            np.save(array_path, array, allow_pickle=False)
+            datasets.append({'label': label, 'file': os.path.basename(array_path)})
+        # The sidecar is written last so it only exists for completely saved data.
+        sidecar = {**metadata, 'parameters': parameters, 'datasets': datasets}
+        with open(file_path + '.json', 'w') as file:
+            json.dump(sidecar, file, indent=2, default=self._json_default)
+        return
+
+    def _save_hdf5(self, data, file_path, parameters, metadata):
+        """
+        Saves the data arrays as datasets of a single HDF5 file. The parameters are saved as
+        JSON encoded attributes of the group "parameters", the metadata as attributes of the file.
+
+        @param dict data: data arrays with the data labels as keys
+        @param str file_path: path of the file without file ending
+        @param dict parameters: parameters to save
+        @param dict metadata: module name, timestamp and POI of the measurement
+        """
+        with h5py.File(file_path + '.h5', 'w', track_order=True) as file:
+            for key, value in metadata.items():
+                file.attrs[key] = value
+            param_group = file.create_group('parameters', track_order=True)
+            for key, value in parameters.items():
+                param_group.attrs[str(key)] = json.dumps(value, default=self._json_default)
+            data_group = file.create_group('data', track_order=True)
+            for label, array in data.items():
+                # '/' would create a subgroup. The original label is kept as attribute.
+                dataset = data_group.create_dataset(label.replace('/', '|'), data=array)
+                dataset.attrs['label'] = label
+        return
+
+    @staticmethod
+    def _json_default(obj):
+        """
+        Converts objects not serializable by the json module. Unknown objects are saved as string.
+        """
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        elif isinstance(obj, np.generic):
+            return obj.item()
+        elif isinstance(obj, (datetime.datetime, datetime.date)):
+            return obj.isoformat()
+        elif isinstance(obj, (set, frozenset)):
+            return list(obj)
+        return str(obj)
+
+    def load_data(self, file_path, mmap_mode=None, delimiter='\t'):
+        """
+        Loads data saved with save_data in any of the supported file formats. The format is
+        determined by the file ending:
+            '.h5' or '.hdf5': HDF5 file
+            '.json':          JSON sidecar of the npy format
+            '.npz':           numpy archive (parameters are read from the <name>_params.dat file)
+            anything else:    text file
+
+        @param str file_path: full path of the file to load
+        @param str mmap_mode: optional, memory-map mode passed to numpy.load for the npy format,
+                              e.g. 'r' to access large arrays without loading them into memory
+        @param str delimiter: optional, the column delimiter of text files
+
+        @return (OrderedDict, dict): data arrays with the data labels as keys and the saved
+                                     parameters. (None, None) if loading failed.
+        """
+        if not os.path.isfile(file_path):
+            self.log.error('Unable to load data. File "{0}" does not exist.'.format(file_path))
+            return None, None
+
+        extension = os.path.splitext(file_path)[1].lower()
+        try:
+            if extension in ('.h5', '.hdf5'):
+                if h5py is None:
+                    self.log.error('Loading HDF5 files requires the package h5py.')
+                    return None, None
+                return self._load_hdf5(file_path)
+            elif extension == '.json':
+                return self._load_npy(file_path, mmap_mode=mmap_mode)
+            elif extension == '.npz':
+                with np.load(file_path, allow_pickle=False) as archive:
+                    data = OrderedDict((label, archive[label]) for label in archive.files)
+                param_path = file_path[:-4] + '_params.dat'
+                if os.path.isfile(param_path):
+                    parameters, _ = self._read_text_header(param_path)
+                else:
+                    parameters = dict()
+                return data, parameters
+            else:
+                return self._load_text(file_path, delimiter=delimiter)
+        except (OSError, ValueError, KeyError) as err:
+            self.log.error('Unable to load data from file "{0}":\n{1}'.format(file_path, err))
+            return None, None
+
+    def _load_npy(self, file_path, mmap_mode=None):
+        with open(file_path, 'r') as file:
+            sidecar = json.load(file)
+        directory = os.path.dirname(file_path)
+        data = OrderedDict()
+        for dataset in sidecar['datasets']:
+            data[dataset['label']] = np.load(os.path.join(directory, dataset['file']),
+                                             mmap_mode=mmap_mode,
+                                             allow_pickle=False)
+        return data, sidecar['parameters']
+
+    def _load_hdf5(self, file_path):
+        data = OrderedDict()
+        with h5py.File(file_path, 'r') as file:
+            parameters = {key: json.loads(value)
+                          for key, value in file['parameters'].attrs.items()}
+            for dataset in file['data'].values():
+                data[dataset.attrs['label']] = dataset[()]
+        return data, parameters
+
+    def _load_text(self, file_path, delimiter='\t'):
+        parameters, column_header = self._read_text_header(file_path)
+        array = np.loadtxt(file_path, delimiter=delimiter, comments='#', ndmin=2)
+        labels = [label for label in column_header.split(delimiter) if label]
+        if len(labels) == array.shape[1] > 1:
+            data = OrderedDict((label, array[:, i]) for i, label in enumerate(labels))
+        else:
+            data = OrderedDict([(column_header.strip(delimiter), array)])
+        return data, parameters
+
+    @staticmethod
+    def _read_text_header(file_path):
+        """
+        Reads the parameters and the column header from the header of a text file created by
+        save_data. Parameter values are converted into int or float if possible.
+
+        @param str file_path: full path of the text file
+
+        @return (dict, str): parameters and column header of the data
+        """
+        header_lines = list()
+        with open(file_path, 'r') as file:
+            for line in file:
+                if not line.startswith('#'):
+                    break
+                header_lines.append(line[1:].rstrip('\r\n'))
+
+        parameters = dict()
+        in_parameters = False
+        column_header = ''
+        for index, line in enumerate(header_lines):
+            if line == 'Parameters:':
+                in_parameters = True
+            elif line == 'Data:':
+                in_parameters = False
+                if index + 2 < len(header_lines):
+                    column_header = header_lines[index + 2]
+            elif in_parameters and ': ' in line:
+                key, value = line.split(': ', 1)
+                for converter in (int, float):
+                    try:
+                        value = converter(value)
+                        break
+                    except ValueError:
+                        pass
+                parameters[key] = value
+        return parameters, column_header
+
     def get_daily_directory(self):
         """ Gets or creates daily save directory.
 
@@ -274,6 +274,7 @@ class SCMagnetLogic(GenericLogic):
             # Only save figure if list is not empty to prevent IndexError
             fig = self.draw_figure(data=np.array(self._data_to_save))
             self._save_logic.save_figure(plotfig=fig, filepath=self.filepath, filename=self.filename)
+        self._save_logic.close_stream(filepath=self.filepath, filename=self.filename)
 
         self._saving = False
         self.sigSavingStatusChanged.emit(self._saving)
@@ -347,7 +348,8 @@ class SCMagnetLogic(GenericLogic):
                     self.header_string += ',{} (V)'.format(channel)
                 elif 'ramp_rate' in channel:
                     self.header_string += ',{} (A/s)'.format(channel)
-                elif 'quench_state' in channel:
+                else:
+                    # quench_state and ramping_state channels have no unit
                     self.header_string += ',{}'.format(channel)
 
             header_array = self.header_string.split(",")
@@ -75,6 +75,9 @@ class SingleShotLogic(GenericLogic):
         self._hist_num_bins = None
 
         self.data_dict = None
+        # cumulative sum of the summed laser pulses and cache of the analysed binnings
+        self._binning_cumsum = None
+        self._binning_analysis = dict()
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -143,6 +146,8 @@ class SingleShotLogic(GenericLogic):
             self.log.warning('using gated counter not implemented yet')
 
         self.data_dict = return_dict
+        self._binning_cumsum = None
+        self._binning_analysis = dict()
 
         return 0
 
@@ -194,10 +199,11 @@ class SingleShotLogic(GenericLogic):
         sum_single_pulses = []
         start_stop_tupel_list = self.find_laser(smoothing=smoothing, n_laserpulses=n_laserpulses)
         if self.data_dict:
-            data = self.data_dict['raw_data']
-            for row in data:
-                laser_pulses = [np.sum(row[jj[0]:jj[1]]) for jj in start_stop_tupel_list]
-                sum_single_pulses.append(laser_pulses)
+            data = np.asarray(self.data_dict['raw_data'])
+            # sum up each laser pulse in all rows at once
+            sum_single_pulses = [np.sum(data[:, start:stop], axis=1)
+                                 for start, stop in start_stop_tupel_list]
+            return np.stack(sum_single_pulses, axis=1)
         else:
             self.log.error('Pull data from fastcounting device using get_data function before trying to sum_laserpulse.')
 
@@ -241,29 +247,64 @@ class SingleShotLogic(GenericLogic):
         # this is just a guess value, at some point it doesn't make
         # sense anymore to further decrease the number of bins
         max_bin = NN // num_bins
-        count_var = 1
-        bin_list = []
-        temp_list = []
-        signal = self.sum_laserpulse()
-        while count_var <= max_bin:
-            # check if the the first run through loop was done
-            if temp_list:
-                app_arr = np.array(temp_list)
-                bin_list.append(app_arr)
-                temp_list = []
-            jj = 0
-            while jj < NN:
-                sum_ind = np.linspace(jj, jj + count_var - 1, count_var, dtype=np.int)
-                # make sure we don't try to adress not reserved memory
-                jj += count_var
-                if sum_ind[-1] < NN:
-                    # normalize
-                    temp_list.append(np.array([np.sum(signal[sum_ind, 0]), np.sum(signal[sum_ind, 1])]))
-                else:
-                    jj = NN
-            count_var += 1
-
-        return np.array(bin_list)
+        bin_list = [self.get_binning(bin_width) for bin_width in range(1, max_bin)]
+
+        # the binnings have different lengths
+        bin_array = np.empty(len(bin_list), dtype=object)
+        bin_array[:] = bin_list
+        return bin_array
+
+    def get_binning(self, bin_width, normalized=False):
+        """
+        Calculate a single binning of the signal from the cumulative sum of the summed laser pulses.
+        Incomplete bins at the end of the data are dropped.
+        @param int bin_width: number of consecutive rows added up in each bin
+        @param bool normalized: return the normalized signal of the two laser pulses
+        @return numpy array: n_bins x 2 array of the binned laser pulses or 1D array of the
+                             normalized binned signal
+        """
+        cumsum = self._get_binning_cumsum()
+        binning = np.diff(cumsum[::bin_width], axis=0)[:, :2]
+        if normalized:
+            return (binning[:, 0] - binning[:, 1]) / (binning[:, 0] + binning[:, 1])
+        return binning
+
+    def get_binning_analysis(self, bin_width, num_bins=50, normalized=True):
+        """
+        Histogram and threshold analysis of a single binning. The analysis is only done for the
+        requested binning and cached until new data is pulled with get_data.
+        @param int bin_width: number of consecutive rows added up in each bin
+        @param int num_bins: number of bins of the histogram
+        @param bool normalized: analyse the normalized binned signal
+        @return dict: containing the histogram 'hist_x', 'hist_y' as well as 'threshold',
+                      'fidelity' and 'param_dict' of calculate_threshold
+        """
+        key = (bin_width, num_bins, normalized)
+        if key not in self._binning_analysis:
+            binning = self.get_binning(bin_width, normalized=normalized)
+            hist_y_val, hist_x_val = np.histogram(binning, bins=num_bins)
+            hist_data = (hist_x_val, hist_y_val)
+            threshold_fit, fidelity, \
+            param_dict = self._traceanalysis_logic.calculate_threshold(hist_data=hist_data,
+                                                                       distr='gaussian_normalized')
+            self._binning_analysis[key] = {'hist_x': hist_x_val,
+                                           'hist_y': hist_y_val,
+                                           'threshold': threshold_fit,
+                                           'fidelity': fidelity,
+                                           'param_dict': param_dict}
+        return self._binning_analysis[key]
+
+    def _get_binning_cumsum(self):
+        """
+        Cumulative sum of the summed laser pulses along the rows with a leading zero row.
+        Every binning is the difference of every n-th row. Cached until new data is pulled.
+        @return numpy array: (n_rows + 1) x n_laserpulses array
+        """
+        if self._binning_cumsum is None:
+            signal = self.sum_laserpulse()
+            self._binning_cumsum = np.concatenate((np.zeros_like(signal[:1]),
+                                                   np.cumsum(signal, axis=0)))
+        return self._binning_cumsum
 
     def calc_all_binnings_normalized(self, num_bins=100):
         """
@@ -294,19 +335,15 @@ class SingleShotLogic(GenericLogic):
         # what needs to be done here now is the basic evaluation steps like fit, threshold
         # readout fidelity
 
-        bin_list = self.calc_all_binnings(self, num_bins=100)
+        bin_list = self.calc_all_binnings(num_bins=100)
 
         param_dict_list = []
         fidelity_list = []
-        for ii in bin_list:
+        for bin_width in range(1, len(bin_list) + 1):
             # what is a good estimate for the number of bins ?
-            hist_y_val, hist_x_val = np.histogram(ii, bins=50)
-            hist_data = np.array([hist_x_val, hist_y_val])
-            threshold_fit, fidelity, \
-            param_dict = self._traceanalysis_logic.calculate_threshold(hist_data=hist_data,
-                                                                       distr='gaussian_normalized')
-            param_dict_list.append(param_dict)
-            fidelity_list.append(fidelity)
+            analysis = self.get_binning_analysis(bin_width, num_bins=50, normalized=False)
+            param_dict_list.append(analysis['param_dict'])
+            fidelity_list.append(analysis['fidelity'])
 
         # now get the maximum fidelity, not really working up till now. The fidelity alone is not a good indicator
         # because the fit can still be bad. Need somehow a mixed measure of this. Will look for some heuristic.
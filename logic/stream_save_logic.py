@@ -23,9 +23,9 @@ top-level directory of this distribution and at <https://github.com/projecthira/
 """
 
 import datetime
-import inspect
-import logging
+import json
 import os
+import struct
 import time
 
 import matplotlib.pyplot as plt
@@ -36,7 +36,175 @@ from matplotlib.backends.backend_pdf import PdfPages
 
 from core.configoption import ConfigOption
 
-from logic.save_logic import SaveLogic, DailyLogHandler
+from logic.save_logic import SaveLogic, h5py
+
+
+class StreamWriter:
+    """
+    Writer appending rows of a fixed number of columns to a single file, which stays open until
+    close is called. Each write only costs the conversion of the new rows.
+
+    Supported file types:
+        'text': rows are formatted with numpy.savetxt and appended to the (existing) text file
+        'npy':  rows are appended as raw binary data to a .npy file. The header holding the number
+                of rows is rewritten on every flush, so the file is readable at any time.
+                The column labels and parameters are saved in a JSON sidecar file.
+        'hdf5': rows are collected in memory and written into a resizable dataset on every flush
+                or once chunk_size rows are pending. The dataset is enlarged by chunk_size rows
+                whenever it is full and trimmed on close. Needs the optional package h5py.
+    The binary files use the same layout as SaveLogic.save_data and can be read with
+    SaveLogic.load_data.
+
+    Written rows are flushed to disk at the latest flush_interval seconds after the previous flush.
+    """
+    # Fixed size of the .npy header so it can be rewritten in place
+    _npy_header_size = 128
+
+    def __init__(self, file_path, columns, filetype='text', parameters=None, metadata=None,
+                 delimiter='\t', flush_interval=1.0, chunk_size=4096):
+        """
+        @param str file_path: path of the file. For the binary file types the file ending is
+                              replaced with '.npy' (plus '.json' sidecar) or '.h5', respectively.
+        @param list columns: labels of the columns
+        @param str filetype: 'text', 'npy' or 'hdf5'
+        @param dict parameters: optional, parameters saved alongside binary data
+        @param dict metadata: optional, module name, timestamp and POI saved alongside binary data
+        @param str delimiter: optional, column delimiter of text files
+        @param float flush_interval: optional, maximum time in seconds between flushes to disk
+        @param int chunk_size: optional, number of rows the HDF5 dataset is enlarged by
+        """
+        self.columns = list(columns)
+        self.filetype = filetype
+        self.delimiter = delimiter
+        self.flush_interval = float(flush_interval)
+        self.chunk_size = max(int(chunk_size), 1)
+        self.rows = 0
+        self._capacity = 0
+        self._pending_rows = list()
+        self._pending_row_count = 0
+        self._dataset_rows = 0
+        self._last_flush = time.perf_counter()
+        self._file = None
+        self._dataset = None
+
+        label = delimiter.join(self.columns)
+        parameters = dict() if parameters is None else parameters
+        metadata = dict() if metadata is None else metadata
+        base_path = os.path.splitext(file_path)[0]
+        if filetype == 'text':
+            self.file_path = file_path
+            self._file = open(file_path, 'ab')
+        elif filetype == 'npy':
+            self.file_path = base_path + '.npy'
+            self._file = open(self.file_path, 'wb')
+            self._write_npy_header()
+            sidecar = {**metadata,
+                       'parameters': parameters,
+                       'datasets': [{'label': label, 'file': os.path.basename(self.file_path)}]}
+            with open(base_path + '.json', 'w') as file:
+                json.dump(sidecar, file, indent=2, default=SaveLogic._json_default)
+        elif filetype == 'hdf5':
+            self.file_path = base_path + '.h5'
+            self._file = h5py.File(self.file_path, 'w', track_order=True)
+            for key, value in metadata.items():
+                self._file.attrs[key] = value
+            param_group = self._file.create_group('parameters', track_order=True)
+            for key, value in parameters.items():
+                param_group.attrs[str(key)] = json.dumps(value, default=SaveLogic._json_default)
+            self._dataset = self._file.create_group('data').create_dataset(
+                label.replace('/', '|'),
+                shape=(0, len(self.columns)),
+                maxshape=(None, len(self.columns)),
+                chunks=(self.chunk_size, len(self.columns)),
+                dtype='float64')
+            self._dataset.attrs['label'] = label
+        else:
+            raise ValueError('Unknown stream filetype "{0}".'.format(filetype))
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def write_rows(self, rows, fmt='%.15e'):
+        """
+        Appends rows to the file.
+
+        @param numpy.ndarray rows: 2D array with one row per line or a single 1D row
+        @param str fmt: optional, format specifier of text files (see numpy.savetxt)
+        """
+        rows = np.array(rows, dtype='float64', ndmin=2)
+        if rows.shape[1] != len(self.columns):
+            raise ValueError('Rows with {0:d} columns do not fit the stream with {1:d} columns.'
+                             ''.format(rows.shape[1], len(self.columns)))
+        if self.filetype == 'text':
+            np.savetxt(self._file, rows, fmt=fmt, delimiter=self.delimiter)
+        elif self.filetype == 'npy':
+            self._file.write(rows.tobytes())
+        else:
+            # Writing single rows into HDF5 datasets is slow, so rows are written in blocks
+            self._pending_rows.append(rows)
+            self._pending_row_count += len(rows)
+            if self._pending_row_count >= self.chunk_size:
+                self._write_pending_rows()
+        self.rows += len(rows)
+
+        if time.perf_counter() - self._last_flush >= self.flush_interval:
+            self.flush()
+        return
+
+    def flush(self):
+        """
+        Writes all buffered rows to disk.
+        """
+        if self.filetype == 'npy':
+            self._write_npy_header()
+        elif self.filetype == 'hdf5':
+            self._write_pending_rows()
+        self._file.flush()
+        self._last_flush = time.perf_counter()
+        return
+
+    def close(self):
+        """
+        Flushes all rows to disk and closes the file. HDF5 datasets are trimmed to the written rows.
+        """
+        if self._file is None:
+            return
+        self.flush()
+        if self.filetype == 'hdf5':
+            self._dataset.resize(self.rows, axis=0)
+            self._dataset = None
+        self._file.close()
+        self._file = None
+        return
+
+    def _write_pending_rows(self):
+        if self._pending_row_count == 0:
+            return
+        start = self._dataset_rows
+        stop = start + self._pending_row_count
+        if stop > self._capacity:
+            self._capacity = (stop + self.chunk_size) // self.chunk_size * self.chunk_size
+            self._dataset.resize(self._capacity, axis=0)
+        self._dataset[start:stop] = np.concatenate(self._pending_rows)
+        self._pending_rows = list()
+        self._pending_row_count = 0
+        self._dataset_rows = stop
+        return
+
+    def _write_npy_header(self):
+        header = "{{'descr': {0!r}, 'fortran_order': False, 'shape': ({1:d}, {2:d}), }}" \
+                 "".format(np.lib.format.dtype_to_descr(np.dtype('float64')),
+                           self.rows,
+                           len(self.columns))
+        # magic string, version and header length take 10 bytes. The header ends with a newline.
+        header = header.ljust(self._npy_header_size - 11) + '\n'
+        self._file.seek(0)
+        self._file.write(np.lib.format.magic(1, 0))
+        self._file.write(struct.pack('<H', len(header)))
+        self._file.write(header.encode('latin1'))
+        self._file.seek(0, os.SEEK_END)
+        return
 
 
 class StreamSaveLogic(SaveLogic):
@@ -52,11 +220,18 @@ class StreamSaveLogic(SaveLogic):
         log_into_daily_directory: True
         save_pdf: True
         save_png: True
+        stream_filetype: 'text'     # optional, one of 'text', 'npy' or 'hdf5'
+        stream_flush_interval: 1    # optional, maximum time in seconds between flushes to disk
+
+    Files created with create_file_and_header stay open and data passed to write_data is appended
+    by a StreamWriter until close_stream is called or the module is deactivated.
     """
 
     _win_data_dir = ConfigOption('win_data_directory', 'C:/Data/')
     _unix_data_dir = ConfigOption('unix_data_directory', 'Data')
     log_into_daily_directory = ConfigOption('log_into_daily_directory', False, missing='warn')
+    _stream_filetype = ConfigOption('stream_filetype', 'text', missing='nothing')
+    _stream_flush_interval = ConfigOption('stream_flush_interval', 1.0, missing='nothing')
 
     # Matplotlib style definition for saving plots
     mpl_qudihira_style = {
@@ -82,31 +257,26 @@ class StreamSaveLogic(SaveLogic):
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
 
+        # open StreamWriter instances with the full path of the data file as keys
+        self._stream_writers = dict()
+
     def on_activate(self):
         """
         Definition, configuration and initialisation of the SaveLogic.
         """
-        if self.log_into_daily_directory:
-            # adds a log handler for logging into daily directory
-            self._daily_loghandler = DailyLogHandler(
-                '%Y%m%d-%Hh%Mm%Ss-qudi.log', self)
-            self._daily_loghandler.setFormatter(logging.Formatter(
-                '%(asctime)s %(name)s %(levelname)s: %(message)s',
-                datefmt='%Y-%m-%d %H:%M:%S'))
-            self._daily_loghandler.setLevel(logging.DEBUG)
-            logging.getLogger().addHandler(self._daily_loghandler)
-        else:
-            self._daily_loghandler = None
+        super().on_activate()
 
     def on_deactivate(self):
-        if self._daily_loghandler is not None:
-            # removes the log handler logging into the daily directory
-            logging.getLogger().removeHandler(self._daily_loghandler)
+        for writer in self._stream_writers.values():
+            writer.close()
+        self._stream_writers.clear()
+        super().on_deactivate()
 
     def create_file_and_header(self, data, filepath=None, parameters=None, filename=None, filelabel=None,
-                               timestamp=None, fmt='%s', delimiter='\t'):
+                               timestamp=None, fmt='%s', delimiter='\t', filetype=None):
         """
-        General save routine for data.
+        Creates the file for streaming data and opens a StreamWriter for it. The data passed to
+        write_data afterwards is appended to this file.
 
         @param dictionary data: Dictionary containing the data to be saved. The keys should be
                                 strings containing the data header/description. The corresponding
@@ -149,8 +319,6 @@ class StreamSaveLogic(SaveLogic):
                                    fix the timestamp for the filename. Be careful when passing a
                                    filename and a timestamp, because then the timestamp will be
                                    ignored.
-        @param string filetype: optional, the file format the data should be saved in. Valid inputs
-                                are 'text', 'xml' and 'npz'. Default is 'text'.
         @param string or list of strings fmt: optional, format specifier for saved data. See python
                                               documentation for
                                               "Format Specification Mini-Language". If you want for
@@ -165,6 +333,11 @@ class StreamSaveLogic(SaveLogic):
                                               behaviour or failure to save right away.
         @param string delimiter: optional, insert here the delimiter, like '\n' for new line, '\t'
                                  for tab, ',' for a comma ect.
+        @param string filetype: optional, the file format the data should be streamed to. Valid
+                                inputs are 'text', 'npy' and 'hdf5'. Default is the configured
+                                stream_filetype ('text' if not configured).
+
+        @return str: filename to pass to write_data, save_figure and close_stream
 
         1D data
         =======
@@ -199,17 +372,19 @@ class StreamSaveLogic(SaveLogic):
         if timestamp is None:
             timestamp = datetime.datetime.now()
 
+        if filetype is None:
+            filetype = self._stream_filetype
+        if filetype == 'hdf5' and h5py is None:
+            self.log.error('Streaming data to HDF5 file requires the package h5py. Streaming data '
+                           'to npy file instead.')
+            filetype = 'npy'
+        elif filetype not in ('text', 'npy', 'hdf5'):
+            self.log.error('Filetype "{0}" can not be streamed. Streaming data to textfile.'
+                           ''.format(filetype))
+            filetype = 'text'
+
         # try to trace back the functioncall to the class which was calling it.
-        try:
-            frm = inspect.stack()[1]
-            # this will get the object, which called the save_data function.
-            mod = inspect.getmodule(frm[0])
-            # that will extract the name of the class.
-            module_name = mod.__name__.split('.')[-1]
-        except:
-            # Sometimes it is not possible to get the object which called the save_data function
-            # (such as when calling this from the console).
-            module_name = 'UNSPECIFIED'
+        module_name = self._get_caller_module_name()
 
         self.module_name = module_name
 
@@ -263,126 +438,83 @@ class StreamSaveLogic(SaveLogic):
                 header += 'not specified parameters: {0}\n'.format(parameters)
         header += '\nData:\n====='
 
-        self.log.info(f'{module_name} data being streamed to:\n{filepath}\\{filename}')
-        data[0] = "#" + data[0]
-        self.save_array_as_text(data=np.column_stack(data), filename=filename, filepath=filepath,
-                                fmt=fmt, header=header, delimiter=delimiter, comments='#',
-                                append=False)
+        file_path = os.path.join(filepath, filename)
+        self.close_stream(filepath=filepath, filename=filename)
+        if filetype == 'text':
+            columns = list(data)
+            data[0] = "#" + data[0]
+            self.save_array_as_text(data=np.column_stack(data), filename=filename,
+                                    filepath=filepath, fmt=fmt, header=header,
+                                    delimiter=delimiter, comments='#', append=False)
+            writer = StreamWriter(file_path,
+                                  columns=columns,
+                                  filetype='text',
+                                  delimiter=delimiter,
+                                  flush_interval=self._stream_flush_interval)
+        else:
+            if isinstance(parameters, dict):
+                parameter_dict = parameters
+            elif parameters is not None:
+                parameter_dict = {'not specified parameters': str(parameters)}
+            else:
+                parameter_dict = dict()
+            metadata = {'module': module_name,
+                        'timestamp': timestamp.isoformat(),
+                        'poi': self.active_poi_name}
+            writer = StreamWriter(file_path,
+                                  columns=data,
+                                  filetype=filetype,
+                                  parameters=parameter_dict,
+                                  metadata=metadata,
+                                  delimiter=delimiter,
+                                  flush_interval=self._stream_flush_interval)
+        self._stream_writers[file_path] = writer
+        self.log.info(f'{module_name} data being streamed to:\n{writer.file_path}')
         return filename
 
     def write_data(self, data_to_save, header, filename, filepath, fmt='%.15e', filetype='text', delimiter='\t'):
-        # write data to file
-        # FIXME: Implement other file formats
-        # write to textfile
-
-        data = {header: data_to_save}
-
-        # Try to cast data array into numpy.ndarray if it is not already one
-        # Also collect information on arrays in the process and do sanity checks
-        found_1d = False
-        found_2d = False
-        multiple_dtypes = False
-        arr_length = []
-        arr_dtype = []
-        max_row_num = 0
-        max_line_num = 0
-        for keyname in data:
-            # Cast into numpy array
-            if not isinstance(data[keyname], np.ndarray):
-                try:
-                    data[keyname] = np.array(data[keyname])
-                except:
-                    self.log.error('Casting data array of type "{0}" into numpy.ndarray failed. '
-                                   'Could not save data.'.format(type(data[keyname])))
-                    return -1
-
-            # determine dimensions
-            if data[keyname].ndim < 3:
-                length = data[keyname].shape[0]
-                arr_length.append(length)
-                if length > max_line_num:
-                    max_line_num = length
-                if data[keyname].ndim == 2:
-                    found_2d = True
-                    width = data[keyname].shape[1]
-                    if max_row_num < width:
-                        max_row_num = width
-                else:
-                    found_1d = True
-                    max_row_num += 1
-            else:
-                self.log.error('Found data array with dimension >2. Unable to save data.')
-                return -1
-
-            # determine array data types
-            if len(arr_dtype) > 0:
-                if arr_dtype[-1] != data[keyname].dtype:
-                    multiple_dtypes = True
-            arr_dtype.append(data[keyname].dtype)
-
-        # Raise error if data contains a mixture of 1D and 2D arrays
-        if found_2d and found_1d:
-            self.log.error('Passed data dictionary contains 1D AND 2D arrays. This is not allowed. '
-                           'Either fit all data arrays into a single 2D array or pass multiple 1D '
-                           'arrays only. Saving data failed!')
+        """
+        Appends rows to a file created with create_file_and_header. Only the new rows are written.
+
+        @param numpy.ndarray data_to_save: 2D array (or list of 1D rows) with one row per line
+        @param str header: comma separated column labels. Only used if there is no open stream
+                           for the file, which is then opened in append mode as textfile.
+        @param str filename: filename returned by create_file_and_header
+        @param str filepath: path to the directory of the file
+        @param str fmt: optional, format specifier of textfiles (see numpy.savetxt)
+        @param str filetype: optional, ignored. The file type is chosen in create_file_and_header.
+        @param str delimiter: optional, column delimiter if a new text stream has to be opened
+
+        @return int: error code (0:OK, -1:error)
+        """
+        file_path = os.path.join(filepath, filename)
+        writer = self._stream_writers.get(file_path)
+        if writer is None:
+            # File was not created by this module instance, e.g. after a reload of this module
+            writer = StreamWriter(file_path,
+                                  columns=header.split(','),
+                                  filetype='text',
+                                  delimiter=delimiter,
+                                  flush_interval=self._stream_flush_interval)
+            self._stream_writers[file_path] = writer
+        try:
+            writer.write_rows(data_to_save, fmt=fmt)
+        except (ValueError, TypeError) as err:
+            self.log.error('Could not stream data to "{0}":\n{1}'.format(writer.file_path, err))
             return -1
+        return 0
 
-        if filetype == 'text':
-            # Reshape data if multiple 1D arrays have been passed to this method.
-            # If a 2D array has been passed, reformat the specifier
-            if len(data) != 1:
-                identifier_str = ''
-                if multiple_dtypes:
-                    field_dtypes = list(zip(['f{0:d}'.format(i) for i in range(len(arr_dtype))],
-                                            arr_dtype))
-                    new_array = np.empty(max_line_num, dtype=field_dtypes)
-                    for i, keyname in enumerate(data):
-                        identifier_str += keyname + delimiter
-                        field = 'f{0:d}'.format(i)
-                        length = data[keyname].size
-                        new_array[field][:length] = data[keyname]
-                        if length < max_line_num:
-                            if isinstance(data[keyname][0], str):
-                                new_array[field][length:] = 'nan'
-                            else:
-                                new_array[field][length:] = np.nan
-                else:
-                    new_array = np.empty([max_line_num, max_row_num], arr_dtype[0])
-                    for i, keyname in enumerate(data):
-                        identifier_str += keyname + delimiter
-                        length = data[keyname].size
-                        new_array[:length, i] = data[keyname]
-                        if length < max_line_num:
-                            if isinstance(data[keyname][0], str):
-                                new_array[length:, i] = 'nan'
-                            else:
-                                new_array[length:, i] = np.nan
-                # discard old data array and use new one
-                data = {identifier_str: new_array}
-            elif found_2d:
-                keyname = list(data.keys())[0]
-                identifier_str = keyname.replace(', ', delimiter).replace(',', delimiter)
-                data[identifier_str] = data.pop(keyname)
-            else:
-                identifier_str = list(data)[0]
-
-            self.save_array_as_text(data=data[identifier_str], filename=filename, filepath=filepath,
-                                    fmt=fmt, header="", delimiter=delimiter, comments='#',
-                                    append=True)
-
-        # write npz file and save parameters in textfile
-        elif filetype == 'npz':
-            header = str(list(data.keys()))[1:-1]
-            np.savez_compressed(filepath + '/' + filename[:-4], **data)
-            self.save_array_as_text(data=[], filename=filename[:-4] + '_params.dat', filepath=filepath,
-                                    fmt=fmt, header="", delimiter=delimiter, comments='#',
-                                    append=True)
-        else:
-            self.log.error('Only saving of data as textfile and npz-file is implemented. Filetype "{0}" is not '
-                           'supported yet. Saving as textfile.'.format(filetype))
-            self.save_array_as_text(data=data[identifier_str], filename=filename, filepath=filepath,
-                                    fmt=fmt, header=header, delimiter=delimiter, comments='#',
-                                    append=True)
+    def close_stream(self, filepath, filename):
+        """
+        Flushes and closes the stream of a file created with create_file_and_header.
+
+        @param str filepath: path to the directory of the file
+        @param str filename: filename returned by create_file_and_header
+        """
+        writer = self._stream_writers.pop(os.path.join(filepath, filename), None)
+        if writer is not None:
+            writer.close()
+        return
 
     def save_array_as_text(self, data, filename, filepath='', fmt='%.15e', header='',
                            delimiter='\t', comments='#', append=False):
@@ -22,6 +22,8 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 from qtpy import QtCore
 import numpy as np
 import datetime as dt
+import os
+import tempfile
 import time
 import matplotlib.pyplot as plt
 
@@ -31,6 +33,7 @@ from core.configoption import ConfigOption
 from logic.generic_logic import GenericLogic
 from core.util.mutex import Mutex
 from core.util.units import ScaledFloat
+from core.util.buffers import RecordBuffer, RingBuffer
 from interface.data_instream_interface import StreamChannelType, StreamingMode
 
 
@@ -44,6 +47,8 @@ class TimeSeriesReaderLogic(GenericLogic):
         module.Class: 'time_series_reader_logic.TimeSeriesReaderLogic'
         max_frame_rate: 10  # optional (10Hz by default)
         calc_digital_freq: True  # optional (True by default)
+        recording_memory: 100e6  # optional, bytes of recorded data kept in memory (100MB by default)
+        recording_spill_dir: 'C:/Temp'  # optional, directory for recorded data exceeding the memory
         connect:
             _streamer_con: <streamer_name>
             _savelogic_con: <save_logic_name>
@@ -61,6 +66,8 @@ class TimeSeriesReaderLogic(GenericLogic):
     # config options
     _max_frame_rate = ConfigOption('max_frame_rate', default=10, missing='warn')
     _calc_digital_freq = ConfigOption('calc_digital_freq', default=True, missing='warn')
+    _recording_memory = ConfigOption('recording_memory', default=100e6, missing='nothing')
+    _recording_spill_dir = ConfigOption('recording_spill_dir', default=None, missing='nothing')
 
     # status vars
     _trace_window_size = StatusVar('trace_window_size', default=6)
@@ -83,11 +90,11 @@ class TimeSeriesReaderLogic(GenericLogic):
         self._samples_per_frame = None
         self._stop_requested = True
 
-        # Data arrays
+        # Data buffers
+        self._read_buffer = None
         self._trace_data = None
         self._trace_times = None
         self._trace_data_averaged = None
-        self.__moving_filter = None
 
         # for data recording
         self._recorded_data = None
@@ -154,6 +161,9 @@ class TimeSeriesReaderLogic(GenericLogic):
             self._stop_reader_wait()
 
         self._sigNextDataFrame.disconnect()
+        if self._recorded_data is not None:
+            self._recorded_data.close()
+            self._recorded_data = None
 
         # Save status vars
         self._active_channels = self.active_channel_names
@@ -162,12 +172,39 @@ class TimeSeriesReaderLogic(GenericLogic):
 
     def _init_data_arrays(self):
         window_size = self.trace_window_size_samples
-        self._trace_data = np.zeros(
-            [self.number_of_active_channels, window_size + self._moving_average_width // 2])
-        self._trace_data_averaged = np.zeros(
-            [len(self._averaged_channels), window_size - self._moving_average_width // 2])
+        self._trace_data = RingBuffer(window_size + self._moving_average_width // 2,
+                                      channels=self.number_of_active_channels)
+        self._trace_data_averaged = RingBuffer(window_size - self._moving_average_width // 2,
+                                               channels=len(self._averaged_channels))
         self._trace_times = np.arange(window_size) / self.data_rate
-        self._recorded_data = list()
+        # The streamer reads the samples of each frame directly into this preallocated buffer.
+        # Samples not fitting in are read with the next frame.
+        samples_per_read = max(self._samples_per_frame, self._trace_data.size)
+        self._read_buffer = np.empty(
+            self.number_of_active_channels * samples_per_read * self._oversampling_factor,
+            dtype=self._streamer.data_type)
+        self._reset_recorded_data()
+        return
+
+    def _reset_recorded_data(self):
+        """
+        Discards all recorded data. The recorded samples are kept in memory up to the size given by
+        the ConfigOption recording_memory and moved to a temporary file beyond that.
+        """
+        if self._recorded_data is not None:
+            self._recorded_data.close()
+        spill_dir = self._recording_spill_dir
+        if spill_dir is None:
+            spill_dir = tempfile.gettempdir()
+        os.makedirs(spill_dir, exist_ok=True)
+        spill_fd, spill_path = tempfile.mkstemp(suffix='.raw', prefix='time_series_', dir=spill_dir)
+        os.close(spill_fd)
+        # chunks of about 1MB
+        chunk_size = max(2 ** 17 // max(self.number_of_active_channels, 1), 1)
+        self._recorded_data = RecordBuffer(width=self.number_of_active_channels,
+                                           chunk_size=chunk_size,
+                                           spill_path=spill_path,
+                                           max_memory=int(self._recording_memory))
         return
 
     @property
@@ -279,18 +316,27 @@ class TimeSeriesReaderLogic(GenericLogic):
 
     @property
     def trace_data(self):
-        data_offset = self._trace_data.shape[1] - self._moving_average_width // 2
-        data = {ch: self._trace_data[i, :data_offset] for i, ch in
-                enumerate(self.active_channel_names)}
+        """
+        Time trace of all active channels. The data arrays are views on the trace ring buffer and
+        are overwritten by the following data frames, so copy them if they are kept.
+        """
+        data_offset = self._trace_data.size - self._moving_average_width // 2
+        trace = self._trace_data.data
+        data = {ch: trace[i, :data_offset] for i, ch in enumerate(self.active_channel_names)}
         return self._trace_times, data
 
     @property
     def averaged_trace_data(self):
+        """
+        Moving average of the time trace of all averaged channels. The data arrays are views on the
+        averaged trace ring buffer and are overwritten by the following data frames, so copy them
+        if they are kept.
+        """
         if not self.averaged_channel_names or self.moving_average_width <= 1:
             return None, None
-        data = {ch: self._trace_data_averaged[i] for i, ch in
-                enumerate(self.averaged_channel_names)}
-        return self._trace_times[-self._trace_data_averaged.shape[1]:], data
+        averaged_trace = self._trace_data_averaged.data
+        data = {ch: averaged_trace[i] for i, ch in enumerate(self.averaged_channel_names)}
+        return self._trace_times[-self._trace_data_averaged.size:], data
 
     @property
     def all_settings(self):
@@ -373,8 +419,6 @@ class TimeSeriesReaderLogic(GenericLogic):
                 if new_val / data_rate > self.trace_window_size:
                     if 'data_rate' in settings_dict or 'trace_window_size' in settings_dict:
                         self._moving_average_width = new_val
-                        self.__moving_filter = np.full(shape=self.moving_average_width,
-                                                       fill_value=1.0 / self.moving_average_width)
                     else:
                         self.log.warning('Moving average width to set ({0:d}) is smaller than the '
                                          'trace window size. Will adjust trace window size to '
@@ -382,8 +426,6 @@ class TimeSeriesReaderLogic(GenericLogic):
                         self._trace_window_size = float(new_val / data_rate)
                 else:
                     self._moving_average_width = new_val
-                    self.__moving_filter = np.full(shape=self.moving_average_width,
-                                                   fill_value=1.0 / self.moving_average_width)
 
             if 'data_rate' in settings_dict:
                 new_val = float(settings_dict['data_rate'])
@@ -463,7 +505,7 @@ class TimeSeriesReaderLogic(GenericLogic):
             settings = self.all_settings
             self.sigSettingsChanged.emit(settings)
             if not restart:
-                self.sigDataChanged.emit(*self.trace_data, *self.averaged_trace_data)
+                self._emit_data_snapshot()
         if restart:
             self.start_reading()
         return settings
@@ -506,7 +548,7 @@ class TimeSeriesReaderLogic(GenericLogic):
 
             if self._data_recording_active:
                 self._record_start_time = dt.datetime.now()
-                self._recorded_data = list()
+                self._reset_recorded_data()
 
             if self._streamer.start_stream() < 0:
                 self.log.error('Error while starting streaming device data acquisition.')
@@ -546,7 +588,7 @@ class TimeSeriesReaderLogic(GenericLogic):
                             'Error while trying to stop streaming device data acquisition.')
                     if self._data_recording_active:
                         self._save_recorded_data(to_file=True, save_figure=True)
-                        self._recorded_data = list()
+                        self._reset_recorded_data()
                     self._data_recording_active = False
                     self.module_state.unlock()
                     self.sigStatusChanged.emit(False, False)
@@ -558,24 +600,43 @@ class TimeSeriesReaderLogic(GenericLogic):
                 if samples_to_read < 1:
                     self._sigNextDataFrame.emit()
                     return
+                samples_to_read = min(samples_to_read,
+                                      self._read_buffer.size // self.number_of_active_channels)
 
-                # read the current counter values
-                data = self._streamer.read_data(number_of_samples=samples_to_read)
-                if data.shape[1] != samples_to_read:
+                # read the current counter values into the preallocated read buffer
+                samples_read = self._streamer.read_data_into_buffer(
+                    self._read_buffer, number_of_samples=samples_to_read)
+                if samples_read != samples_to_read:
                     self.log.error('Reading data from streamer went wrong; '
                                    'killing the stream with next data frame.')
                     self._stop_requested = True
                     self._sigNextDataFrame.emit()
                     return
+                data = self._read_buffer[:self.number_of_active_channels * samples_read].reshape(
+                    (self.number_of_active_channels, samples_read))
 
                 # Process data
                 self._process_trace_data(data)
 
                 # Emit update signal
-                self.sigDataChanged.emit(*self.trace_data, *self.averaged_trace_data)
+                self._emit_data_snapshot()
                 self._sigNextDataFrame.emit()
         return
 
+    def _emit_data_snapshot(self):
+        """
+        Emits sigDataChanged with copies of the current trace data. The trace and averaged trace
+        properties return views on the ring buffers, which are overwritten by the following data
+        frames before a queued receiver might have used them.
+        """
+        data_time, data = self.trace_data
+        smooth_time, smooth_data = self.averaged_trace_data
+        data = {ch: arr.copy() for ch, arr in data.items()}
+        if smooth_data is not None:
+            smooth_data = {ch: arr.copy() for ch, arr in smooth_data.items()}
+        self.sigDataChanged.emit(data_time, data, smooth_time, smooth_data)
+        return
+
     def _process_trace_data(self, data):
         """
         Processes raw data from the streaming device
@@ -599,25 +660,25 @@ class TimeSeriesReaderLogic(GenericLogic):
 
         # Append data to save if necessary
         if self._data_recording_active:
-            self._recorded_data.append(data.copy())
+            self._recorded_data.extend(data.transpose())
 
-        data = data[:, -self._trace_data.shape[1]:]
+        data = data[:, -self._trace_data.size:]
         new_samples = data.shape[1]
 
-        # Roll data array to have a continuously running time trace
-        self._trace_data = np.roll(self._trace_data, -new_samples, axis=1)
-        # Insert new data
-        self._trace_data[:, -new_samples:] = data
+        # Insert new data into the ring buffer to have a continuously running time trace
+        self._trace_data.append(data)
 
-        # Calculate moving average by using numpy.convolve with a normalized uniform filter
+        # Calculate the moving average of the new samples from the cumulative sum
         if self.moving_average_width > 1 and self.averaged_channel_names:
-            # Only convolve the new data and roll the previously calculated moving average
-            self._trace_data_averaged = np.roll(self._trace_data_averaged, -new_samples, axis=1)
-            offset = new_samples + len(self.__moving_filter) - 1
-            for i, ch in enumerate(self.averaged_channel_names):
-                data_index = self.active_channel_names.index(ch)
-                self._trace_data_averaged[i, -new_samples:] = np.convolve(
-                    self._trace_data[data_index, -offset:], self.__moving_filter, mode='valid')
+            width = self.moving_average_width
+            new_averages = min(new_samples, self._trace_data_averaged.size)
+            channel_indices = [self.active_channel_names.index(ch) for ch in
+                               self.averaged_channel_names]
+            samples = self._trace_data.data[channel_indices, -(new_averages + width - 1):]
+            cumulative_sum = np.zeros((samples.shape[0], samples.shape[1] + 1))
+            np.cumsum(samples, axis=1, out=cumulative_sum[:, 1:])
+            self._trace_data_averaged.append(
+                (cumulative_sum[:, width:] - cumulative_sum[:, :-width]) / width)
         return
 
     @QtCore.Slot()
@@ -635,7 +696,7 @@ class TimeSeriesReaderLogic(GenericLogic):
 
             self._data_recording_active = True
             if self.module_state() == 'locked':
-                self._recorded_data = list()
+                self._reset_recorded_data()
                 self._record_start_time = dt.datetime.now()
                 self.sigStatusChanged.emit(True, True)
             else:
@@ -658,7 +719,7 @@ class TimeSeriesReaderLogic(GenericLogic):
             self._data_recording_active = False
             if self.module_state() == 'locked':
                 self._save_recorded_data(to_file=True, save_figure=True)
-                self._recorded_data = list()
+                self._reset_recorded_data()
                 self.sigStatusChanged.emit(True, False)
         return 0
 
@@ -671,17 +732,15 @@ class TimeSeriesReaderLogic(GenericLogic):
 
         @return dict parameters: Dictionary which contains the saving parameters
         """
-        if not self._recorded_data:
+        if len(self._recorded_data) == 0:
             self.log.error('No data has been recorded. Save to file failed.')
             return np.empty(0), dict()
 
-        data_arr = np.concatenate(self._recorded_data, axis=1)
-        if data_arr.size == 0:
-            self.log.error('No data has been recorded. Save to file failed.')
-            return np.empty(0), dict()
+        # All recorded samples (samples x channels), memory-mapped if exceeding recording_memory
+        data_arr = self._recorded_data.finalize()
 
         saving_stop_time = self._record_start_time + dt.timedelta(
-            seconds=data_arr.shape[1] / self.data_rate)
+            seconds=data_arr.shape[0] / self.data_rate)
 
         # write the parameters:
         parameters = dict()
@@ -700,7 +759,7 @@ class TimeSeriesReaderLogic(GenericLogic):
             header = ', '.join(
                 '{0} ({1})'.format(ch, unit) for ch, unit in self.active_channel_units.items())
 
-            data = {header: data_arr.transpose()}
+            data = {header: data_arr}
             filepath = self._savelogic.get_path_for_module(module_name='TimeSeriesReader')
             set_of_units = set(self.active_channel_units.values())
             unit_list = tuple(self.active_channel_units)
@@ -712,7 +771,10 @@ class TimeSeriesReaderLogic(GenericLogic):
                     occurrences = count
                     y_unit = unit
 
-            fig = self._draw_figure(data_arr, self.data_rate, y_unit) if save_figure else None
+            if save_figure:
+                fig = self._draw_figure(data_arr.transpose(), self.data_rate, y_unit)
+            else:
+                fig = None
 
             self._savelogic.save_data(data=data,
                                       filepath=filepath,
@@ -722,7 +784,7 @@ class TimeSeriesReaderLogic(GenericLogic):
                                       delimiter='\t',
                                       timestamp=saving_stop_time)
             self.log.info('Time series saved to: {0}'.format(filepath))
-        return data_arr, parameters
+        return data_arr.transpose(), parameters
 
     def _draw_figure(self, data, timebase, y_unit):
         """ Draw figure to save with data file.
@@ -736,7 +798,10 @@ class TimeSeriesReaderLogic(GenericLogic):
 
         # Create figure and scale data
         max_abs_value = ScaledFloat(max(data.max(), np.abs(data.min())))
-        time_data = np.arange(data.shape[1]) / timebase
+        # Plot at most about 1e6 samples per channel to limit memory usage for long recordings
+        step = max(data.shape[1] // 1000000, 1)
+        data = data[:, ::step]
+        time_data = np.arange(0, step * data.shape[1], step) / timebase
         fig, ax = plt.subplots()
         if max_abs_value.scale:
             ax.plot(time_data,
@@ -774,8 +839,8 @@ class TimeSeriesReaderLogic(GenericLogic):
 
             header = ', '.join(
                 '{0} ({1})'.format(ch, unit) for ch, unit in self.active_channel_units.items())
-            data_offset = self._trace_data.shape[1] - self.moving_average_width // 2
-            data = {header: self._trace_data[:, :data_offset].transpose()}
+            data_offset = self._trace_data.size - self.moving_average_width // 2
+            data = {header: self._trace_data.data[:, :data_offset].transpose()}
 
             if to_file:
                 filepath = self._savelogic.get_path_for_module(module_name='TimeSeriesReader')
@@ -807,7 +872,7 @@ class TimeSeriesReaderLogic(GenericLogic):
                     'Error while trying to stop streaming device data acquisition.')
             if self._data_recording_active:
                 self._save_recorded_data(to_file=True, save_figure=True)
-                self._recorded_data = list()
+                self._reset_recorded_data()
             self._data_recording_active = False
             self.module_state.unlock()
             self.sigStatusChanged.emit(False, False)
@@ -483,95 +483,49 @@ class TraceAnalysisLogic(GenericLogic):
         return hist_fit_x, hist_fit_y, param_dict, fit_result
 
     def analyze_lifetime(self, trace, dt, method='postselect',
-                         distr='gaussian_normalized', state='|-1>', num_bins=50):
+                         distr='gaussian_normalized', state='|-1>', num_bins=50, threshold=None,
+                         chunk_size=2 ** 22):
         """ Perform an lifetime analysis of a 1D time trace. The analysis is
             based on the method provided ( for now only post select is implemented ).
-        @param numpy array trace: 1 D array
+        @param numpy array trace: 1 D array, can be a memmap of a trace larger than the memory.
+                                  An iterable of 1D array chunks is accepted if the threshold is
+                                  given.
+        @param float dt: time between two trace points in s
         @param string method: The method used for the lifetime analysis
         @param string distr: distribution used for analysis
         @param string state: State that the mw was applied to
         @param int num_bins: number of bins used in the histogram to determine the threshold before digitalisation
                              of data
+        @param float threshold: optional, threshold for the digitalisation. Determined from the
+                                histogram of the trace if None.
+        @param int chunk_size: number of trace points processed at once
         @return: dictionary containing the lifetimes of the different states |0>, |1>, |-1> in the case of the HMM method
                  For the postselect method only lifetime for bright and darkstate is returned, keys are 'bright_state' and
-                 'dark_state'
+                 'dark_state'. The dwell times in s are returned with the keys 'bright_times' and
+                 'dark_times' and their histograms (counts, bin edges) with the keys
+                 'bright_hist' and 'dark_hist'.
         """
         lifetime_dict = {}
 
         if method == 'postselect':
-            if distr == 'gaussian_normalized':
-                hist_y_val, hist_x_val = np.histogram(trace, num_bins)
+            if threshold is None and distr == 'gaussian_normalized':
+                hist_y_val, hist_x_val = self._calculate_chunked_histogram(trace, num_bins,
+                                                                           chunk_size)
                 hist_data = np.array([hist_x_val, hist_y_val])
                 threshold_fit, fidelity, param_dict = self.calculate_threshold(hist_data=hist_data,
                                                                                distr='gaussian_normalized')
                 threshold = threshold_fit
+            self.log.debug('threshold {0}'.format(threshold))
 
-            # helper functions to get and analyze the timetrace
-            def analog_digitial_converter(cut_off, data):
-                new_digital_trace = []
-                for data_point in data:
-                    if data_point >= cut_off:
-                        new_digital_trace.append(1)
-                    else:
-                        new_digital_trace.append(0)
-                return new_digital_trace
-
-            def time_in_high_low(raw_digital_trace, local_dt):
-                """
-                What I need this function to do is to get all consecutive {1, ... , n} 1s or 0s and add
-                them up and put into a list to later make a histogram from them.
-                """
-                occurances = []
-                index = 0
-                index2 = 0
-
-                while index < len(raw_digital_trace):
-                    occurances.append(0)
-                    # start following the consecutive 1s
-                    while raw_digital_trace[index] == 1:
-                        occurances[index2] += 1
-                        if index == (len(raw_digital_trace) - 1):
-                            occurances = np.array(occurances)
-                            return occurances * local_dt
-                        else:
-                            index += 1
-                    if raw_digital_trace[index - 1] == 1:
-                        index2 += 1
-                        occurances.append(0)
-                    # start following the consecutive 0s
-                    while raw_digital_trace[index] == 0:
-                        occurances[index2] -= 1
-                        if index == (len(raw_digital_trace) - 1):
-                            occurances = np.array(occurances)
-                            return occurances * local_dt
-                        else:
-                            index += 1
-                    index2 += 1
-
-            digital_trace = analog_digitial_converter(threshold, trace)
-            time_array = time_in_high_low(digital_trace, dt)
-
-            # now we need to make a histogram as well as a fit
-            # what would be a good estimate for the number of bins
-
-            # longest = np.max(np.array(occurances))
-            # number of steps in between, rather not use that for now
-            # est_bins = np.int(longest/dt)
-
-            time_array_high = np.array([ii for ii in filter(lambda x: x > 0, time_array)])
-            time_array_low = np.array([ii for ii in filter(lambda x: x < 0, time_array)])
+            time_array_high, time_array_low = self.calculate_dwell_times(trace, threshold, dt,
+                                                                         chunk_size)
+            lifetime_dict['bright_times'] = time_array_high
+            lifetime_dict['dark_times'] = time_array_low
 
             # get lifetime of bright state
             time_hist_high = np.histogram(time_array_high, bins=num_bins)
-            vals = [i for i in filter(lambda x: x[1] > 0, enumerate(time_hist_high[0][0:num_bins]))]
-
-            indices = np.array([val[0] for val in vals])
-            indices = np.array([np.int(indice) for indice in indices])
-            self.log.debug('threshold {0}'.format(threshold))
-            self.log.debug('time_array:{0}'.format(time_array))
-            self.log.debug('time_array_high:{0}'.format(time_array_high))
-            self.log.debug('time_hist_high:{0}'.format(time_hist_high))
-            self.log.debug('indices: {0}'.format(indices))
+            lifetime_dict['bright_hist'] = time_hist_high
+            indices = np.flatnonzero(time_hist_high[0] > 0)
             self.debug_lifetime_x = time_hist_high[1][indices]
             self.debug_lifetime_y = time_hist_high[0][indices]
             para = dict()
@@ -586,12 +540,11 @@ class TraceAnalysisLogic(GenericLogic):
             # also give back the data used for the fit
             lifetime_dict['bright_raw'] = np.array([time_hist_high[1][indices], time_hist_high[0][indices]])
 
-            # get lifetime of dark state
-            time_hist_low = np.histogram(time_array_low, bins=num_bins)
-            vals = [i for i in filter(lambda x: x[1] > 0, enumerate(time_hist_low[0][0:num_bins]))]
-            indices = np.array([val[0] for val in vals])
-            indices = np.array([np.int(indice) for indice in indices])
-            values = np.array([val[1] for val in vals])
+            # get lifetime of dark state. The histogram is calculated on the negative time axis.
+            time_hist_low = np.histogram(-time_array_low, bins=num_bins)
+            lifetime_dict['dark_hist'] = time_hist_low
+            indices = np.flatnonzero(time_hist_low[0] > 0)
+            values = time_hist_low[0][indices]
             # positive axis
             mirror_axis = -time_hist_low[1][indices]
             result = self._fit_logic.make_decayexponential_fit(mirror_axis,
@@ -608,6 +561,70 @@ class TraceAnalysisLogic(GenericLogic):
 
         return lifetime_dict
 
+    def calculate_dwell_times(self, trace, threshold, dt=1, chunk_size=2 ** 22):
+        """ Digitize a trace with a threshold and calculate the durations of all consecutive runs
+            of points above or equal (bright) and below (dark) the threshold. The runs at the
+            start and the end of the trace are included.
+        @param np.array trace: 1D array, can be a memmap of a trace larger than the memory.
+                               Alternatively an iterable of consecutive 1D array chunks.
+        @param float threshold: points greater or equal the threshold are bright
+        @param float dt: time between two trace points in s
+        @param int chunk_size: number of trace points processed at once if trace is an array
+        @return tuple(np.array, np.array): durations of the bright and the dark runs in s
+        """
+        if isinstance(trace, np.ndarray):
+            chunks = (trace[start:start + chunk_size] for start in range(0, len(trace), chunk_size))
+        else:
+            chunks = trace
+
+        bright_runs = list()
+        dark_runs = list()
+        # run that may continue in the next chunk
+        open_state = None
+        open_length = 0
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            bright = np.asarray(chunk) >= threshold
+            # run-length encoding of the chunk
+            changes = np.flatnonzero(bright[1:] != bright[:-1]) + 1
+            run_states = bright[np.concatenate(([0], changes))]
+            run_lengths = np.diff(np.concatenate(([0], changes, [len(bright)])))
+            if open_state == run_states[0]:
+                run_lengths[0] += open_length
+            elif open_state is not None:
+                run_states = np.concatenate(([open_state], run_states))
+                run_lengths = np.concatenate(([open_length], run_lengths))
+            bright_runs.append(run_lengths[:-1][run_states[:-1]])
+            dark_runs.append(run_lengths[:-1][~run_states[:-1]])
+            open_state = run_states[-1]
+            open_length = run_lengths[-1]
+        if open_state is not None:
+            (bright_runs if open_state else dark_runs).append(np.array([open_length]))
+
+        bright_times = np.concatenate(bright_runs) * dt if bright_runs else np.zeros(0)
+        dark_times = np.concatenate(dark_runs) * dt if dark_runs else np.zeros(0)
+        return bright_times, dark_times
+
+    def _calculate_chunked_histogram(self, trace, num_bins, chunk_size=2 ** 22):
+        """ Histogram of a trace calculated in chunks with equal bins over the full trace range.
+            The result is identical to np.histogram(trace, num_bins).
+        @param np.array trace: 1D array, can be a memmap of a trace larger than the memory
+        @param int num_bins: number of bins
+        @param int chunk_size: number of trace points processed at once
+        @return tuple(np.array, np.array): counts and bin edges
+        """
+        chunk_starts = range(0, len(trace), chunk_size)
+        trace_min = min(trace[start:start + chunk_size].min() for start in chunk_starts)
+        trace_max = max(trace[start:start + chunk_size].max() for start in chunk_starts)
+        counts = np.zeros(num_bins, dtype='int64')
+        for start in chunk_starts:
+            chunk_counts, bin_edges = np.histogram(trace[start:start + chunk_size],
+                                                   bins=num_bins,
+                                                   range=(trace_min, trace_max))
+            counts += chunk_counts
+        return counts, bin_edges
+
     def do_gaussian_fit(self, axis, data):
         """ Perform a gaussian fit.
         @param axis:
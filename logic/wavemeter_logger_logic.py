@@ -31,6 +31,7 @@ import matplotlib.pyplot as plt
 
 from core.connector import Connector
 from core.configoption import ConfigOption
+from core.util.buffers import RecordBuffer
 from logic.generic_logic import GenericLogic
 from core.util.mutex import Mutex
 
@@ -125,6 +126,8 @@ class WavemeterLoggerLogic(GenericLogic):
         self._acqusition_start_time = 0
         self._bins = 200
         self._data_index = 0
+        # (time, wavelength, interpolated counts, interpolation final) of all processed wavelengths
+        self._stitched_data = RecordBuffer(width=4)
 
         self._recent_wavelength_window = [0, 0]
         self.counts_with_wavelength = []
@@ -298,7 +301,8 @@ class WavemeterLoggerLogic(GenericLogic):
             self._acqusition_start_time = self._counter_logic._saving_start_time
             self._wavelength_data = []
 
-            self.data_index = 0
+            self._data_index = 0
+            self._stitched_data = RecordBuffer(width=4)
 
             self._recent_wavelength_window = [0, 0]
             self.counts_with_wavelength = []
@@ -409,7 +413,6 @@ class WavemeterLoggerLogic(GenericLogic):
         # There is no need to recompute the interpolation for the stitched data.
         if complete_histogram:
             count_window = len(self._counter_logic._data_to_save)
-            self._data_index = 0
             self.log.info('Recalcutating Laser Scanning Histogram for: '
                           '{0:d} counts and {1:d} wavelength.'.format(
                               count_window,
@@ -429,41 +432,73 @@ class WavemeterLoggerLogic(GenericLogic):
         # only do something if there is wavelength data to work with
         if len(self._wavelength_data) > 0:
 
-            for i in self._wavelength_data[self._data_index:]:
-                self._data_index += 1
-
-                if i[1] < self._xmin or i[1] > self._xmax:
-                    continue
-
-                # calculate the bin the new wavelength needs to go in
-                newbin = np.digitize([i[1]], self.histogram_axis)[0]
-                # if the bin make no sense, start from the beginning
-                if newbin > len(self.rawhisto) - 1:
-                    continue
-
-                # sum the counts in rawhisto and count the occurence of the bin in sumhisto
-                interpolation = np.interp(i[0], xp=temp[:, 0], fp=temp[:, 1])
-                self.rawhisto[newbin] += interpolation
-                self.sumhisto[newbin] += 1.0
-
-                self.envelope_histogram[newbin] = np.max([interpolation,
-                                                          self.envelope_histogram[newbin]
-                                                          ])
-
-                datapoint = [i[1], i[0], interpolation]
-                if time.time() - self.last_point_time > 1:
-                    self.sig_new_data_point.emit(self.recent_avg)
-                    self.last_point_time = time.time()
-                    self.recent_count = 0
-                else:
-                    self.recent_count += 1
-                    for j in range(3):
-                        self.recent_avg[j] -= self.recent_avg[j] / self.recent_count
-                        self.recent_avg[j] += datapoint[j] / self.recent_count
+            if complete_histogram:
+                # rebin the already interpolated wavelengths, only interpolations that were
+                # limited by the available count data are calculated again
+                stitched_data = np.array(self._stitched_data)
+                not_final = stitched_data[:, 3] == 0
+                stitched_data[not_final] = self._stitch_counts(stitched_data[not_final, :2], temp)
+                self._stitched_data = RecordBuffer(width=4)
+                self._stitched_data.extend(stitched_data)
+                self._add_to_histogram(stitched_data)
+
+            new_data = np.array(self._wavelength_data[self._data_index:]).reshape(-1, 2)
+            self._data_index += len(new_data)
+            stitched_data = self._stitch_counts(new_data, temp)
+            self._stitched_data.extend(stitched_data)
+            self._add_to_histogram(stitched_data)
 
             # the plot data is the summed counts divided by the occurence of the respective bins
             self.histogram = self.rawhisto / self.sumhisto
 
+    def _stitch_counts(self, wavelength_data, count_data):
+        """ Interpolate the counts at the times of the wavelength values.
+
+        @param numpy.ndarray wavelength_data: N x 2 array of time and wavelength
+        @param numpy.ndarray count_data: M x 2 array of time and counts
+        @return numpy.ndarray: N x 4 array of time, wavelength, interpolated counts and whether the
+                               time is within the count data, so the interpolation is final
+        """
+        times = wavelength_data[:, 0]
+        counts = np.interp(times, xp=count_data[:, 0], fp=count_data[:, 1])
+        final = (times >= count_data[0, 0]) & (times <= count_data[-1, 0])
+        return np.column_stack((times, wavelength_data[:, 1], counts, final))
+
+    def _add_to_histogram(self, stitched_data):
+        """ Add interpolated counts to the histogram bins of their wavelengths.
+
+        @param numpy.ndarray stitched_data: N x 4 array as returned by _stitch_counts
+        """
+        times, wavelengths, counts = stitched_data[:, 0], stitched_data[:, 1], stitched_data[:, 2]
+
+        # calculate the bins the new wavelengths need to go in
+        bins = np.digitize(wavelengths, self.histogram_axis)
+        # ignore wavelengths outside the range and bins that make no sense
+        valid = (wavelengths >= self._xmin) & (wavelengths <= self._xmax)
+        valid &= bins <= len(self.rawhisto) - 1
+        if not np.any(valid):
+            return
+        bins = bins[valid]
+        counts = counts[valid]
+
+        # sum the counts in rawhisto and count the occurence of the bin in sumhisto
+        np.add.at(self.rawhisto, bins, counts)
+        np.add.at(self.sumhisto, bins, 1.0)
+        np.maximum.at(self.envelope_histogram, bins, counts)
+
+        # running average of the (wavelength, time, counts) datapoints since the last signal
+        datapoints = np.column_stack((wavelengths[valid], times[valid], counts))
+        if time.time() - self.last_point_time > 1:
+            self.sig_new_data_point.emit(self.recent_avg)
+            self.last_point_time = time.time()
+            self.recent_count = 0
+            datapoints = datapoints[1:]
+        if len(datapoints) > 0:
+            new_count = self.recent_count + len(datapoints)
+            self.recent_avg = list((np.array(self.recent_avg) * self.recent_count +
+                                    np.sum(datapoints, axis=0)) / new_count)
+            self.recent_count = new_count
+
     def save_data(self, timestamp=None):
         """ Save the counter trace data and writes it to a file.
 